@@ -0,0 +1,11 @@
+from .common import compare_results, load_results, save_results
+from .synthetic import SAM_VARIANTS, build_synthetic_sam, create_synthetic_image
+
+__all__ = [
+    "compare_results",
+    "load_results",
+    "save_results",
+    "SAM_VARIANTS",
+    "build_synthetic_sam",
+    "create_synthetic_image",
+]
@@ -0,0 +1,151 @@
+import argparse
+import sys
+
+import torch
+
+from .common import compare_results, get_environment_info, load_results, save_results
+from .sam_bench import run_benchmark, run_benchmark_isolated
+from .synthetic import IMAGE_SIZES, SAM_VARIANTS
+
+
+def run(args):
+    device = torch.device(args.device)
+    cases = []
+    for variant in args.variants:
+        if "model_size" in args.benches:
+            cases.append(("model_size", dict(variant=variant)))
+        if "encoder" in args.benches:
+            cases.append(("encoder", dict(variant=variant, device=args.device, warmup=args.warmup, repeat=args.repeat,
+                                          checkpoint_dir=args.checkpoint_dir)))
+        if "attention" in args.benches:
+            for backend in args.attn_backends:
+                cases.append(("attention", dict(variant=variant, device=args.device, backend=backend, warmup=args.warmup,
+                                                repeat=args.repeat, checkpoint_dir=args.checkpoint_dir)))
+        if "shared_weights" in args.benches:
+            cases.append(("shared_weights", dict(variant=variant, device=args.device, checkpoint_dir=args.checkpoint_dir)))
+        if "channels_last" in args.benches:
+            cases.append(("channels_last", dict(variant=variant, device=args.device, points_per_batch=max(args.points_per_batch),
+                                                warmup=args.warmup, repeat=args.repeat, checkpoint_dir=args.checkpoint_dir)))
+        if "compile" in args.benches:
+            for mode in args.compile_modes:
+                cases.append(("compile", dict(variant=variant, device=args.device, mode=mode, repeat=args.repeat,
+                                              checkpoint_dir=args.checkpoint_dir)))
+        for image_size in args.sizes:
+            if "decoder" in args.benches:
+                cases.append(("decoder", dict(variant=variant, device=args.device, image_size=image_size,
+                                              points_per_batch=args.points_per_batch, warmup=args.warmup, repeat=args.repeat,
+                                              checkpoint_dir=args.checkpoint_dir)))
+            if "generate" in args.benches:
+                cases.append(("generate", dict(variant=variant, device=args.device, image_size=image_size,
+                                               points_per_side=args.points_per_side, points_per_batch=max(args.points_per_batch),
+                                               checkpoint_dir=args.checkpoint_dir)))
+            if "precision" in args.benches:
+                cases.append(("precision", dict(variant=variant, device=args.device, image_size=image_size, precisions=args.precisions,
+                                                warmup=args.warmup, repeat=args.repeat, checkpoint_dir=args.checkpoint_dir)))
+            if "rectangular" in args.benches:
+                cases.append(("rectangular", dict(variant=variant, device=args.device, image_size=image_size,
+                                                  aspect_ratios=args.aspect_ratios, warmup=args.warmup, repeat=args.repeat,
+                                                  checkpoint_dir=args.checkpoint_dir)))
+            if "token_merging" in args.benches:
+                cases.append(("token_merging", dict(variant=variant, device=args.device, image_size=image_size,
+                                                    ratios=args.tome_ratios, warmup=args.warmup, repeat=args.repeat,
+                                                    checkpoint_dir=args.checkpoint_dir)))
+            if "backend" in args.benches:
+                cases.append(("backend", dict(variant=variant, image_size=image_size, backends=args.backends,
+                                              num_threads=args.onnx_threads, warmup=args.warmup, repeat=args.repeat,
+                                              checkpoint_dir=args.checkpoint_dir)))
+            if "mask_file" in args.benches:
+                cases.append(("mask_file", dict(variant=variant, device=args.device, image_size=image_size, num_masks=args.num_masks,
+                                                points_per_side=args.points_per_side, points_per_batch=max(args.points_per_batch),
+                                                checkpoint_dir=args.checkpoint_dir)))
+            if "mask_candidates" in args.benches:
+                cases.append(("mask_candidates", dict(variant=variant, device=args.device, image_size=image_size,
+                                                      points_per_side=args.points_per_side, points_per_batch=max(args.points_per_batch),
+                                                      checkpoint_dir=args.checkpoint_dir)))
+            if "roi" in args.benches:
+                cases.append(("roi", dict(variant=variant, device=args.device, image_size=image_size,
+                                          points_per_side=args.points_per_side, points_per_batch=max(args.points_per_batch),
+                                          checkpoint_dir=args.checkpoint_dir)))
+            if "incremental" in args.benches:
+                cases.append(("incremental", dict(variant=variant, device=args.device, image_size=image_size,
+                                                  points_per_side=args.points_per_side, points_per_batch=max(args.points_per_batch),
+                                                  checkpoint_dir=args.checkpoint_dir)))
+            if "resolution" in args.benches:
+                cases.append(("resolution", dict(variant=variant, device=args.device, image_size=image_size, img_sizes=args.img_sizes,
+                                                 warmup=args.warmup, repeat=args.repeat, checkpoint_dir=args.checkpoint_dir)))
+    for image_size in args.sizes:
+        for name in ["seg_color", "mask_set", "morphology"]:
+            if name in args.benches:
+                cases.append((name, dict(image_size=image_size, num_masks=args.num_masks, repeat=args.repeat)))
+        for name in ["postprocess", "mask_index"]:
+            if name in args.benches:
+                cases.append((name, dict(image_size=image_size, num_masks=args.num_masks)))
+
+    results = []
+    for name, kwargs in cases:
+        print(f"running {name}: {kwargs}", file=sys.stderr)
+        if args.no_isolate or name == "model_size":
+            results.extend(run_benchmark(name, kwargs))
+        else:
+            results.extend(run_benchmark_isolated(name, kwargs))
+
+    config = {k: v for k, v in vars(args).items() if k != "func"}
+    save_results(args.output, results, get_environment_info(device), config)
+    print(f"saved: {args.output}", file=sys.stderr)
+
+
+def compare(args):
+    rows = compare_results(load_results(args.base), load_results(args.new), args.metrics)
+    for row in rows:
+        ratio = "n/a" if row["ratio"] is None else f"{row['ratio']:.3f}"
+        print(f"{row['case']:<80} {row['metric']:<16} {row['base']:>12.4f} {row['new']:>12.4f} {ratio:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Inpaint Anything benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and write JSON results.")
+    run_parser.add_argument("--variants", nargs="+", default=["sam_vit_b", "mobile_sam_vit_t"], choices=list(SAM_VARIANTS.keys()))
+    run_parser.add_argument("--benches", nargs="+", default=["model_size", "encoder", "decoder", "generate"],
+                            choices=["model_size", "encoder", "decoder", "generate", "attention", "resolution", "precision", "compile",
+                                     "backend", "token_merging", "rectangular", "shared_weights", "channels_last", "seg_color", "mask_set", "postprocess",
+                                     "morphology", "mask_index", "mask_file", "mask_candidates", "roi", "incremental"])
+    run_parser.add_argument("--sizes", nargs="+", type=int, default=list(IMAGE_SIZES))
+    run_parser.add_argument("--points-per-batch", nargs="+", type=int, default=[16, 32, 64, 128])
+    run_parser.add_argument("--points-per-side", type=int, default=32)
+    run_parser.add_argument("--img-sizes", nargs="+", type=int, default=[1024, 768, 512], help="Encoder input sizes for the resolution bench.")
+    run_parser.add_argument("--precisions", nargs="+", default=["fp32", "int8", "bf16"], choices=["fp32", "fp16", "bf16", "int8"],
+                            help="Precisions for the precision bench.")
+    run_parser.add_argument("--compile-modes", nargs="+", default=["eager", "trace"], choices=["eager", "trace", "inductor"],
+                            help="Image encoder compile modes for the compile bench.")
+    run_parser.add_argument("--aspect-ratios", nargs="+", type=float, default=[1.0, 16 / 9, 3.0],
+                            help="Image aspect ratios (width / height) for the rectangular bench.")
+    run_parser.add_argument("--tome-ratios", nargs="+", type=float, default=[0.0, 0.25, 0.5],
+                            help="Token merging ratios for the token_merging bench.")
+    run_parser.add_argument("--num-masks", nargs="+", type=int, default=[50, 250, 1000],
+                            help="Numbers of synthetic masks for the mask benches (seg_color, mask_set, postprocess, morphology, mask_index, mask_file).")
+    run_parser.add_argument("--backends", nargs="+", default=["torch", "onnx"], choices=["torch", "onnx"],
+                            help="SAM backends for the backend bench (CPU only).")
+    run_parser.add_argument("--onnx-threads", type=int, default=0, help="ONNX Runtime intra-op threads for the backend bench.")
+    run_parser.add_argument("--attn-backends", nargs="+", default=["eager", "sdpa"], choices=["eager", "sdpa"])
+    run_parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--checkpoint-dir", default=None, help="Use real weights found in this models directory.")
+    run_parser.add_argument("--no-isolate", action="store_true", help="Run all cases in this process (peak RSS is cumulative).")
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON result files.")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--metrics", nargs="+", default=None)
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
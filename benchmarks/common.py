@@ -0,0 +1,231 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESULTS_VERSION = 1
+
+
+def make_result(bench: str, case: Dict[str, Any], metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Make a benchmark result record.
+
+    Args:
+        bench (str): benchmark name
+        case (Dict[str, Any]): parameters identifying the case
+        metrics (Dict[str, Any]): measured values
+
+    Returns:
+        Dict[str, Any]: benchmark result
+    """
+    return dict(bench=bench, case=case, metrics=metrics)
+
+
+def synchronize(device: torch.device) -> None:
+    """Wait for all kernels on the device to finish.
+
+    Args:
+        device (torch.device): device
+
+    Returns:
+        None
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps" and hasattr(torch, "mps"):
+        torch.mps.synchronize()
+
+
+def time_function(
+        fn: Callable[[], Any],
+        device: torch.device,
+        warmup: int = 1,
+        repeat: int = 3,
+        ) -> Dict[str, float]:
+    """Time a function call.
+
+    Args:
+        fn (Callable[[], Any]): function to time
+        device (torch.device): device the function runs on
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+
+    Returns:
+        Dict[str, float]: min, median and mean wall time in seconds
+    """
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    return dict(min_s=min(times), median_s=statistics.median(times), mean_s=statistics.mean(times))
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Get the peak resident set size of this process.
+
+    Returns:
+        float or None: peak RSS in MiB, None if unavailable on this platform
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+def peak_device_memory_mb(device: torch.device) -> Optional[float]:
+    """Get the peak allocated device memory.
+
+    Args:
+        device (torch.device): device
+
+    Returns:
+        float or None: peak allocated memory in MiB, None for non-CUDA devices
+    """
+    if device.type != "cuda":
+        return None
+    return torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+
+
+def get_git_commit() -> Optional[str]:
+    """Get the current git commit of the repository.
+
+    Returns:
+        str or None: commit hash, None if not in a git checkout
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def get_environment_info(device: torch.device) -> Dict[str, Any]:
+    """Get information about the benchmark environment.
+
+    Args:
+        device (torch.device): benchmark device
+
+    Returns:
+        Dict[str, Any]: environment information
+    """
+    info = dict(
+        commit=get_git_commit(),
+        timestamp=datetime.now().isoformat(timespec="seconds"),
+        python=sys.version.split()[0],
+        torch=torch.__version__,
+        platform=platform.platform(),
+        processor=platform.processor(),
+        device=str(device),
+        num_threads=torch.get_num_threads(),
+    )
+    if device.type == "cuda":
+        info["device_name"] = torch.cuda.get_device_name(device)
+
+    return info
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    """Get the key identifying a benchmark case across runs.
+
+    Args:
+        result (Dict[str, Any]): benchmark result
+
+    Returns:
+        str: key
+    """
+    keys = [k for k in sorted(result.get("case", {}).keys())]
+    return "/".join([result["bench"]] + [f"{k}={result['case'][k]}" for k in keys])
+
+
+def save_results(path: str, results: List[Dict[str, Any]], environment: Dict[str, Any], config: Dict[str, Any]) -> None:
+    """Save benchmark results to a JSON file.
+
+    Args:
+        path (str): output JSON path
+        results (List[Dict[str, Any]]): benchmark results
+        environment (Dict[str, Any]): environment information
+        config (Dict[str, Any]): benchmark configuration
+
+    Returns:
+        None
+    """
+    data = dict(version=RESULTS_VERSION, environment=environment, config=config, results=results)
+    dir_name = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir_name, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    """Load benchmark results from a JSON file.
+
+    Args:
+        path (str): JSON path
+
+    Returns:
+        Dict[str, Any]: benchmark results
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if data.get("version") != RESULTS_VERSION:
+        raise ValueError(f"Unsupported results version: {data.get('version')}")
+
+    return data
+
+
+def compare_results(
+        base: Dict[str, Any],
+        new: Dict[str, Any],
+        metrics: Optional[List[str]] = None,
+        ) -> List[Dict[str, Any]]:
+    """Compare two benchmark result sets case by case.
+
+    Args:
+        base (Dict[str, Any]): baseline results
+        new (Dict[str, Any]): new results
+        metrics (List[str], optional): metrics to compare. Defaults to all shared numeric metrics.
+
+    Returns:
+        List[Dict[str, Any]]: one row per (case, metric) with base, new and ratio
+    """
+    base_results = {result_key(r): r for r in base["results"]}
+    rows = []
+    for new_result in new["results"]:
+        key = result_key(new_result)
+        if key not in base_results:
+            continue
+        base_metrics = base_results[key].get("metrics", {})
+        new_metrics = new_result.get("metrics", {})
+        for metric, new_value in new_metrics.items():
+            if metrics is not None and metric not in metrics:
+                continue
+            base_value = base_metrics.get(metric)
+            if not isinstance(base_value, (int, float)) or not isinstance(new_value, (int, float)):
+                continue
+            ratio = new_value / base_value if base_value else None
+            rows.append(dict(case=key, metric=metric, base=base_value, new=new_value, ratio=ratio))
+
+    return rows
@@ -0,0 +1,299 @@
+import copy
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from .common import make_result, time_function
+from .synthetic import create_synthetic_masks
+
+
+def legacy_create_seg_color_image(input_image: np.ndarray, sam_masks: List[Dict[str, Any]]) -> np.ndarray:
+    """create_seg_color_image before the label map, without its progress bar, as the baseline.
+
+    Args:
+        input_image (np.ndarray): input image
+        sam_masks (List[Dict[str, Any]]): SAM masks
+
+    Returns:
+        np.ndarray: segmentation color image
+    """
+    from inpalib.samlib import get_seg_colormap
+
+    seg_colormap = get_seg_colormap()
+    sam_masks = sam_masks[:len(seg_colormap)]
+
+    canvas_image = np.zeros((*input_image.shape[:2], 1), dtype=np.uint8)
+    for idx, seg_dict in enumerate(sam_masks[0:min(255, len(sam_masks))]):
+        seg_mask = np.expand_dims(seg_dict["segmentation"].astype(np.uint8), axis=-1)
+        canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
+        seg_color = np.array([idx+1], dtype=np.uint8) * seg_mask * canvas_mask
+        canvas_image = canvas_image + seg_color
+    seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
+    temp_canvas_image = np.apply_along_axis(lambda x: seg_colormap[x[0]], axis=-1, arr=canvas_image)
+    if len(sam_masks) > 255:
+        canvas_image = canvas_image.astype(bool).astype(np.uint8)
+        for idx, seg_dict in enumerate(sam_masks[255:min(509, len(sam_masks))]):
+            seg_mask = np.expand_dims(seg_dict["segmentation"].astype(np.uint8), axis=-1)
+            canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
+            seg_color = np.array([idx+2], dtype=np.uint8) * seg_mask * canvas_mask
+            canvas_image = canvas_image + seg_color
+        seg_colormap = seg_colormap[256:]
+        seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
+        seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
+        canvas_image = np.apply_along_axis(lambda x: seg_colormap[x[0]], axis=-1, arr=canvas_image)
+        canvas_image = temp_canvas_image + canvas_image
+    else:
+        canvas_image = temp_canvas_image
+
+    return canvas_image.astype(np.uint8)
+
+
+def bench_seg_color(
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        repeat: int = 3,
+        ) -> List[Dict[str, Any]]:
+    """Measure create_seg_color_image against the per-pixel colormap lookup it replaced.
+
+    The baseline is timed once, since it takes seconds per call on large images.
+
+    Args:
+        image_size (int): height and width of the synthetic image
+        num_masks (Sequence[int]): numbers of masks to measure
+        repeat (int): number of timed calls
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from inpalib.samlib import create_seg_color_image
+
+    cpu = torch.device("cpu")
+    input_image = np.zeros((image_size, image_size, 3), dtype=np.uint8)
+
+    results = []
+    for count in num_masks:
+        sam_masks = create_synthetic_masks(image_size, count)
+        new_s = time_function(lambda: create_seg_color_image(input_image, sam_masks), cpu, warmup=0, repeat=repeat)["median_s"]
+
+        start = time.perf_counter()
+        legacy_create_seg_color_image(input_image, sam_masks)
+        legacy_s = time.perf_counter() - start
+
+        metrics = dict(new_s=new_s, legacy_s=legacy_s, speedup=legacy_s / new_s)
+        results.append(make_result("seg_color", dict(image_size=image_size, num_masks=len(sam_masks)), metrics))
+
+    return results
+
+
+def bench_mask_set(
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        repeat: int = 3,
+        ) -> List[Dict[str, Any]]:
+    """Measure the memory of a MaskSet against the list of SAM masks it is built from.
+
+    Args:
+        image_size (int): height and width of the synthetic image
+        num_masks (Sequence[int]): numbers of masks to measure
+        repeat (int): number of timed calls
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from inpalib.masklib import create_mask_image
+    from inpalib.maskset import MaskSet
+
+    cpu = torch.device("cpu")
+    sketch = np.zeros((image_size, image_size, 1), dtype=np.uint8)
+    sketch[image_size // 2 - 4:image_size // 2 + 4, image_size // 4:image_size * 3 // 4] = 255
+
+    results = []
+    for count in num_masks:
+        sam_masks = create_synthetic_masks(image_size, count)
+        mask_set = MaskSet.from_masks(sam_masks)
+        build_s = time_function(lambda: MaskSet.from_masks(sam_masks), cpu, warmup=0, repeat=repeat)["median_s"]
+        get_mask_s = time_function(lambda: [mask_set.get_mask(idx) for idx in range(len(mask_set))],
+                                   cpu, warmup=0, repeat=repeat)["median_s"] / max(1, len(mask_set))
+        mask_image_s = time_function(lambda: create_mask_image(sketch, mask_set), cpu, warmup=0, repeat=repeat)["median_s"]
+
+        metrics = dict(list_mb=sum(sam_mask["segmentation"].nbytes for sam_mask in sam_masks) / (1024 ** 2),
+                       mask_set_mb=mask_set.nbytes / (1024 ** 2),
+                       num_overlaps=sum(overlap is not None for overlap in mask_set.overlaps),
+                       build_s=build_s, get_mask_s=get_mask_s, mask_image_s=mask_image_s)
+        results.append(make_result("mask_set", dict(image_size=image_size, num_masks=len(sam_masks)), metrics))
+
+    return results
+
+
+def legacy_postprocess_masks(sam_masks: List[Dict[str, Any]]) -> Any:
+    """Post-generation steps before the areas were carried through, as the baseline.
+
+    The masks are deep-copied as generate_sam_masks did, sorted by summing each mask,
+    and stored in a MaskSet that computes the areas and bounding boxes again.
+
+    Args:
+        sam_masks (List[Dict[str, Any]]): SAM masks
+
+    Returns:
+        MaskSet: mask set
+    """
+    from inpalib.maskset import MaskSet
+
+    sam_masks = copy.deepcopy(sam_masks)
+    sam_masks = sorted(sam_masks, key=lambda x: np.sum(x.get("segmentation").astype(np.uint32)))
+
+    return MaskSet.from_masks([dict(segmentation=x["segmentation"]) for x in sam_masks])
+
+
+def measure_peak(fn: Callable[[], Any]) -> Tuple[float, float]:
+    """Measure the wall time and the peak of the memory allocated by a function call.
+
+    Args:
+        fn (Callable[[], Any]): function to measure
+
+    Returns:
+        Tuple[float, float]: wall time in seconds and peak allocated memory in MiB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / (1024 ** 2)
+
+
+def bench_postprocess(
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        ) -> List[Dict[str, Any]]:
+    """Measure the steps after mask generation, sorting by area and storing the masks in a MaskSet.
+
+    The peak memory is the memory allocated by the steps on top of the generated masks,
+    as traced by tracemalloc.
+
+    Args:
+        image_size (int): height and width of the synthetic image
+        num_masks (Sequence[int]): numbers of masks to measure
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from inpalib.samlib import sort_masks_by_area
+
+    results = []
+    for count in num_masks:
+        sam_masks = create_synthetic_masks(image_size, count)
+        legacy_s, legacy_peak_mb = measure_peak(lambda: legacy_postprocess_masks(sam_masks))
+        new_s, new_peak_mb = measure_peak(lambda: sort_masks_by_area(sam_masks, (image_size, image_size)))
+
+        metrics = dict(new_s=new_s, legacy_s=legacy_s, speedup=legacy_s / new_s,
+                       new_peak_mb=new_peak_mb, legacy_peak_mb=legacy_peak_mb)
+        results.append(make_result("postprocess", dict(image_size=image_size, num_masks=len(sam_masks)), metrics))
+
+    return results
+
+
+def legacy_close_open_masks(sam_masks: List[Dict[str, Any]], close_size: int, open_size: int) -> List[np.ndarray]:
+    """Closing and opening of full-frame masks one by one, as the baseline.
+
+    Args:
+        sam_masks (List[Dict[str, Any]]): SAM masks
+        close_size (int): kernel size of the closing
+        open_size (int): kernel size of the opening
+
+    Returns:
+        List[np.ndarray]: processed masks in bool
+    """
+    import cv2
+
+    outputs = []
+    for sam_mask in sam_masks:
+        seg = cv2.morphologyEx(sam_mask["segmentation"].astype(np.uint8), cv2.MORPH_CLOSE, np.ones((close_size, close_size), np.uint8))
+        seg = cv2.morphologyEx(seg, cv2.MORPH_OPEN, np.ones((open_size, open_size), np.uint8))
+        outputs.append(seg.astype(bool))
+
+    return outputs
+
+
+def bench_morphology(
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        repeat: int = 3,
+        ) -> List[Dict[str, Any]]:
+    """Measure the anime style closing and opening within bounding boxes against full-frame masks.
+
+    Args:
+        image_size (int): height and width of the synthetic image
+        num_masks (Sequence[int]): numbers of masks to measure
+        repeat (int): number of timed calls
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_mask_morphology import close_open_masks
+
+    cpu = torch.device("cpu")
+
+    results = []
+    for count in num_masks:
+        sam_masks = create_synthetic_masks(image_size, count)
+        new_masks = close_open_masks(copy.deepcopy(sam_masks), 5, 5)
+        legacy_s = time_function(lambda: legacy_close_open_masks(sam_masks, 5, 5), cpu, warmup=0, repeat=repeat)["median_s"]
+        # The masks are processed in place, processing them again takes the same time
+        new_s = time_function(lambda: close_open_masks(new_masks, 5, 5), cpu, warmup=0, repeat=repeat)["median_s"]
+
+        metrics = dict(new_s=new_s, legacy_s=legacy_s, speedup=legacy_s / new_s)
+        results.append(make_result("morphology", dict(image_size=image_size, num_masks=len(sam_masks)), metrics))
+
+    return results
+
+
+def bench_mask_index(
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        num_queries: int = 200,
+        ) -> List[Dict[str, Any]]:
+    """Measure building a MaskIndex and its point, box and polyline queries.
+
+    The queries are at random positions, the boxes and polylines within 128 pixels.
+
+    Args:
+        image_size (int): height and width of the synthetic image
+        num_masks (Sequence[int]): numbers of masks to measure
+        num_queries (int): number of queries of each kind
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from inpalib.maskindex import MaskIndex
+    from inpalib.maskset import MaskSet
+
+    def time_queries(fn, args_list):
+        start = time.perf_counter()
+        for args in args_list:
+            fn(*args)
+        return (time.perf_counter() - start) / len(args_list)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for count in num_masks:
+        mask_set = MaskSet.from_masks(create_synthetic_masks(image_size, count))
+        start = time.perf_counter()
+        index = MaskIndex(mask_set)
+        build_s = time.perf_counter() - start
+
+        corners = rng.integers(0, image_size, (num_queries, 2))
+        boxes = [(x, y, x + 127, y + 127) for x, y in corners.tolist()]
+        polylines = [((corners[i] + rng.integers(0, 128, (8, 2))).tolist(), 3) for i in range(num_queries)]
+        metrics = dict(build_s=build_s,
+                       point_us=time_queries(index.masks_at_point, corners.tolist()) * 1e6,
+                       box_us=time_queries(index.masks_in_box, boxes) * 1e6,
+                       polyline_us=time_queries(index.masks_on_polyline, polylines) * 1e6)
+        results.append(make_result("mask_index", dict(image_size=image_size, num_masks=len(mask_set)), metrics))
+
+    return results
@@ -0,0 +1,1011 @@
+import gc
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from .common import make_result, peak_device_memory_mb, peak_rss_mb, synchronize, time_function
+from .mask_bench import bench_mask_index, bench_mask_set, bench_morphology, bench_postprocess, bench_seg_color
+from .synthetic import (build_synthetic_sam, count_parameters, create_synthetic_image, create_synthetic_masks, find_checkpoint,
+                        get_sam_package)
+
+
+def bench_model_size(variant: str) -> List[Dict[str, Any]]:
+    """Report parameter counts, without allocating weights where the meta device allows it.
+
+    Args:
+        variant (str): variant name
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    try:
+        sam = build_synthetic_sam(variant, device=torch.device("meta"))
+    except (RuntimeError, NotImplementedError):
+        # TinyViT calls .item() while building, which meta tensors do not support
+        sam = build_synthetic_sam(variant, device=torch.device("cpu"))
+    results = []
+    for name in ["image_encoder", "prompt_encoder", "mask_decoder"]:
+        num_params, num_bytes = count_parameters(getattr(sam, name))
+        results.append(make_result("model_size", dict(variant=variant, module=name),
+                                   dict(num_params=num_params, size_mb=num_bytes / (1024 * 1024))))
+
+    return results
+
+
+@torch.no_grad()
+def bench_encoder(
+        variant: str,
+        device: torch.device,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure image encoder latency on a preprocessed input.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    img_size = sam.image_encoder.img_size
+    input_image = torch.randn(1, 3, img_size, img_size, device=device)
+
+    timing = time_function(lambda: sam.image_encoder(input_image), device, warmup=warmup, repeat=repeat)
+    metrics = dict(**timing, peak_rss_mb=peak_rss_mb(), peak_device_mb=peak_device_memory_mb(device))
+
+    return [make_result("encoder", dict(variant=variant, img_size=img_size), metrics)]
+
+
+@torch.no_grad()
+def bench_decoder(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        points_per_batch: Sequence[int] = (16, 32, 64, 128),
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure prompt encoder + mask decoder throughput per points_per_batch.
+
+    The timed call is the one SamAutomaticMaskGenerator makes per batch,
+    including upscaling the logits to the original image size.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        points_per_batch (Sequence[int]): batch sizes to measure
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    predictor = package.SamPredictor(sam)
+    image = create_synthetic_image(image_size)
+    predictor.set_image(image)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in points_per_batch:
+        points = rng.uniform(0, 1, size=(batch_size, 2)) * np.array(image.shape[1::-1])
+        points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+        in_points = torch.as_tensor(points, device=device)[:, None, :]
+        in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+
+        timing = time_function(
+            lambda: predictor.predict_torch(in_points, in_labels, multimask_output=True, return_logits=True),
+            device, warmup=warmup, repeat=repeat)
+        metrics = dict(**timing, points_per_s=batch_size / timing["median_s"],
+                       peak_rss_mb=peak_rss_mb(), peak_device_mb=peak_device_memory_mb(device))
+        results.append(make_result("decoder", dict(variant=variant, image_size=image_size, points_per_batch=batch_size), metrics))
+
+    return results
+
+
+@torch.no_grad()
+def bench_generate(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        points_per_side: int = 32,
+        points_per_batch: int = 64,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the wall time of SamAutomaticMaskGenerator.generate().
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        points_per_side (int): points per side of the prompt grid
+        points_per_batch (int): points per decoder batch
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    sam_mask_generator = package.SamAutomaticMaskGenerator(
+        model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch)
+    image = create_synthetic_image(image_size)
+
+    start = time.perf_counter()
+    sam_masks = sam_mask_generator.generate(image)
+    synchronize(device)
+    elapsed = time.perf_counter() - start
+
+    metrics = dict(wall_s=elapsed, num_masks=len(sam_masks),
+                   peak_rss_mb=peak_rss_mb(), peak_device_mb=peak_device_memory_mb(device))
+    case = dict(variant=variant, image_size=image_size, points_per_side=points_per_side, points_per_batch=points_per_batch)
+
+    return [make_result("generate", case, metrics)]
+
+
+@torch.no_grad()
+def bench_attention(
+        variant: str,
+        device: torch.device,
+        backend: str = "sdpa",
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure image encoder latency with an attention backend.
+
+    The sdpa backend is enabled with Sam.set_sdpa, as with --sam-sdpa. Its equivalence with eager
+    attention is tested in tests/test_sdpa_attention.py.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        backend (str): "eager" or "sdpa"
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    if backend not in ["eager", "sdpa"]:
+        raise ValueError(f"Unknown attention backend: {backend}")
+
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    img_size = sam.image_encoder.img_size
+    input_image = torch.randn(1, 3, img_size, img_size, device=device)
+
+    sam.set_sdpa(backend == "sdpa")
+    timing = time_function(lambda: sam.image_encoder(input_image), device, warmup=warmup, repeat=repeat)
+    metrics = dict(**timing, peak_rss_mb=peak_rss_mb(), peak_device_mb=peak_device_memory_mb(device))
+    sam.set_sdpa(False)
+
+    return [make_result("attention", dict(variant=variant, img_size=img_size, backend=backend), metrics)]
+
+
+def mask_iou(masks: torch.Tensor, reference: torch.Tensor) -> torch.Tensor:
+    """Compute the IoU of each mask with its reference mask.
+
+    Args:
+        masks (torch.Tensor): boolean masks in BxHxW format
+        reference (torch.Tensor): boolean reference masks in BxHxW format
+
+    Returns:
+        torch.Tensor: IoU per mask, 1.0 if both masks are empty
+    """
+    intersection = (masks & reference).flatten(1).sum(1).float()
+    union = (masks | reference).flatten(1).sum(1).float()
+
+    return torch.where(union > 0, intersection / union.clamp(min=1), torch.ones_like(union))
+
+
+@torch.no_grad()
+def bench_resolution(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        img_sizes: Sequence[int] = (1024, 768, 512),
+        num_points: int = 32,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure image encoding latency and mask agreement at reduced encoder input sizes.
+
+    Masks are predicted for the same point prompts at each size and compared with
+    the masks at the largest size. With random weights only the latency is meaningful,
+    use checkpoint_dir for the mask quality.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        img_sizes (Sequence[int]): encoder input sizes to measure
+        num_points (int): number of point prompts
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results, empty if the variant does not support other input sizes
+    """
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    if not hasattr(sam.image_encoder, "set_img_size"):
+        return []
+    image = create_synthetic_image(image_size)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(num_points, 2)) * np.array(image.shape[1::-1])
+
+    reference = None
+    results = []
+    for img_size in sorted(img_sizes, reverse=True):
+        sam.set_img_size(img_size)
+        predictor = package.SamPredictor(sam)
+        timing = time_function(lambda: predictor.set_image(image), device, warmup=warmup, repeat=repeat)
+
+        in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+        in_points = torch.as_tensor(in_points, device=device)[:, None, :]
+        in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+        masks, _, _ = predictor.predict_torch(in_points, in_labels, multimask_output=False)
+        masks = masks[:, 0]
+        if reference is None:
+            reference = masks
+
+        metrics = dict(**timing, mask_iou=mask_iou(masks, reference).mean().item())
+        results.append(make_result("resolution", dict(variant=variant, image_size=image_size, img_size=img_size), metrics))
+
+    return results
+
+
+def state_dict_size(model: torch.nn.Module) -> int:
+    """Get the size of the tensors in a state dict, including packed quantized weights.
+
+    Args:
+        model (torch.nn.Module): model
+
+    Returns:
+        int: size in bytes
+    """
+    num_bytes = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, tuple) else (value,)
+        num_bytes += sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+    return num_bytes
+
+
+@torch.no_grad()
+def bench_precision(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        precisions: Sequence[str] = ("fp32", "int8", "bf16"),
+        num_points: int = 32,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure mixed precision and dynamic int8 quantization against fp32.
+
+    int8 is measured on CPU only.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        precisions (Sequence[str]): "fp32", "fp16", "bf16" or "int8"
+        num_points (int): number of point prompts
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_sam_precision import apply_sam_precision
+    from ia_sam_quantize import quantize_sam
+
+    package = get_sam_package(variant)
+    image = create_synthetic_image(image_size)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(num_points, 2)) * np.array(image.shape[1::-1])
+
+    reference = None
+    results = []
+    for precision in ["fp32"] + [p for p in precisions if p != "fp32"]:
+        if precision == "int8" and device.type != "cpu":
+            continue
+        sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+        if precision == "int8":
+            sam = quantize_sam(sam)
+        elif precision != "fp32":
+            sam = apply_sam_precision(sam, precision, device)
+        state_dict_mb = state_dict_size(sam) / (1024 * 1024)
+
+        predictor = package.SamPredictor(sam)
+        encode = time_function(lambda: predictor.set_image(image), device, warmup=warmup, repeat=repeat)
+
+        in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+        in_points = torch.as_tensor(in_points, device=device)[:, None, :]
+        in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+        decode = time_function(lambda: predictor.predict_torch(in_points, in_labels, multimask_output=False),
+                               device, warmup=warmup, repeat=repeat)
+        masks, _, _ = predictor.predict_torch(in_points, in_labels, multimask_output=False)
+        masks = masks[:, 0]
+        if reference is None:
+            reference = masks
+
+        metrics = dict(encode_s=encode["median_s"], decode_s=decode["median_s"], state_dict_mb=state_dict_mb,
+                       mask_iou=mask_iou(masks, reference).mean().item())
+        results.append(make_result("precision", dict(variant=variant, image_size=image_size, precision=precision), metrics))
+        del predictor, sam
+
+    return results
+
+
+@torch.no_grad()
+def bench_compile(
+        variant: str,
+        device: torch.device,
+        mode: str = "trace",
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the first call (including compilation) and steady-state latency of a compiled image encoder.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        mode (str): "eager", "trace" or "inductor"
+        repeat (int): number of timed steady-state calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_compile import compile_sam_encoder
+
+    checkpoint = find_checkpoint(variant, checkpoint_dir)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=checkpoint)
+    if mode != "eager":
+        model_key = f"bench_{variant}" if checkpoint is None else f"bench_{variant}_{int(os.path.getmtime(checkpoint))}"
+        compile_sam_encoder(sam, mode, model_key)
+    img_size = sam.image_encoder.img_size
+    input_image = torch.randn(1, 3, img_size, img_size, device=device)
+
+    start = time.perf_counter()
+    sam.image_encoder(input_image)
+    synchronize(device)
+    first_call_s = time.perf_counter() - start
+
+    timing = time_function(lambda: sam.image_encoder(input_image), device, warmup=0, repeat=repeat)
+    metrics = dict(first_call_s=first_call_s, steady_s=timing["median_s"], peak_rss_mb=peak_rss_mb())
+
+    return [make_result("compile", dict(variant=variant, img_size=img_size, mode=mode), metrics)]
+
+
+@torch.no_grad()
+def bench_rectangular(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        aspect_ratios: Sequence[float] = (1.0, 16 / 9, 3.0),
+        num_points: int = 32,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the non-square input mode against square padding.
+
+    Variants without a ViT image encoder (TinyViT) are skipped.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        aspect_ratios (Sequence[float]): width / height of the synthetic images
+        num_points (int): number of point prompts
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    if not hasattr(sam.image_encoder, "get_input_size"):
+        return []
+    predictor = get_sam_package(variant).SamPredictor(sam)
+
+    results = []
+    for aspect_ratio in aspect_ratios:
+        image = create_synthetic_image(image_size, aspect_ratio=aspect_ratio)
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0, 1, size=(num_points, 2)) * np.array(image.shape[1::-1])
+        in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+        in_points = torch.as_tensor(in_points, device=device)[:, None, :]
+        in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+
+        reference = None
+        baseline_s = None
+        for rectangular in [False, True]:
+            sam.set_rectangular_input(rectangular)
+            encode = time_function(lambda: predictor.set_image(image), device, warmup=warmup, repeat=repeat)
+            masks, _, _ = predictor.predict_torch(in_points, in_labels, multimask_output=False)
+            masks = masks[:, 0]
+            if reference is None:
+                reference, baseline_s = masks, encode["median_s"]
+
+            metrics = dict(encode_s=encode["median_s"], speedup=baseline_s / encode["median_s"],
+                           num_tokens=int(np.prod(predictor.features.shape[-2:])), mask_iou=mask_iou(masks, reference).mean().item())
+            case = dict(variant=variant, image_size=image_size, aspect_ratio=round(aspect_ratio, 3), rectangular=rectangular)
+            results.append(make_result("rectangular", case, metrics))
+    sam.set_rectangular_input(False)
+
+    return results
+
+
+@torch.no_grad()
+def bench_channels_last(
+        variant: str,
+        device: torch.device,
+        points_per_batch: int = 64,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the conv stacks of SAM in NCHW and in channels-last with the fused LayerNorm2d.
+
+    The LayerNorm2d and output_upscaling calls are timed on the decoder's inputs for
+    points_per_batch prompts, and predict_torch on the same prompts.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        points_per_batch (int): number of point prompts per decoder call
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    predictor = get_sam_package(variant).SamPredictor(sam)
+    image = create_synthetic_image(1024)
+    predictor.set_image(image)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(points_per_batch, 2)) * np.array(image.shape[1::-1])
+    in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+    in_points = torch.as_tensor(in_points, device=device)[:, None, :]
+    in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+
+    output_upscaling = sam.mask_decoder.output_upscaling
+    layer_norm = output_upscaling[1]
+    c = sam.mask_decoder.transformer_dim
+    h, w = predictor.features.shape[-2:]
+    src = torch.randn(points_per_batch, c, h, w, device=device)
+    upscaled = torch.randn(points_per_batch, c // 4, 2 * h, 2 * w, device=device)
+
+    results = []
+    for channels_last in [False, True]:
+        sam.set_channels_last(channels_last)
+        predictor.set_image(image)
+        if channels_last:
+            upscaled = upscaled.contiguous(memory_format=torch.channels_last)
+        layer_norm_s = time_function(lambda: layer_norm(upscaled), device, warmup=warmup, repeat=repeat)["median_s"]
+        upscaling_s = time_function(lambda: output_upscaling(src), device, warmup=warmup, repeat=repeat)["median_s"]
+        decode_s = time_function(lambda: predictor.predict_torch(in_points, in_labels, multimask_output=True),
+                                 device, warmup=warmup, repeat=repeat)["median_s"]
+
+        metrics = dict(layer_norm_s=layer_norm_s, upscaling_s=upscaling_s, decode_s=decode_s)
+        case = dict(variant=variant, points_per_batch=points_per_batch, channels_last=channels_last)
+        results.append(make_result("channels_last", case, metrics))
+    sam.set_channels_last(False)
+
+    return results
+
+
+def bench_shared_weights(
+        variant: str,
+        device: torch.device,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the memory of a SAM-HQ model loaded next to the SAM model of the same size, with and without weight sharing.
+
+    With random weights, the SAM-HQ model gets the weights of the SAM model, as in the released checkpoints.
+    Variants other than SAM-HQ are skipped.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_sam_cache import SamModelCache, get_tensors_size
+
+    if not variant.startswith("sam_hq_"):
+        return []
+    base_variant = variant.replace("sam_hq_", "sam_")
+    cpu = torch.device("cpu")
+    sam = build_synthetic_sam(base_variant, device=cpu, checkpoint=find_checkpoint(base_variant, checkpoint_dir))
+    checkpoint = find_checkpoint(variant, checkpoint_dir)
+    sam_hq = build_synthetic_sam(variant, device=cpu, checkpoint=checkpoint, seed=1)
+    if checkpoint is None:
+        sam_hq.load_state_dict(sam.state_dict(), strict=False)
+    separate_bytes = get_tensors_size([sam, sam_hq])
+
+    cache = SamModelCache()
+    cache.share_tensors(sam, device)
+    start = time.perf_counter()
+    cache.share_tensors(sam_hq, device)
+    synchronize(device)
+    share_s = time.perf_counter() - start
+    shared_bytes = get_tensors_size([sam, sam_hq])
+
+    metrics = dict(separate_mb=separate_bytes / (1024 ** 2), shared_mb=shared_bytes / (1024 ** 2),
+                   hq_extra_mb=(shared_bytes - get_tensors_size([sam])) / (1024 ** 2), share_s=share_s)
+
+    return [make_result("shared_weights", dict(variant=variant, base_variant=base_variant), metrics)]
+
+
+@torch.no_grad()
+def bench_token_merging(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        ratios: Sequence[float] = (0.0, 0.25, 0.5),
+        num_points: int = 32,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure token merging in the global attention blocks against no merging.
+
+    Variants without a ViT image encoder (TinyViT) are skipped.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        ratios (Sequence[float]): token merging ratios
+        num_points (int): number of point prompts
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    if not hasattr(sam.image_encoder, "set_token_merging"):
+        return []
+    predictor = get_sam_package(variant).SamPredictor(sam)
+    image = create_synthetic_image(image_size)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(num_points, 2)) * np.array(image.shape[1::-1])
+    in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+    in_points = torch.as_tensor(in_points, device=device)[:, None, :]
+    in_labels = torch.ones(in_points.shape[:2], dtype=torch.int, device=device)
+
+    reference = None
+    baseline_s = None
+    results = []
+    for ratio in [0.0] + [r for r in ratios if r != 0.0]:
+        sam.image_encoder.set_token_merging(ratio)
+        encode = time_function(lambda: predictor.set_image(image), device, warmup=warmup, repeat=repeat)
+        masks, _, _ = predictor.predict_torch(in_points, in_labels, multimask_output=False)
+        masks = masks[:, 0]
+        if reference is None:
+            reference, baseline_s = masks, encode["median_s"]
+
+        metrics = dict(encode_s=encode["median_s"], speedup=baseline_s / encode["median_s"],
+                       mask_iou=mask_iou(masks, reference).mean().item())
+        results.append(make_result("token_merging", dict(variant=variant, image_size=image_size, ratio=ratio), metrics))
+
+    return results
+
+
+@torch.no_grad()
+def bench_backend(
+        variant: str,
+        image_size: int,
+        backends: Sequence[str] = ("torch", "onnx"),
+        num_points: int = 32,
+        num_threads: int = 0,
+        warmup: int = 1,
+        repeat: int = 3,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure the ONNX Runtime backend against PyTorch on CPU.
+
+    Args:
+        variant (str): variant name
+        image_size (int): longest side of the synthetic image
+        backends (Sequence[str]): "torch" or "onnx"
+        num_points (int): number of point prompts
+        num_threads (int): number of ONNX Runtime intra-op threads, 0 for the default
+        warmup (int): number of untimed calls
+        repeat (int): number of timed calls
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    import tempfile
+
+    from ia_sam_onnx import OnnxSam, OnnxSamPredictor, export_sam_onnx
+
+    device = torch.device("cpu")
+    package = get_sam_package(variant)
+    image = create_synthetic_image(image_size)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(num_points, 2)) * np.array(image.shape[1::-1])
+
+    reference = None
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in ["torch"] + [b for b in backends if b != "torch"]:
+            sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+            export_s = 0.0
+            if backend == "onnx":
+                start = time.perf_counter()
+                onnx_dir = export_sam_onnx(sam, os.path.join(tmp_dir, variant))
+                export_s = time.perf_counter() - start
+                del sam
+                gc.collect()
+                predictor = OnnxSamPredictor(OnnxSam(onnx_dir, num_threads))
+            else:
+                predictor = package.SamPredictor(sam)
+            encode = time_function(lambda: predictor.set_image(image), device, warmup=warmup, repeat=repeat)
+
+            in_points = predictor.transform.apply_coords(points, image.shape[:2]).astype(np.float32)
+            in_points = torch.as_tensor(in_points)[:, None, :]
+            in_labels = torch.ones(in_points.shape[:2], dtype=torch.int)
+            decode = time_function(lambda: predictor.predict_torch(in_points, in_labels, multimask_output=False),
+                                   device, warmup=warmup, repeat=repeat)
+            masks, _, _ = predictor.predict_torch(in_points, in_labels, multimask_output=False)
+            masks = masks[:, 0]
+            if reference is None:
+                reference = masks
+
+            metrics = dict(encode_s=encode["median_s"], decode_s=decode["median_s"], export_s=export_s,
+                           peak_rss_mb=peak_rss_mb(), mask_iou=mask_iou(masks, reference).mean().item())
+            results.append(make_result("backend", dict(variant=variant, image_size=image_size, backend=backend), metrics))
+            del predictor
+
+    return results
+
+
+@torch.no_grad()
+def bench_mask_file(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        num_masks: Sequence[int] = (50, 250, 1000),
+        points_per_side: int = 32,
+        points_per_batch: int = 64,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure saving and loading a mask set file against regenerating the masks.
+
+    The masks are regenerated as run_sam does, generated and sorted by area. Synthetic
+    masks are saved and loaded, since a synthetic SAM model finds few masks.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        num_masks (Sequence[int]): numbers of synthetic masks to save and load
+        points_per_side (int): points per side of the prompt grid
+        points_per_batch (int): points per decoder batch
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from inpalib.maskfile import get_image_hash, load_mask_set, save_mask_set
+    from inpalib.maskset import MaskSet
+    from inpalib.samlib import sort_masks_by_area
+
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    sam_mask_generator = package.SamAutomaticMaskGenerator(
+        model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch)
+    image = create_synthetic_image(image_size)
+
+    start = time.perf_counter()
+    sort_masks_by_area(sam_mask_generator.generate(image), image.shape[:2])
+    synchronize(device)
+    regenerate_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_image_hash(image)
+    hash_s = time.perf_counter() - start
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for count in num_masks:
+            mask_set = MaskSet.from_masks(create_synthetic_masks(image_size, count))
+            file_path = os.path.join(temp_dir, f"masks_{count}.npz")
+            start = time.perf_counter()
+            save_mask_set(mask_set, file_path, dict(image_size=image_size))
+            save_s = time.perf_counter() - start
+            start = time.perf_counter()
+            load_mask_set(file_path)
+            load_s = time.perf_counter() - start
+
+            metrics = dict(regenerate_s=regenerate_s, hash_s=hash_s, save_s=save_s, load_s=load_s,
+                           speedup=regenerate_s / (hash_s + load_s), file_mb=os.path.getsize(file_path) / (1024 ** 2))
+            case = dict(variant=variant, image_size=image_size, num_masks=len(mask_set), points_per_side=points_per_side)
+            results.append(make_result("mask_file", case, metrics))
+
+    return results
+
+
+@torch.no_grad()
+def bench_mask_candidates(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        points_per_side: int = 32,
+        points_per_batch: int = 64,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure filtering candidate masks for new thresholds against generating the masks again.
+
+    The candidates are kept with zero thresholds, since a synthetic SAM model finds few
+    masks above the thresholds of the app. Each style is then filtered from them, and
+    timed against a generator with the thresholds of the style.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        points_per_side (int): points per side of the prompt grid
+        points_per_batch (int): points per decoder batch
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_sam_candidates import generate_sam_mask_candidates
+    from ia_sam_manager import get_sam_mask_generator_thresholds
+
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    image = create_synthetic_image(image_size)
+
+    sam_mask_generator = package.SamAutomaticMaskGenerator(
+        model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch,
+        pred_iou_thresh=0.0, stability_score_thresh=0.0)
+    start = time.perf_counter()
+    candidates = generate_sam_mask_candidates(sam_mask_generator, image)
+    synchronize(device)
+    candidates_s = time.perf_counter() - start
+
+    results = []
+    for anime_style_chk in [False, True]:
+        thresholds = get_sam_mask_generator_thresholds(anime_style_chk)
+        sam_mask_generator = package.SamAutomaticMaskGenerator(
+            model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch, **thresholds)
+        start = time.perf_counter()
+        sam_mask_generator.generate(image)
+        synchronize(device)
+        regenerate_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        filtered = candidates.filter(**thresholds)
+        filter_s = time.perf_counter() - start
+
+        metrics = dict(regenerate_s=regenerate_s, candidates_s=candidates_s, filter_s=filter_s,
+                       speedup=regenerate_s / filter_s, num_candidates=len(candidates), num_masks=len(filtered))
+        case = dict(variant=variant, image_size=image_size, anime_style=anime_style_chk, points_per_side=points_per_side)
+        results.append(make_result("mask_candidates", case, metrics))
+
+    return results
+
+
+@torch.no_grad()
+def bench_roi(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        points_per_side: int = 32,
+        points_per_batch: int = 64,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure generating masks within a region of interest against the whole image.
+
+    The ROI is the centered box of a quarter of the image area, and a diagonal sketch stroke.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        points_per_side (int): points per side of the prompt grid
+        points_per_batch (int): points per decoder batch
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    import cv2
+
+    from ia_sam_roi import build_roi_point_grid, generate_roi_masks, get_roi_mask
+
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    sam_mask_generator = package.SamAutomaticMaskGenerator(
+        model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch)
+    image = create_synthetic_image(image_size)
+    height, width = image.shape[:2]
+
+    sketch = np.zeros((height, width), dtype=np.uint8)
+    cv2.line(sketch, (width // 8, height * 7 // 8), (width * 7 // 8, height // 8), 255, max(3, image_size // 128))
+    rois = dict(box=[width // 4, height // 4, width * 3 // 4, height * 3 // 4], sketch=sketch)
+
+    start = time.perf_counter()
+    sam_masks = sam_mask_generator.generate(image)
+    synchronize(device)
+    full_s = time.perf_counter() - start
+    results = [make_result("roi", dict(variant=variant, image_size=image_size, roi="none", roi_crop=False),
+                           dict(generate_s=full_s, num_points=points_per_side ** 2, num_masks=len(sam_masks), speedup=1.0))]
+
+    for roi_name, roi in rois.items():
+        num_points = len(build_roi_point_grid(get_roi_mask(roi, image.shape), [0, 0, width, height], points_per_side))
+        for roi_crop in [False, True]:
+            start = time.perf_counter()
+            sam_masks = generate_roi_masks(sam_mask_generator, image, roi, roi_crop)
+            synchronize(device)
+            generate_s = time.perf_counter() - start
+
+            metrics = dict(generate_s=generate_s, num_points=num_points, num_masks=len(sam_masks), speedup=full_s / generate_s)
+            case = dict(variant=variant, image_size=image_size, roi=roi_name, roi_crop=roi_crop)
+            results.append(make_result("roi", case, metrics))
+
+    return results
+
+
+@torch.no_grad()
+def bench_incremental(
+        variant: str,
+        device: torch.device,
+        image_size: int,
+        points_per_side: int = 32,
+        points_per_batch: int = 64,
+        checkpoint_dir: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+    """Measure updating the masks of an image with a changed region against segmenting it again.
+
+    The changed region is a centered square of 1/16 and 1/4 of the image area, as an inpainted object.
+
+    Args:
+        variant (str): variant name
+        device (torch.device): device
+        image_size (int): longest side of the synthetic image
+        points_per_side (int): points per side of the prompt grid
+        points_per_batch (int): points per decoder batch
+        checkpoint_dir (str, optional): models directory with real weights
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    from ia_sam_roi import generate_update_masks
+    from inpalib.samlib import get_changed_mask, merge_sam_masks, sort_masks_by_area
+
+    package = get_sam_package(variant)
+    sam = build_synthetic_sam(variant, device=device, checkpoint=find_checkpoint(variant, checkpoint_dir))
+    sam_mask_generator = package.SamAutomaticMaskGenerator(
+        model=sam, points_per_side=points_per_side, points_per_batch=points_per_batch)
+    image = create_synthetic_image(image_size)
+    height, width = image.shape[:2]
+    sam_masks = sort_masks_by_area(sam_mask_generator.generate(image), (height, width))
+
+    results = []
+    for fraction in [1 / 16, 1 / 4]:
+        side_y, side_x = int(height * fraction ** 0.5), int(width * fraction ** 0.5)
+        y0, x0 = (height - side_y) // 2, (width - side_x) // 2
+        new_image = image.copy()
+        new_image[y0:y0 + side_y, x0:x0 + side_x] = 255 - new_image[y0:y0 + side_y, x0:x0 + side_x]
+
+        start = time.perf_counter()
+        sort_masks_by_area(sam_mask_generator.generate(new_image), (height, width))
+        synchronize(device)
+        full_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        changed_mask = get_changed_mask(image, new_image)
+        new_masks, crop_box = generate_update_masks(sam_mask_generator, new_image, changed_mask)
+        updated = merge_sam_masks(sam_masks, new_masks, changed_mask, crop_box)
+        synchronize(device)
+        update_s = time.perf_counter() - start
+
+        metrics = dict(full_s=full_s, update_s=update_s, speedup=full_s / update_s, num_masks=len(updated))
+        case = dict(variant=variant, image_size=image_size, changed_fraction=fraction, points_per_side=points_per_side)
+        results.append(make_result("incremental", case, metrics))
+
+    return results
+
+
+BENCHMARKS = {
+    "model_size": bench_model_size,
+    "encoder": bench_encoder,
+    "decoder": bench_decoder,
+    "generate": bench_generate,
+    "attention": bench_attention,
+    "resolution": bench_resolution,
+    "precision": bench_precision,
+    "compile": bench_compile,
+    "backend": bench_backend,
+    "token_merging": bench_token_merging,
+    "rectangular": bench_rectangular,
+    "shared_weights": bench_shared_weights,
+    "channels_last": bench_channels_last,
+    "seg_color": bench_seg_color,
+    "mask_set": bench_mask_set,
+    "postprocess": bench_postprocess,
+    "morphology": bench_morphology,
+    "mask_index": bench_mask_index,
+    "mask_file": bench_mask_file,
+    "mask_candidates": bench_mask_candidates,
+    "roi": bench_roi,
+    "incremental": bench_incremental,
+}
+
+
+def run_benchmark(name: str, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run a benchmark in the current process.
+
+    Args:
+        name (str): benchmark name in BENCHMARKS
+        kwargs (Dict[str, Any]): benchmark arguments
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    if "device" in kwargs:
+        kwargs = dict(kwargs, device=torch.device(kwargs["device"]))
+    try:
+        return BENCHMARKS[name](**kwargs)
+    finally:
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def run_benchmark_isolated(name: str, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run a benchmark in a fresh subprocess so that peak RSS is per case.
+
+    Args:
+        name (str): benchmark name in BENCHMARKS
+        kwargs (Dict[str, Any]): benchmark arguments (picklable)
+
+    Returns:
+        List[Dict[str, Any]]: benchmark results
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_benchmark, (name, kwargs))
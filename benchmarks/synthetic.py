@@ -0,0 +1,169 @@
+import importlib
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+ia_basedir = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+if ia_basedir not in sys.path:
+    sys.path.append(ia_basedir)
+
+# variant name -> (package, registry name, model type, SAM model ID)
+SAM_VARIANTS = {
+    "sam_vit_b": ("segment_anything_fb", "sam_model_registry", "vit_b", "sam_vit_b_01ec64.pth"),
+    "sam_vit_l": ("segment_anything_fb", "sam_model_registry", "vit_l", "sam_vit_l_0b3195.pth"),
+    "sam_vit_h": ("segment_anything_fb", "sam_model_registry", "vit_h", "sam_vit_h_4b8939.pth"),
+    "sam_hq_vit_b": ("segment_anything_hq", "sam_model_registry", "vit_b", "sam_hq_vit_b.pth"),
+    "sam_hq_vit_l": ("segment_anything_hq", "sam_model_registry", "vit_l", "sam_hq_vit_l.pth"),
+    "sam_hq_vit_h": ("segment_anything_hq", "sam_model_registry", "vit_h", "sam_hq_vit_h.pth"),
+    "mobile_sam_vit_t": ("mobile_sam", "sam_model_registry", "vit_t", "mobile_sam.pt"),
+}
+
+IMAGE_SIZES = (512, 1024, 2048, 4096)
+
+
+def get_sam_package(variant: str) -> Any:
+    """Import the SAM package implementing a variant.
+
+    Args:
+        variant (str): variant name in SAM_VARIANTS
+
+    Returns:
+        module: SAM package
+    """
+    if variant not in SAM_VARIANTS:
+        raise ValueError(f"Unknown SAM variant: {variant}")
+
+    return importlib.import_module(SAM_VARIANTS[variant][0])
+
+
+def find_checkpoint(variant: str, checkpoint_dir: Optional[str]) -> Optional[str]:
+    """Find the checkpoint of a variant in a models directory.
+
+    Args:
+        variant (str): variant name in SAM_VARIANTS
+        checkpoint_dir (str, optional): models directory
+
+    Returns:
+        str or None: checkpoint path, None if not found
+    """
+    if checkpoint_dir is None:
+        return None
+    checkpoint = os.path.join(checkpoint_dir, SAM_VARIANTS[variant][3])
+
+    return checkpoint if os.path.isfile(checkpoint) else None
+
+
+def build_synthetic_sam(
+        variant: str,
+        device: torch.device = torch.device("cpu"),
+        checkpoint: Optional[str] = None,
+        seed: int = 0,
+        ) -> torch.nn.Module:
+    """Build a SAM model with random weights (or from a checkpoint).
+
+    On the meta device no memory is allocated, which is only useful for
+    inspecting the model structure and parameter counts.
+
+    Args:
+        variant (str): variant name in SAM_VARIANTS
+        device (torch.device): device to build the model on
+        checkpoint (str, optional): checkpoint path. Defaults to random weights.
+        seed (int): random seed for the weights
+
+    Returns:
+        torch.nn.Module: SAM model in eval mode
+    """
+    package = get_sam_package(variant)
+    _, registry_name, model_type, _ = SAM_VARIANTS[variant]
+    registry = getattr(package, registry_name)
+
+    torch.manual_seed(seed)
+    if device.type == "meta":
+        with torch.device("meta"):
+            sam = registry[model_type]()
+    else:
+        sam = registry[model_type](checkpoint=checkpoint)
+        if checkpoint is None:
+            # relative positional embeddings are zero initialized, which would hide their cost and errors
+            for name, param in sam.named_parameters():
+                if "rel_pos" in name:
+                    torch.nn.init.normal_(param, std=0.02)
+        sam.to(device=device)
+    sam.eval()
+
+    return sam
+
+
+def count_parameters(model: torch.nn.Module) -> Tuple[int, int]:
+    """Count model parameters.
+
+    Args:
+        model (torch.nn.Module): model
+
+    Returns:
+        Tuple[int, int]: number of parameters and their size in bytes
+    """
+    num_params = sum(p.numel() for p in model.parameters())
+    num_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+
+    return num_params, num_bytes
+
+
+def create_synthetic_image(size: int, aspect_ratio: float = 1.0, num_shapes: int = 64, seed: int = 0) -> np.ndarray:
+    """Create a synthetic RGB image with flat regions and rectangles.
+
+    Args:
+        size (int): length of the longest side
+        aspect_ratio (float): width / height
+        num_shapes (int): number of rectangles drawn over the background gradient
+        seed (int): random seed
+
+    Returns:
+        np.ndarray: image in HWC uint8 format
+    """
+    rng = np.random.default_rng(seed)
+    if aspect_ratio >= 1.0:
+        width, height = size, max(1, int(round(size / aspect_ratio)))
+    else:
+        width, height = max(1, int(round(size * aspect_ratio))), size
+
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = np.stack([gradient, gradient[:, ::-1], np.full_like(gradient, 128)], axis=-1).astype(np.uint8)
+
+    for _ in range(num_shapes):
+        x0, x1 = np.sort(rng.integers(0, width, size=2))
+        y0, y1 = np.sort(rng.integers(0, height, size=2))
+        image[y0:y1 + 1, x0:x1 + 1] = rng.integers(0, 256, size=3, dtype=np.uint8)
+
+    return image
+
+
+def create_synthetic_masks(size: int, num_masks: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Create synthetic SAM masks of overlapping ellipses, sorted by area.
+
+    Args:
+        size (int): height and width of the masks
+        num_masks (int): number of masks
+        seed (int): random seed
+
+    Returns:
+        List[Dict[str, Any]]: SAM masks with segmentation, area and bbox (XYWH, as in SamAutomaticMaskGenerator)
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.ogrid[:size, :size]
+    sam_masks = []
+    for _ in range(num_masks):
+        cx, cy = rng.uniform(0, size, size=2)
+        rx, ry = rng.uniform(size / 64, size / 4, size=2)
+        segmentation = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1.0
+        ys, xs = np.nonzero(segmentation)
+        if len(xs) == 0:
+            continue
+        bbox = [int(xs.min()), int(ys.min()), int(xs.max() - xs.min()), int(ys.max() - ys.min())]
+        sam_masks.append(dict(segmentation=segmentation, area=int(len(xs)), bbox=bbox))
+
+    return sorted(sam_masks, key=lambda x: x["area"])
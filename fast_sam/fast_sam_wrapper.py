@@ -7,6 +7,8 @@ import numpy as np
 import torch
 import ultralytics
 
+from ia_mask_morphology import close_open_mask, close_open_masks_torch, resize_masks
+
 if hasattr(ultralytics, "FastSAM"):
     from ultralytics import FastSAM as YOLO
 else:
@@ -76,15 +78,12 @@ class FastSamAutomaticMaskGenerator:
 
         annotations = results[0].masks.data
 
-        if isinstance(annotations[0], torch.Tensor):
-            annotations = np.array(annotations.cpu())
-
-        annotations_list = []
-        for i, mask in enumerate(annotations):
-            mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
-            mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_OPEN, np.ones((7, 7), np.uint8))
-            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_AREA)
-
-            annotations_list.append(dict(segmentation=mask.astype(bool)))
+        if isinstance(annotations, torch.Tensor):
+            annotations = close_open_masks_torch(annotations, 3, 7).to(dtype=torch.uint8).cpu().numpy()
+        else:
+            annotations = [mask.astype(bool) for mask in annotations]
+            for mask in annotations:
+                close_open_mask(mask, 3, 7)
+            annotations = [mask.astype(np.uint8) for mask in annotations]
 
-        return annotations_list
+        return resize_masks(annotations, (width, height))
@@ -0,0 +1,218 @@
+import os
+import time
+from functools import wraps
+
+import torch
+
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+
+SAM_COMPILE_MODES = ["trace", "inductor"]
+
+
+def get_compile_cache_dir():
+    """Get the directory of compiled graph artifacts.
+
+    Returns:
+        str: compiled graph cache directory
+    """
+    compile_cache_dir = os.path.join(ia_file_manager.cache_dir, "compiled")
+    if not os.path.isdir(compile_cache_dir):
+        os.makedirs(compile_cache_dir, exist_ok=True)
+
+    return compile_cache_dir
+
+
+def setup_inductor_cache():
+    """Store the torch.compile (inductor) artifacts in the cache directory.
+
+    Returns:
+        None
+    """
+    if "TORCHINDUCTOR_CACHE_DIR" not in os.environ:
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(get_compile_cache_dir(), "inductor")
+    try:
+        import torch._inductor.config as inductor_config
+        if hasattr(inductor_config, "fx_graph_cache"):
+            inductor_config.fx_graph_cache = True
+    except Exception as e:
+        ia_logging.warning(f"Failed to configure the inductor cache: {e}")
+
+
+def get_traced_cache_path(model_key, device, inputs):
+    """Get the file path of a traced graph.
+
+    Args:
+        model_key (str): model identifier, including its weights and precision
+        device (torch.device): device
+        inputs (torch.Tensor): example input
+
+    Returns:
+        str: traced graph file path
+    """
+    shape = "x".join([str(s) for s in inputs.shape])
+    dtype = str(inputs.dtype).replace("torch.", "")
+    torch_version = torch.__version__.replace("+", "_")
+    file_name = f"{model_key}_{device.type}_{dtype}_{shape}_torch{torch_version}.pt"
+
+    return os.path.join(get_compile_cache_dir(), file_name)
+
+
+def log_call_time(name, forward):
+    """Log the time of the first call and of the second (steady state) call of a forward.
+
+    Args:
+        name (str): name in the log
+        forward (Callable): forward function
+
+    Returns:
+        Callable: forward function
+    """
+    state = dict(num_calls=0)
+
+    @wraps(forward)
+    def wrapper(*args, **kwargs):
+        if state["num_calls"] >= 2 or torch.jit.is_tracing():
+            return forward(*args, **kwargs)
+
+        start_time = time.perf_counter()
+        outputs = forward(*args, **kwargs)
+        elapsed_time = time.perf_counter() - start_time
+        state["num_calls"] += 1
+        if state["num_calls"] == 1:
+            ia_logging.info(f"{name} first call (including compilation): {elapsed_time:.3f}s")
+        else:
+            ia_logging.info(f"{name} steady-state call: {elapsed_time:.3f}s")
+
+        return outputs
+
+    return wrapper
+
+
+def trace_forward(module, model_key):
+    """Replace the forward of a module with TorchScript graphs traced per input shape.
+
+    The traced graphs are saved to the cache directory and loaded on later runs.
+    If tracing fails, the eager forward is used for that input shape.
+
+    Args:
+        module (torch.nn.Module): module taking a single tensor input
+        model_key (str): model identifier, including its weights and precision
+
+    Returns:
+        torch.nn.Module: module
+    """
+    eager_forward = module.forward
+    state = dict(tracing=False, graphs={})
+
+    @wraps(eager_forward)
+    def wrapper(x):
+        if state["tracing"] or torch.is_grad_enabled():
+            return eager_forward(x)
+
+        device = x.device
+        cache_key = (device, x.dtype, tuple(x.shape))
+        if cache_key not in state["graphs"]:
+            traced_path = get_traced_cache_path(model_key, device, x)
+            graph = None
+            if os.path.isfile(traced_path):
+                try:
+                    graph = torch.jit.load(traced_path, map_location=device)
+                    ia_logging.info(f"Loaded traced graph from {traced_path}")
+                except Exception as e:
+                    ia_logging.warning(f"Failed to load traced graph: {e}")
+            if graph is None:
+                state["tracing"] = True
+                try:
+                    graph = torch.jit.trace(module, x, check_trace=False)
+                    tmp_path = traced_path + ".tmp"
+                    torch.jit.save(graph, tmp_path)
+                    os.replace(tmp_path, traced_path)
+                    ia_logging.info(f"Saved traced graph to {traced_path}")
+                except Exception as e:
+                    ia_logging.warning(f"Failed to trace {module.__class__.__name__}, using eager mode: {e}")
+                    graph = None
+                finally:
+                    state["tracing"] = False
+            state["graphs"][cache_key] = graph
+
+        graph = state["graphs"][cache_key]
+        if graph is None:
+            return eager_forward(x)
+
+        return graph(x)
+
+    module.forward = log_call_time(f"{module.__class__.__name__} (trace)", wrapper)
+
+    return module
+
+
+def compile_forward(module, **compile_kwargs):
+    """Replace the forward of a module with torch.compile, falling back to eager mode on failure.
+
+    Args:
+        module (torch.nn.Module): module
+        **compile_kwargs: torch.compile arguments
+
+    Returns:
+        torch.nn.Module: module
+    """
+    if not hasattr(torch, "compile"):
+        ia_logging.warning("torch.compile is not available, using eager mode")
+        return module
+
+    setup_inductor_cache()
+    eager_forward = module.forward
+    compiled_forward = torch.compile(eager_forward, **compile_kwargs)
+    state = dict(enabled=True)
+
+    @wraps(eager_forward)
+    def wrapper(*args, **kwargs):
+        if state["enabled"]:
+            try:
+                return compiled_forward(*args, **kwargs)
+            except Exception as e:
+                ia_logging.warning(f"Failed to compile {module.__class__.__name__}, using eager mode: {e}")
+                state["enabled"] = False
+
+        return eager_forward(*args, **kwargs)
+
+    module.forward = log_call_time(f"{module.__class__.__name__} (torch.compile)", wrapper)
+
+    return module
+
+
+def compile_sam_encoder(sam, mode, model_key):
+    """Compile the image encoder of a SAM model.
+
+    Args:
+        sam (Sam): SAM model
+        mode (str): "trace" (TorchScript) or "inductor" (torch.compile)
+        model_key (str): model identifier, including its weights and precision
+
+    Returns:
+        Sam: SAM model
+    """
+    if mode not in SAM_COMPILE_MODES:
+        raise ValueError(f"Invalid SAM compile mode: {mode}")
+
+    if mode == "trace":
+        trace_forward(sam.image_encoder, model_key)
+    else:
+        compile_forward(sam.image_encoder, dynamic=False)
+
+    return sam
+
+
+def compile_unet(pipe):
+    """Compile the UNet of a diffusers pipeline with torch.compile.
+
+    Args:
+        pipe (DiffusionPipeline): diffusers pipeline
+
+    Returns:
+        DiffusionPipeline: diffusers pipeline
+    """
+    compile_forward(pipe.unet, dynamic=False)
+
+    return pipe
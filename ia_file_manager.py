@@ -14,6 +14,8 @@ class IAFileManager:
 
         self._ia_models_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "models")
 
+        self._ia_cache_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cache")
+
     @property
     def outputs_dir(self) -> str:
         """Get inpaint-anything outputs directory.
@@ -36,6 +38,17 @@ class IAFileManager:
             os.makedirs(self._ia_models_dir, exist_ok=True)
         return self._ia_models_dir
 
+    @property
+    def cache_dir(self) -> str:
+        """Get inpaint-anything cache directory.
+
+        Returns:
+            str: inpaint-anything cache directory
+        """
+        if not os.path.isdir(self._ia_cache_dir):
+            os.makedirs(self._ia_cache_dir, exist_ok=True)
+        return self._ia_cache_dir
+
     @property
     def savename_prefix(self) -> str:
         """Get inpaint-anything savename prefix.
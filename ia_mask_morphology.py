@@ -0,0 +1,214 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def get_morphology_padding(close_size, open_size):
+    """Get the padding around the bounding box of a mask, within which closing and opening the mask is exact.
+
+    Closing with a kernel of radius r1 reads the mask up to 2 * r1 away from its bounding box,
+    and opening the closed mask with a kernel of radius r2 reads it up to r1 + 2 * r2 away.
+
+    Args:
+        close_size (int): kernel size of the closing
+        open_size (int): kernel size of the opening
+
+    Returns:
+        int: padding in pixels
+    """
+    close_radius, open_radius = close_size // 2, open_size // 2
+
+    return max(2 * close_radius, close_radius + 2 * open_radius)
+
+
+def get_mask_bbox_slices(segmentation, bbox=None, padding=0):
+    """Get the slices of the padded bounding box of a mask, clipped to the mask.
+
+    Args:
+        segmentation (np.ndarray): mask
+        bbox (list[int], optional): bounding box in XYWH format as in SamAutomaticMaskGenerator,
+            computed from the mask if None
+        padding (int): padding around the bounding box
+
+    Returns:
+        tuple[slice, slice] or None: row and column slices, None if the mask is empty
+    """
+    height, width = segmentation.shape[:2]
+    if bbox is None:
+        rows = np.flatnonzero(np.any(segmentation, axis=1))
+        if len(rows) == 0:
+            return None
+        cols = np.flatnonzero(np.any(segmentation[rows[0]:rows[-1] + 1], axis=0))
+        x0, y0, x1, y1 = cols[0], rows[0], cols[-1], rows[-1]
+    else:
+        x0, y0 = int(bbox[0]), int(bbox[1])
+        x1, y1 = x0 + int(bbox[2]), y0 + int(bbox[3])
+
+    return (slice(max(0, y0 - padding), min(height, y1 + padding + 1)),
+            slice(max(0, x0 - padding), min(width, x1 + padding + 1)))
+
+
+def get_area_and_bbox(crop, slices):
+    """Get the area and the bounding box of a mask from its crop.
+
+    Args:
+        crop (np.ndarray): mask within the slices in uint8
+        slices (tuple[slice, slice]): row and column slices of the crop
+
+    Returns:
+        tuple[int, list[int]]: area, and bounding box in XYWH format as in SamAutomaticMaskGenerator
+    """
+    area = cv2.countNonZero(crop)
+    if area == 0:
+        return 0, [0, 0, 0, 0]
+    x, y, w, h = cv2.boundingRect(crop)
+
+    return area, [slices[1].start + x, slices[0].start + y, w - 1, h - 1]
+
+
+def close_open_mask(segmentation, close_size, open_size, bbox=None):
+    """Close then open a mask in place with square kernels, within its padded bounding box only.
+
+    The result is the same as closing and opening the full mask with cv2.morphologyEx.
+
+    Args:
+        segmentation (np.ndarray): mask in bool, modified in place
+        close_size (int): kernel size of the closing
+        open_size (int): kernel size of the opening
+        bbox (list[int], optional): bounding box in XYWH format as in SamAutomaticMaskGenerator,
+            computed from the mask if None
+
+    Returns:
+        tuple[int, list[int]]: area and bounding box of the processed mask
+    """
+    slices = get_mask_bbox_slices(segmentation, bbox, get_morphology_padding(close_size, open_size))
+    if slices is None:
+        return 0, [0, 0, 0, 0]
+
+    crop = segmentation[slices].astype(np.uint8)
+    crop = cv2.morphologyEx(crop, cv2.MORPH_CLOSE, np.ones((close_size, close_size), np.uint8))
+    crop = cv2.morphologyEx(crop, cv2.MORPH_OPEN, np.ones((open_size, open_size), np.uint8))
+    segmentation[slices] = crop.astype(bool)
+
+    return get_area_and_bbox(crop, slices)
+
+
+def close_open_masks(
+        sam_masks: List[Dict[str, Any]],
+        close_size: int,
+        open_size: int,
+        num_workers: Optional[int] = None,
+        ) -> List[Dict[str, Any]]:
+    """Close then open SAM masks in place, within their padded bounding boxes, on a thread pool.
+
+    Args:
+        sam_masks (List[Dict[str, Any]]): SAM masks, the segmentation, area and bbox are updated
+        close_size (int): kernel size of the closing
+        open_size (int): kernel size of the opening
+        num_workers (int, optional): number of threads. Defaults to None (up to 8, depending on the CPU count).
+
+    Returns:
+        List[Dict[str, Any]]: SAM masks
+    """
+    def process(sam_mask):
+        if sam_mask["segmentation"].dtype != bool:
+            sam_mask["segmentation"] = sam_mask["segmentation"].astype(bool)
+        sam_mask["area"], sam_mask["bbox"] = close_open_mask(
+            sam_mask["segmentation"], close_size, open_size, sam_mask.get("bbox", None))
+
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+    if num_workers <= 1 or len(sam_masks) <= 1:
+        for sam_mask in sam_masks:
+            process(sam_mask)
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(process, sam_masks))
+
+    return sam_masks
+
+
+def close_open_masks_torch(masks, close_size, open_size, batch_size=16):
+    """Close then open masks on their device with max pooling, in batches.
+
+    Max pooling pads with -inf, so that the borders are handled as by cv2.morphologyEx.
+
+    Args:
+        masks (torch.Tensor): masks in NxHxW format
+        close_size (int): odd kernel size of the closing
+        open_size (int): odd kernel size of the opening
+        batch_size (int): number of masks processed at once
+
+    Returns:
+        torch.Tensor: masks in bool
+    """
+    if close_size % 2 == 0 or open_size % 2 == 0:
+        raise ValueError("Kernel sizes must be odd")
+
+    def dilate(x, size):
+        return F.max_pool2d(x, size, stride=1, padding=size // 2)
+
+    def erode(x, size):
+        return -F.max_pool2d(-x, size, stride=1, padding=size // 2)
+
+    dtype = torch.float16 if masks.device.type == "cuda" else torch.float32
+    outputs = []
+    for batch in torch.split(masks, batch_size):
+        x = batch.unsqueeze(1).to(dtype=dtype)
+        x = erode(dilate(x, close_size), close_size)
+        x = dilate(erode(x, open_size), open_size)
+        outputs.append(x.squeeze(1) > 0.5)
+
+    return torch.cat(outputs) if len(outputs) > 0 else masks.bool()
+
+
+def resize_mask(mask, size):
+    """Resize a mask with area interpolation.
+
+    The full mask is resized, since the area interpolation weights depend on the position
+    of a pixel in the full mask.
+
+    Args:
+        mask (np.ndarray): mask in uint8
+        size (tuple[int, int]): output width and height
+
+    Returns:
+        tuple[np.ndarray, int, list[int]]: resized mask in bool, its area and its bounding box
+            in XYWH format as in SamAutomaticMaskGenerator
+    """
+    mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+    area, bbox = get_area_and_bbox(mask, (slice(0, mask.shape[0]), slice(0, mask.shape[1])))
+
+    return mask.astype(bool), area, bbox
+
+
+def resize_masks(
+        masks: Sequence[np.ndarray],
+        size: Tuple[int, int],
+        num_workers: Optional[int] = None,
+        ) -> List[Dict[str, Any]]:
+    """Resize masks on a thread pool, into SAM masks.
+
+    Args:
+        masks (Sequence[np.ndarray]): masks in uint8
+        size (Tuple[int, int]): output width and height
+        num_workers (int, optional): number of threads. Defaults to None (up to 8, depending on the CPU count).
+
+    Returns:
+        List[Dict[str, Any]]: SAM masks with segmentation, area and bbox
+    """
+    def process(mask):
+        segmentation, area, bbox = resize_mask(mask, size)
+        return dict(segmentation=segmentation, area=area, bbox=bbox)
+
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+    if num_workers <= 1 or len(masks) <= 1:
+        return [process(mask) for mask in masks]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(process, masks))
@@ -0,0 +1,160 @@
+import hashlib
+import weakref
+from collections import OrderedDict
+
+import torch
+
+from ia_logging import ia_logging
+
+
+def get_tensor_fingerprint(tensor):
+    """Get the fingerprint of a tensor, computed from its dtype, shape and contents.
+
+    Args:
+        tensor (torch.Tensor): tensor
+
+    Returns:
+        tuple: fingerprint
+    """
+    data = tensor.detach().cpu().contiguous().reshape(-1)
+    digest = hashlib.blake2b(data.view(torch.uint8).numpy(), digest_size=16)
+
+    return str(tensor.dtype), tuple(tensor.shape), digest.hexdigest()
+
+
+def is_same_device(tensor_device, device):
+    """Check if a tensor device is the device a model is moved to, "cuda" matching "cuda:0".
+
+    Args:
+        tensor_device (torch.device): device of a tensor
+        device (torch.device): device
+
+    Returns:
+        bool: True if same else False
+    """
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+
+    return tensor_device == device
+
+
+def get_module_tensors(model):
+    """Get the parameters and the buffers of a model with the modules holding them.
+
+    Args:
+        model (torch.nn.Module): model
+
+    Returns:
+        list[tuple]: (module, tensor dict, name, tensor) tuples
+    """
+    module_tensors = []
+    for module in model.modules():
+        for tensors in [module._parameters, module._buffers]:
+            for name, tensor in tensors.items():
+                if tensor is not None and not tensor.is_quantized and tensor.numel() > 0:
+                    module_tensors.append((module, tensors, name, tensor))
+
+    return module_tensors
+
+
+def get_tensors_size(models):
+    """Get the size of the parameters and the buffers of models, counting shared storages once.
+
+    Args:
+        models (list[torch.nn.Module]): models
+
+    Returns:
+        int: size in bytes
+    """
+    storages = {}
+    for model in models:
+        for _, _, _, tensor in get_module_tensors(model):
+            storage = tensor.untyped_storage()
+            storages[(storage.device, storage.data_ptr())] = storage.nbytes()
+
+    return sum(storages.values())
+
+
+class SamModelCache:
+    def __init__(self) -> None:
+        self._models = OrderedDict()
+        self._tensors = weakref.WeakValueDictionary()
+
+    def get(self, key):
+        """Get a cached model and mark it as the most recently used.
+
+        Args:
+            key (tuple): model cache key
+
+        Returns:
+            Any: model, None if not cached
+        """
+        if key not in self._models:
+            return None
+        self._models.move_to_end(key)
+
+        return self._models[key]
+
+    def put(self, key, model, max_models):
+        """Cache a model, evicting the least recently used models beyond max_models.
+
+        Args:
+            key (tuple): model cache key
+            model (Any): model
+            max_models (int): maximum number of cached models
+
+        Returns:
+            None
+        """
+        self._models[key] = model
+        self._models.move_to_end(key)
+        while len(self._models) > max(max_models, 0):
+            evicted_key, _ = self._models.popitem(last=False)
+            ia_logging.info(f"Evicted SAM model from the cache: {evicted_key[0]}")
+
+    def clear(self):
+        """Remove all cached models.
+
+        Returns:
+            None
+        """
+        self._models.clear()
+
+    def share_tensors(self, model, device):
+        """Move a model to a device, sharing the storage of tensors identical to those of the cached models.
+
+        The tensors are fingerprinted before the model is moved, so that tensors found
+        in the cache are not copied to the device again. Shared tensors are read-only
+        in practice: none of the SAM models modifies its weights in place after loading.
+
+        Args:
+            model (torch.nn.Module): model
+            device (torch.device): device
+
+        Returns:
+            torch.nn.Module: model
+        """
+        fingerprints = []
+        shared_bytes = 0
+        for module, tensors, name, tensor in get_module_tensors(model):
+            fingerprint = get_tensor_fingerprint(tensor)
+            shared_tensor = self._tensors.get(fingerprint)
+            if (shared_tensor is not None and is_same_device(shared_tensor.device, device) and
+                    isinstance(shared_tensor, torch.nn.Parameter) == isinstance(tensor, torch.nn.Parameter)):
+                tensors[name] = shared_tensor
+                shared_bytes += shared_tensor.numel() * shared_tensor.element_size()
+            fingerprints.append(fingerprint)
+
+        model.to(device=device)
+
+        for fingerprint, (_, _, _, tensor) in zip(fingerprints, get_module_tensors(model)):
+            if fingerprint not in self._tensors:
+                self._tensors[fingerprint] = tensor
+        if shared_bytes > 0:
+            ia_logging.info(f"Shared {shared_bytes / (1024 ** 2):.1f} MiB of weights with cached SAM models")
+
+        return model
+
+
+sam_model_cache = SamModelCache()
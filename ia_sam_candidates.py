@@ -0,0 +1,174 @@
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+from torchvision.ops.boxes import batched_nms, box_area
+
+from segment_anything_fb import SamAutomaticMaskGenerator
+from segment_anything_fb.utils.amg import MaskData, area_from_rle, box_xyxy_to_xywh, coco_encode_rle, rle_to_mask
+from segment_anything_fb.utils.torch_nms import nms
+
+
+def box_nms(boxes, scores, iou_threshold):
+    """Run box NMS, falling back to the pure PyTorch NMS as in SamAutomaticMaskGenerator.
+
+    Args:
+        boxes (torch.Tensor): boxes in XYXY format
+        scores (torch.Tensor): scores
+        iou_threshold (float): box IoU above which the box with the lower score is removed
+
+    Returns:
+        torch.Tensor: indices of the kept boxes, by decreasing score
+    """
+    try:
+        return batched_nms(boxes.float(), scores, torch.zeros_like(boxes[:, 0]), iou_threshold=iou_threshold)
+    except Exception:
+        return nms(boxes.float(), scores, iou_threshold=iou_threshold)
+
+
+class SamMaskCandidates:
+    """Candidate masks of a SAM mask generator, before NMS and postprocessing.
+
+    The candidates are the masks passing the thresholds of the generator they come from.
+    Masks for higher thresholds, other NMS IoU thresholds or another min_mask_region_area
+    are obtained with filter, without running SAM again.
+    """
+
+    def __init__(self, mask_data: MaskData, pred_iou_thresh: float, stability_score_thresh: float, output_mode: str) -> None:
+        """Initialize candidate masks, use generate_sam_mask_candidates to create them.
+
+        Args:
+            mask_data (MaskData): masks in RLE with their boxes, scores, points and crop boxes, in numpy
+            pred_iou_thresh (float): predicted IoU threshold the candidates pass
+            stability_score_thresh (float): stability score threshold the candidates pass
+            output_mode (str): output mode of the generator
+        """
+        self.mask_data = mask_data
+        self.pred_iou_thresh = pred_iou_thresh
+        self.stability_score_thresh = stability_score_thresh
+        self.output_mode = output_mode
+
+    def __len__(self) -> int:
+        return len(self.mask_data["rles"])
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the candidates in bytes, counting 8 bytes per RLE run length."""
+        rles_nbytes = 8 * sum(len(rle["counts"]) for rle in self.mask_data["rles"])
+
+        return rles_nbytes + sum(value.nbytes for _, value in self.mask_data.items() if isinstance(value, np.ndarray))
+
+    def can_filter(self, pred_iou_thresh: float, stability_score_thresh: float) -> bool:
+        """Check if the candidates hold all the masks passing the thresholds.
+
+        Args:
+            pred_iou_thresh (float): predicted IoU threshold
+            stability_score_thresh (float): stability score threshold
+
+        Returns:
+            bool: True if the thresholds are not below those of the candidates else False
+        """
+        return pred_iou_thresh >= self.pred_iou_thresh and stability_score_thresh >= self.stability_score_thresh
+
+    def filter(
+            self,
+            pred_iou_thresh: float = 0.88,
+            stability_score_thresh: float = 0.95,
+            box_nms_thresh: float = 0.7,
+            crop_nms_thresh: float = 0.7,
+            min_mask_region_area: int = 0,
+            ) -> List[Dict[str, Any]]:
+        """Filter the candidates into SAM masks, as SamAutomaticMaskGenerator.generate would.
+
+        Args:
+            pred_iou_thresh (float): predicted IoU threshold
+            stability_score_thresh (float): stability score threshold
+            box_nms_thresh (float): box IoU cutoff of the NMS within a crop
+            crop_nms_thresh (float): box IoU cutoff of the NMS between crops
+            min_mask_region_area (int): area of the disconnected regions and holes to remove, 0 to skip
+
+        Returns:
+            List[Dict[str, Any]]: SAM masks
+        """
+        if not self.can_filter(pred_iou_thresh, stability_score_thresh):
+            raise ValueError(f"Thresholds below those of the candidates ({self.pred_iou_thresh}, {self.stability_score_thresh})")
+        if len(self) == 0:
+            return []
+
+        data = MaskData(**dict(self.mask_data.items()))
+        keep = np.ones(len(self), dtype=bool)
+        if pred_iou_thresh > 0.0:
+            keep &= data["iou_preds"] > pred_iou_thresh
+        if stability_score_thresh > 0.0:
+            keep &= data["stability_score"] >= stability_score_thresh
+        data.filter(torch.as_tensor(keep))
+
+        # Remove duplicates within each crop, taking the crops in the order they were processed
+        crop_boxes, first_idxs, crop_idxs = np.unique(data["crop_boxes"], axis=0, return_index=True, return_inverse=True)
+        crop_idxs = crop_idxs.ravel()
+        keep_idxs = [np.zeros(0, dtype=np.int64)]
+        for crop_idx in np.argsort(first_idxs):
+            idxs = np.flatnonzero(crop_idxs == crop_idx)
+            keep_by_nms = box_nms(torch.as_tensor(data["boxes"][idxs]), torch.as_tensor(data["iou_preds"][idxs]), box_nms_thresh)
+            keep_idxs.append(idxs[keep_by_nms.cpu().numpy()])
+        data.filter(torch.as_tensor(np.concatenate(keep_idxs)))
+
+        # Remove duplicate masks between crops, preferring masks from smaller crops
+        if len(crop_boxes) > 1:
+            scores = 1 / box_area(torch.as_tensor(data["crop_boxes"]))
+            data.filter(box_nms(torch.as_tensor(data["boxes"]), scores, crop_nms_thresh))
+
+        # The filtered lists and arrays are new, the candidates are left unchanged
+        if min_mask_region_area > 0:
+            data = SamAutomaticMaskGenerator.postprocess_small_regions(
+                data, min_mask_region_area, max(box_nms_thresh, crop_nms_thresh))
+
+        if self.output_mode == "coco_rle":
+            segmentations = [coco_encode_rle(rle) for rle in data["rles"]]
+        elif self.output_mode == "binary_mask":
+            segmentations = [rle_to_mask(rle) for rle in data["rles"]]
+        else:
+            segmentations = data["rles"]
+
+        return [
+            {
+                "segmentation": segmentations[idx],
+                "area": area_from_rle(data["rles"][idx]),
+                "bbox": box_xyxy_to_xywh(data["boxes"][idx]).tolist(),
+                "predicted_iou": data["iou_preds"][idx].item(),
+                "point_coords": [data["points"][idx].tolist()],
+                "stability_score": data["stability_score"][idx].item(),
+                "crop_box": box_xyxy_to_xywh(data["crop_boxes"][idx]).tolist(),
+            }
+            for idx in range(len(segmentations))
+        ]
+
+
+@torch.no_grad()
+def generate_sam_mask_candidates(sam_mask_generator, image):
+    """Generate the candidate masks of a SAM mask generator, skipping NMS and postprocessing.
+
+    Args:
+        sam_mask_generator (SamAutomaticMaskGenerator): SAM mask generator, from segment_anything_fb,
+            segment_anything_hq or mobile_sam
+        image (np.ndarray): image in HWC uint8 format
+
+    Returns:
+        SamMaskCandidates: candidate masks passing the thresholds of the generator
+
+    Raises:
+        ValueError: if the generator does not support candidate masks
+    """
+    if not hasattr(sam_mask_generator, "_generate_masks"):
+        raise ValueError(f"{sam_mask_generator.__class__.__name__} does not support candidate masks")
+
+    # NMS with an IoU cutoff of 1.0 keeps all the masks, they are removed in filter
+    nms_threshs = sam_mask_generator.box_nms_thresh, sam_mask_generator.crop_nms_thresh
+    sam_mask_generator.box_nms_thresh = sam_mask_generator.crop_nms_thresh = 1.0
+    try:
+        mask_data = sam_mask_generator._generate_masks(image)
+    finally:
+        sam_mask_generator.box_nms_thresh, sam_mask_generator.crop_nms_thresh = nms_threshs
+
+    return SamMaskCandidates(mask_data, sam_mask_generator.pred_iou_thresh,
+                             sam_mask_generator.stability_score_thresh, sam_mask_generator.output_mode)
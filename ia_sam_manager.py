@@ -5,9 +5,15 @@ import torch
 
 from fast_sam import FastSamAutomaticMaskGenerator, fast_sam_model_registry
 from ia_check_versions import ia_check_versions
+from ia_compile import compile_sam_encoder
 from ia_config import IAConfig
 from ia_devices import devices
 from ia_logging import ia_logging
+from ia_sam_cache import sam_model_cache
+from ia_sam_onnx import (OnnxSam, OnnxSamPredictor, export_sam_onnx, get_onnx_cache_dir, get_onnx_cache_meta,
+                         load_onnx_config)
+from ia_sam_precision import apply_sam_precision
+from ia_sam_quantize import load_quantized_sam
 from mobile_sam import SamAutomaticMaskGenerator as SamAutomaticMaskGeneratorMobile
 from mobile_sam import SamPredictor as SamPredictorMobile
 from mobile_sam import sam_model_registry as sam_model_registry_mobile
@@ -17,11 +23,405 @@ from segment_anything_hq import SamPredictor as SamPredictorHQ
 from segment_anything_hq import sam_model_registry as sam_model_registry_hq
 
 
-def get_sam_mask_generator(sam_checkpoint, anime_style_chk=False):
+def set_sam_img_size(sam, img_size):
+    """Set the input image size of a SAM model.
+
+    Args:
+        sam (Sam): SAM model
+        img_size (int): input image size of the image encoder
+
+    Returns:
+        bool: True if the input image size has been set else False
+    """
+    if getattr(getattr(sam, "image_encoder", None), "img_size", None) == img_size:
+        return True
+    if not hasattr(sam, "set_img_size"):
+        ia_logging.warning(f"{sam.__class__.__name__} does not support changing the input image size")
+        return False
+    try:
+        sam.set_img_size(img_size)
+    except NotImplementedError as e:
+        ia_logging.warning(str(e))
+        return False
+
+    return True
+
+
+def set_sam_rectangular_input(sam, enabled):
+    """Enable or disable the non-square input mode of a SAM model.
+
+    Args:
+        sam (Sam): SAM model
+        enabled (bool): True to pad images to multiples of the window size instead of a square
+
+    Returns:
+        bool: True if the mode has been set else False
+    """
+    if not hasattr(sam, "set_rectangular_input"):
+        ia_logging.warning(f"{sam.__class__.__name__} does not support non-square inputs")
+        return False
+    try:
+        sam.set_rectangular_input(enabled)
+    except NotImplementedError as e:
+        ia_logging.warning(str(e))
+        return False
+
+    return True
+
+
+def set_sam_channels_last(sam, enabled):
+    """Enable or disable the channels-last mode of the conv stacks of a SAM model.
+
+    Args:
+        sam (Sam): SAM model
+        enabled (bool): True to run the conv stacks in channels-last with fused LayerNorm2d
+
+    Returns:
+        bool: True if the mode has been set else False
+    """
+    if not hasattr(sam, "set_channels_last"):
+        ia_logging.warning(f"{sam.__class__.__name__} does not support channels-last")
+        return False
+    sam.set_channels_last(enabled)
+
+    return True
+
+
+def set_sam_sdpa(sam, attn_indexes=None):
+    """Enable scaled_dot_product_attention in the attention layers of a SAM model.
+
+    Args:
+        sam (Sam): SAM model
+        attn_indexes (list[int], optional): image encoder blocks using it. Defaults to the global attention blocks.
+
+    Returns:
+        bool: True if scaled_dot_product_attention has been enabled else False
+    """
+    if not hasattr(sam, "set_sdpa"):
+        ia_logging.warning(f"{sam.__class__.__name__} does not support scaled_dot_product_attention")
+        return False
+    sam.set_sdpa(True, attn_indexes)
+
+    return True
+
+
+def set_sam_token_merging(sam, ratios):
+    """Set the token merging ratios of the global attention blocks of a SAM image encoder.
+
+    Args:
+        sam (Sam): SAM model
+        ratios (list[float]): one ratio for all global attention blocks, or one ratio per block
+
+    Returns:
+        bool: True if token merging has been set else False
+    """
+    image_encoder = getattr(sam, "image_encoder", None)
+    if not hasattr(image_encoder, "set_token_merging"):
+        ia_logging.warning(f"{image_encoder.__class__.__name__} does not support token merging")
+        return False
+
+    global_attn_indexes = image_encoder.global_attn_indexes
+    if len(ratios) == 1:
+        ratio = ratios[0]
+    elif len(ratios) == len(global_attn_indexes):
+        ratio = dict(zip(global_attn_indexes, ratios))
+    else:
+        ia_logging.warning(f"Token merging needs 1 or {len(global_attn_indexes)} ratios for this model, got {len(ratios)}")
+        return False
+    image_encoder.set_token_merging(ratio)
+    ia_logging.info(f"SAM token merging ratios: {ratios}")
+
+    return True
+
+
+def get_sam_device(sam_checkpoint):
+    """Get the device to run SAM on.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        torch.device: device
+    """
+    if platform.system() == "Darwin":
+        if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
+            return torch.device("cpu")
+        else:
+            return torch.device("mps")
+    else:
+        if IAConfig.global_args.get("sam_cpu", False):
+            ia_logging.info("SAM is running on CPU... (the option has been selected)")
+            return devices.cpu
+        else:
+            return devices.device
+
+
+def is_sam_quantize_enabled(sam_checkpoint):
+    """Check if dynamic int8 quantization is enabled for a SAM model.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        bool: True if enabled else False
+    """
+    sam_quantize = IAConfig.global_args.get("sam_quantize", None)
+    if sam_quantize is None or "FastSAM" in os.path.basename(sam_checkpoint):
+        return False
+
+    return len(sam_quantize) == 0 or os.path.basename(sam_checkpoint) in sam_quantize
+
+
+def get_sam_model_key(sam_checkpoint, sam_precision="fp32", quantized=False, token_merging=None, channels_last=False, sdpa=None):
+    """Get the key identifying a SAM model, its weights and its precision.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        sam_precision (str): SAM precision
+        quantized (bool): True if the model is quantized
+        token_merging (list[float], optional): token merging ratios
+        channels_last (bool): True if the conv stacks run in channels-last
+        sdpa (list[int], optional): image encoder blocks using scaled_dot_product_attention, empty for the default blocks
+
+    Returns:
+        str: SAM model key
+    """
+    stat = os.stat(sam_checkpoint)
+    sam_name = os.path.splitext(os.path.basename(sam_checkpoint))[0]
+    precision = "int8" if quantized else sam_precision
+    model_key = f"{sam_name}_{stat.st_size}_{int(stat.st_mtime)}_{precision}"
+    if token_merging:
+        model_key += "_tome" + "-".join([str(ratio) for ratio in token_merging])
+    if channels_last:
+        model_key += "_cl"
+    if sdpa is not None:
+        model_key += "_sdpa" + "-".join([str(i) for i in sdpa])
+
+    return model_key
+
+
+def is_sam_onnx_enabled(sam_checkpoint):
+    """Check if the ONNX Runtime backend is enabled for a SAM model.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        bool: True if enabled else False
+    """
+    if "FastSAM" in os.path.basename(sam_checkpoint):
+        return False
+
+    return IAConfig.global_args.get("sam_backend", "torch") == "onnx"
+
+
+def get_sam_model_registry(sam_checkpoint):
+    """Get the SAM model registry and the model type of a SAM checkpoint.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        tuple: SAM model registry and SAM model type
+    """
+    if "_hq_" in os.path.basename(sam_checkpoint):
+        return sam_model_registry_hq, os.path.basename(sam_checkpoint)[7:12]
+    elif "FastSAM" in os.path.basename(sam_checkpoint):
+        return fast_sam_model_registry, os.path.splitext(os.path.basename(sam_checkpoint))[0]
+    elif "mobile_sam" in os.path.basename(sam_checkpoint):
+        return sam_model_registry_mobile, "vit_t"
+    else:
+        return sam_model_registry, os.path.basename(sam_checkpoint)[4:9]
+
+
+def export_sam_onnx_model(sam_checkpoint, img_size=None):
+    """Export a SAM model to ONNX in the cache directory.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
+
+    Returns:
+        str: directory of the exported model
+    """
+    sam_model_registry_local, model_type = get_sam_model_registry(sam_checkpoint)
+    sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
+    if img_size is not None:
+        set_sam_img_size(sam, img_size)
+
+    return export_sam_onnx(sam, get_onnx_cache_dir(sam_checkpoint, img_size), get_onnx_cache_meta(sam_checkpoint))
+
+
+def get_onnx_sam_model(sam_checkpoint, img_size=None):
+    """Load SAM model running on ONNX Runtime, exporting it on the first call.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
+
+    Returns:
+        OnnxSam: SAM model
+    """
+    onnx_dir = get_onnx_cache_dir(sam_checkpoint, img_size)
+    config = load_onnx_config(onnx_dir)
+    if config is None or config.get("meta") != get_onnx_cache_meta(sam_checkpoint):
+        export_sam_onnx_model(sam_checkpoint, img_size)
+
+    for option in ["sam_quantize", "sam_compile", "sam_token_merging", "sam_sdpa"]:
+        if IAConfig.global_args.get(option, None) is not None:
+            ia_logging.warning(f"--{option.replace('_', '-')} is not applied to the ONNX backend")
+    if IAConfig.global_args.get("sam_precision", "fp32") != "fp32":
+        ia_logging.warning("--sam-precision is not applied to the ONNX backend")
+    if IAConfig.global_args.get("sam_rectangular_input", False):
+        ia_logging.warning("--sam-rectangular-input is not applied to the ONNX backend")
+    if IAConfig.global_args.get("sam_channels_last", False):
+        ia_logging.warning("--sam-channels-last is not applied to the ONNX backend")
+
+    num_threads = IAConfig.global_args.get("sam_onnx_threads", 0)
+    ia_logging.info(f"SAM is running on ONNX Runtime ({onnx_dir})...")
+
+    return OnnxSam(onnx_dir, num_threads, get_sam_device(sam_checkpoint))
+
+
+def get_sam_model(sam_checkpoint, sam_model_registry_local, model_type, img_size=None):
+    """Get SAM model, from the model cache if it is enabled, or load it.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        sam_model_registry_local (dict): SAM model registry
+        model_type (str): SAM model type
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
+
+    Returns:
+        torch.nn.Module or OnnxSam: SAM model, OnnxSam if the ONNX backend is enabled
+    """
+    max_models = IAConfig.global_args.get("sam_model_cache", 0)
+    cache_key = (os.path.basename(sam_checkpoint), get_sam_model_key(sam_checkpoint), img_size)
+    if max_models > 0:
+        sam = sam_model_cache.get(cache_key)
+        if sam is not None:
+            ia_logging.info(f"Using cached SAM model: {os.path.basename(sam_checkpoint)}")
+            return sam
+
+    sam = load_sam_model(sam_checkpoint, sam_model_registry_local, model_type, img_size, share_tensors=max_models > 0)
+    if max_models > 0:
+        sam_model_cache.put(cache_key, sam, max_models)
+
+    return sam
+
+
+def load_sam_model(sam_checkpoint, sam_model_registry_local, model_type, img_size=None, share_tensors=False):
+    """Load SAM model, apply the SAM options and move it to its device.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        sam_model_registry_local (dict): SAM model registry
+        model_type (str): SAM model type
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
+        share_tensors (bool): share the storage of weights identical to those of the cached SAM models
+
+    Returns:
+        torch.nn.Module or OnnxSam: SAM model, OnnxSam if the ONNX backend is enabled
+    """
+    if is_sam_onnx_enabled(sam_checkpoint):
+        return get_onnx_sam_model(sam_checkpoint, img_size)
+
+    device = get_sam_device(sam_checkpoint)
+    quantized = False
+    if is_sam_quantize_enabled(sam_checkpoint):
+        if device.type == "cpu":
+            sam = load_quantized_sam(sam_model_registry_local, model_type, sam_checkpoint)
+            quantized = True
+        else:
+            ia_logging.warning("Quantized SAM runs on CPU only, please add --sam-cpu option. Using non-quantized SAM")
+            sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
+    else:
+        sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
+
+    if img_size is not None:
+        set_sam_img_size(sam, img_size)
+    if IAConfig.global_args.get("sam_rectangular_input", False) and "FastSAM" not in os.path.basename(sam_checkpoint):
+        set_sam_rectangular_input(sam, True)
+    sam_token_merging = IAConfig.global_args.get("sam_token_merging", None)
+    if sam_token_merging and "FastSAM" not in os.path.basename(sam_checkpoint):
+        if not set_sam_token_merging(sam, sam_token_merging):
+            sam_token_merging = None
+    sam_channels_last = IAConfig.global_args.get("sam_channels_last", False)
+    if sam_channels_last and "FastSAM" not in os.path.basename(sam_checkpoint):
+        sam_channels_last = set_sam_channels_last(sam, True)
+    sam_sdpa = IAConfig.global_args.get("sam_sdpa", None)
+    if sam_sdpa is not None and "FastSAM" not in os.path.basename(sam_checkpoint):
+        if not set_sam_sdpa(sam, sam_sdpa or None):
+            sam_sdpa = None
+    if share_tensors and "FastSAM" not in os.path.basename(sam_checkpoint):
+        sam_model_cache.share_tensors(sam, device)
+    else:
+        sam.to(device=device)
+
+    sam_precision = IAConfig.global_args.get("sam_precision", "fp32")
+    if sam_precision != "fp32" and "FastSAM" not in os.path.basename(sam_checkpoint):
+        if quantized:
+            ia_logging.warning(f"{sam_precision} is not applied to quantized SAM")
+        else:
+            apply_sam_precision(sam, sam_precision, device)
+
+    sam_compile = IAConfig.global_args.get("sam_compile", None)
+    if sam_compile is not None and "FastSAM" not in os.path.basename(sam_checkpoint):
+        model_key = get_sam_model_key(sam_checkpoint, sam_precision, quantized, sam_token_merging, sam_channels_last, sam_sdpa)
+        compile_sam_encoder(sam, sam_compile, model_key)
+
+    return sam
+
+
+def get_sam_mask_generator_thresholds(anime_style_chk=False):
+    """Get the thresholds of the SAM mask generator.
+
+    Args:
+        anime_style_chk (bool): anime style check
+
+    Returns:
+        dict: pred_iou_thresh and stability_score_thresh
+    """
+    pred_iou_thresh = 0.88 if not anime_style_chk else 0.83
+    stability_score_thresh = 0.95 if not anime_style_chk else 0.9
+
+    return dict(pred_iou_thresh=pred_iou_thresh, stability_score_thresh=stability_score_thresh)
+
+
+def get_sam_mask_generator_settings(sam_checkpoint, anime_style_chk=False, img_size=None):
+    """Get the settings the masks of the SAM mask generator depend on, to match saved masks.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        anime_style_chk (bool): anime style check
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
+
+    Returns:
+        dict: JSON serializable settings
+    """
+    settings = dict(model_key=get_sam_model_key(sam_checkpoint), anime_style_chk=anime_style_chk, img_size=img_size,
+                    **get_sam_mask_generator_thresholds(anime_style_chk))
+    if "FastSAM" not in os.path.basename(sam_checkpoint):
+        sam_token_merging = IAConfig.global_args.get("sam_token_merging", None)
+        settings.update(
+            sam_backend="onnx" if is_sam_onnx_enabled(sam_checkpoint) else "torch",
+            sam_precision=IAConfig.global_args.get("sam_precision", "fp32"),
+            sam_quantize=is_sam_quantize_enabled(sam_checkpoint),
+            sam_token_merging=list(sam_token_merging) if sam_token_merging else None,
+            sam_sdpa=IAConfig.global_args.get("sam_sdpa", None),
+            sam_rectangular_input=IAConfig.global_args.get("sam_rectangular_input", False),
+        )
+
+    return settings
+
+
+def get_sam_mask_generator(sam_checkpoint, anime_style_chk=False, img_size=None):
     """Get SAM mask generator.
 
     Args:
         sam_checkpoint (str): SAM checkpoint path
+        anime_style_chk (bool): anime style check
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
 
     Returns:
         SamAutomaticMaskGenerator or None: SAM mask generator
@@ -48,35 +448,25 @@ def get_sam_mask_generator(sam_checkpoint, anime_style_chk=False):
         SamAutomaticMaskGeneratorLocal = SamAutomaticMaskGenerator
         points_per_batch = 64
 
-    pred_iou_thresh = 0.88 if not anime_style_chk else 0.83
-    stability_score_thresh = 0.95 if not anime_style_chk else 0.9
+    thresholds = get_sam_mask_generator_thresholds(anime_style_chk)
 
     if os.path.isfile(sam_checkpoint):
-        sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
-        if platform.system() == "Darwin":
-            if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
-                sam.to(device=torch.device("cpu"))
-            else:
-                sam.to(device=torch.device("mps"))
-        else:
-            if IAConfig.global_args.get("sam_cpu", False):
-                ia_logging.info("SAM is running on CPU... (the option has been selected)")
-                sam.to(device=devices.cpu)
-            else:
-                sam.to(device=devices.device)
-        sam_mask_generator = SamAutomaticMaskGeneratorLocal(
-            model=sam, points_per_batch=points_per_batch, pred_iou_thresh=pred_iou_thresh, stability_score_thresh=stability_score_thresh)
+        sam = get_sam_model(sam_checkpoint, sam_model_registry_local, model_type, img_size)
+        if isinstance(sam, OnnxSam):
+            sam, SamAutomaticMaskGeneratorLocal = OnnxSamPredictor(sam), SamAutomaticMaskGenerator
+        sam_mask_generator = SamAutomaticMaskGeneratorLocal(model=sam, points_per_batch=points_per_batch, **thresholds)
     else:
         sam_mask_generator = None
 
     return sam_mask_generator
 
 
-def get_sam_predictor(sam_checkpoint):
+def get_sam_predictor(sam_checkpoint, img_size=None):
     """Get SAM predictor.
 
     Args:
         sam_checkpoint (str): SAM checkpoint path
+        img_size (int, optional): input image size of the image encoder. Defaults to the model's own size.
 
     Returns:
         SamPredictor or None: SAM predictor
@@ -98,19 +488,8 @@ def get_sam_predictor(sam_checkpoint):
         SamPredictorLocal = SamPredictor
 
     if os.path.isfile(sam_checkpoint):
-        sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
-        if platform.system() == "Darwin":
-            if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
-                sam.to(device=torch.device("cpu"))
-            else:
-                sam.to(device=torch.device("mps"))
-        else:
-            if IAConfig.global_args.get("sam_cpu", False):
-                ia_logging.info("SAM is running on CPU... (the option has been selected)")
-                sam.to(device=devices.cpu)
-            else:
-                sam.to(device=devices.device)
-        sam_predictor = SamPredictorLocal(sam)
+        sam = get_sam_model(sam_checkpoint, sam_model_registry_local, model_type, img_size)
+        sam_predictor = OnnxSamPredictor(sam) if isinstance(sam, OnnxSam) else SamPredictorLocal(sam)
     else:
         sam_predictor = None
 
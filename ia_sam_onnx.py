@@ -0,0 +1,427 @@
+import argparse
+import inspect
+import json
+import os
+import shutil
+from typing import Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+from segment_anything_fb.predictor import SamPredictor
+from segment_anything_fb.utils.onnx import SamOnnxModel
+from segment_anything_fb.utils.transforms import ResizeLongestSide
+
+SAM_BACKENDS = ["torch", "onnx"]
+ONNX_CACHE_VERSION = 1
+ONNX_OPSET_VERSION = 17
+
+
+def is_sam_hq(sam):
+    """Check if a SAM model has the HQ mask decoder.
+
+    Args:
+        sam (Sam): SAM model
+
+    Returns:
+        bool: True if SAM-HQ else False
+    """
+    return hasattr(sam.mask_decoder, "hf_token")
+
+
+class SamEncoderOnnxModel(nn.Module):
+    """Image encoder wrapper used in ONNX export.
+
+    The input is a preprocessed (normalized and padded) image. SAM-HQ also returns
+    the early-layer ViT feature used by its mask decoder.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.image_encoder = model.image_encoder
+        self.hq = is_sam_hq(model)
+
+    @torch.no_grad()
+    def forward(self, image):
+        if self.hq:
+            image_embeddings, interm_embeddings = self.image_encoder(image)
+            return image_embeddings, interm_embeddings[0]
+
+        return self.image_encoder(image)
+
+
+class SamDecoderOnnxModel(SamOnnxModel):
+    """Prompt encoder and mask decoder wrapper used in ONNX export.
+
+    All mask tokens are returned as low resolution logits, the selection of the
+    output masks and the upscaling are done by OnnxSamPredictor.
+    """
+
+    def __init__(self, model):
+        super().__init__(model, return_single_mask=False)
+        self.hq = is_sam_hq(model)
+
+    @torch.no_grad()
+    def forward(self, image_embeddings, point_coords, point_labels, mask_input, has_mask_input, interm_embeddings=None):
+        sparse_embedding = self._embed_points(point_coords, point_labels)
+        dense_embedding = self._embed_masks(mask_input, has_mask_input)
+        image_pe = self.model.prompt_encoder.get_dense_pe()
+
+        if self.hq:
+            mask_decoder = self.model.mask_decoder
+            vit_features = interm_embeddings.permute(0, 3, 1, 2)
+            hq_features = mask_decoder.embedding_encoder(image_embeddings) + mask_decoder.compress_vit_feat(vit_features)
+            masks, scores = mask_decoder.predict_masks(
+                image_embeddings=image_embeddings,
+                image_pe=image_pe,
+                sparse_prompt_embeddings=sparse_embedding,
+                dense_prompt_embeddings=dense_embedding,
+                hq_features=hq_features,
+            )
+        else:
+            masks, scores = self.model.mask_decoder.predict_masks(
+                image_embeddings=image_embeddings,
+                image_pe=image_pe,
+                sparse_prompt_embeddings=sparse_embedding,
+                dense_prompt_embeddings=dense_embedding,
+            )
+
+        return masks, scores
+
+
+def get_onnx_export_kwargs():
+    """Get the torch.onnx.export arguments selecting the TorchScript-based exporter.
+
+    Returns:
+        dict: export arguments
+    """
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return dict(dynamo=False)
+
+    return {}
+
+
+def export_sam_onnx(sam, onnx_dir, meta=None, opset_version=ONNX_OPSET_VERSION):
+    """Export the image encoder and the mask decoder of a SAM model to ONNX.
+
+    The directory contains encoder.onnx, decoder.onnx and config.json.
+
+    Args:
+        sam (Sam): SAM model
+        onnx_dir (str): output directory
+        meta (dict, optional): metadata identifying the checkpoint, stored in config.json
+        opset_version (int): ONNX opset version
+
+    Returns:
+        str: output directory
+    """
+    sam = sam.to(device="cpu", dtype=torch.float32).eval()
+    hq = is_sam_hq(sam)
+    img_size = sam.image_encoder.img_size
+    mask_input_size = [4 * s for s in sam.prompt_encoder.image_embedding_size]
+
+    tmp_dir = onnx_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir, exist_ok=True)
+    export_kwargs = get_onnx_export_kwargs()
+
+    encoder = SamEncoderOnnxModel(sam)
+    image = torch.randn(1, 3, img_size, img_size, dtype=torch.float32)
+    encoder_output_names = ["image_embeddings", "interm_embeddings"] if hq else ["image_embeddings"]
+    ia_logging.info(f"Exporting SAM image encoder to ONNX ({img_size}x{img_size})...")
+    torch.onnx.export(
+        encoder, (image,), os.path.join(tmp_dir, "encoder.onnx"),
+        input_names=["image"], output_names=encoder_output_names,
+        opset_version=opset_version, do_constant_folding=True, **export_kwargs)
+
+    encoder_outputs = encoder(image)
+    decoder = SamDecoderOnnxModel(sam)
+    decoder_inputs = dict(
+        image_embeddings=encoder_outputs[0] if hq else encoder_outputs,
+        point_coords=torch.randint(low=0, high=img_size, size=(1, 5, 2), dtype=torch.float32),
+        point_labels=torch.randint(low=0, high=4, size=(1, 5), dtype=torch.float32),
+        mask_input=torch.randn(1, 1, *mask_input_size, dtype=torch.float32),
+        has_mask_input=torch.tensor([1], dtype=torch.float32),
+    )
+    if hq:
+        decoder_inputs["interm_embeddings"] = encoder_outputs[1]
+    ia_logging.info("Exporting SAM mask decoder to ONNX...")
+    torch.onnx.export(
+        decoder, tuple(decoder_inputs.values()), os.path.join(tmp_dir, "decoder.onnx"),
+        input_names=list(decoder_inputs.keys()), output_names=["masks", "iou_predictions"],
+        dynamic_axes={
+            "point_coords": {0: "num_prompts", 1: "num_points"},
+            "point_labels": {0: "num_prompts", 1: "num_points"},
+            "mask_input": {0: "num_masks"},
+            "masks": {0: "num_prompts"},
+            "iou_predictions": {0: "num_prompts"},
+        },
+        opset_version=opset_version, do_constant_folding=True, **export_kwargs)
+
+    config = dict(
+        img_size=img_size,
+        mask_input_size=mask_input_size,
+        pixel_mean=sam.pixel_mean.flatten().tolist(),
+        pixel_std=sam.pixel_std.flatten().tolist(),
+        mask_threshold=sam.mask_threshold,
+        image_format=sam.image_format,
+        hq=hq,
+        num_mask_tokens=sam.mask_decoder.num_mask_tokens,
+        opset_version=opset_version,
+        meta=meta,
+    )
+    with open(os.path.join(tmp_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+    shutil.rmtree(onnx_dir, ignore_errors=True)
+    os.replace(tmp_dir, onnx_dir)
+    ia_logging.info(f"Saved ONNX SAM to {onnx_dir}")
+
+    return onnx_dir
+
+
+def get_onnx_cache_dir(sam_checkpoint, img_size=None):
+    """Get the cache directory of an exported SAM model.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        img_size (int, optional): input image size of the image encoder
+
+    Returns:
+        str: cache directory
+    """
+    sam_name = os.path.splitext(os.path.basename(sam_checkpoint))[0]
+    size_name = "default" if img_size is None else str(img_size)
+
+    return os.path.join(ia_file_manager.cache_dir, "onnx", f"{sam_name}_{size_name}")
+
+
+def get_onnx_cache_meta(sam_checkpoint):
+    """Get the metadata identifying the checkpoint an ONNX model was exported from.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        dict: metadata
+    """
+    stat = os.stat(sam_checkpoint)
+
+    return dict(
+        version=ONNX_CACHE_VERSION,
+        checkpoint_size=stat.st_size,
+        checkpoint_mtime=int(stat.st_mtime),
+        torch_version=torch.__version__,
+    )
+
+
+def load_onnx_config(onnx_dir):
+    """Load the config.json of an exported SAM model.
+
+    Args:
+        onnx_dir (str): directory of the exported model
+
+    Returns:
+        dict or None: config, None if the model has not been exported
+    """
+    config_path = os.path.join(onnx_dir, "config.json")
+    if not os.path.isfile(config_path):
+        return None
+    try:
+        with open(config_path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        ia_logging.warning(f"Failed to load ONNX SAM config: {e}")
+        return None
+
+
+def create_onnx_session(model_path, num_threads=0, device=None):
+    """Create an ONNX Runtime inference session.
+
+    Args:
+        model_path (str): ONNX model path
+        num_threads (int): number of intra-op threads, 0 to use the ONNX Runtime default
+        device (torch.device, optional): device SAM runs on, CUDA is used if available
+
+    Returns:
+        onnxruntime.InferenceSession: inference session
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("onnxruntime is required for the ONNX backend, please install it with `pip install onnxruntime`") from e
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.intra_op_num_threads = num_threads
+    sess_options.inter_op_num_threads = 1
+
+    providers = ["CPUExecutionProvider"]
+    if device is not None and device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+
+    return ort.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+
+class OnnxSam:
+    """SAM model running its image encoder and mask decoder with ONNX Runtime."""
+
+    def __init__(self, onnx_dir, num_threads=0, device=None):
+        config = load_onnx_config(onnx_dir)
+        if config is None:
+            raise FileNotFoundError(f"ONNX SAM not found in {onnx_dir}")
+
+        self.onnx_dir = onnx_dir
+        self.img_size = config["img_size"]
+        self.mask_input_size = tuple(config["mask_input_size"])
+        self.mask_threshold = config["mask_threshold"]
+        self.image_format = config["image_format"]
+        self.hq = config["hq"]
+        self.num_mask_tokens = config["num_mask_tokens"]
+        self.pixel_mean = torch.Tensor(config["pixel_mean"]).view(-1, 1, 1)
+        self.pixel_std = torch.Tensor(config["pixel_std"]).view(-1, 1, 1)
+        self.encoder_session = create_onnx_session(os.path.join(onnx_dir, "encoder.onnx"), num_threads, device)
+        self.decoder_session = create_onnx_session(os.path.join(onnx_dir, "decoder.onnx"), num_threads, device)
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def preprocess(self, x):
+        """Normalize pixel values and pad to a square input."""
+        x = (x - self.pixel_mean) / self.pixel_std
+
+        h, w = x.shape[-2:]
+        x = F.pad(x, (0, self.img_size - w, 0, self.img_size - h))
+        return x
+
+    def postprocess_masks(self, masks, input_size, original_size):
+        """Remove padding and upscale masks to the original image size."""
+        masks = F.interpolate(masks, (self.img_size, self.img_size), mode="bilinear", align_corners=False)
+        masks = masks[..., : input_size[0], : input_size[1]]
+        masks = F.interpolate(masks, original_size, mode="bilinear", align_corners=False)
+        return masks
+
+
+class OnnxSamPredictor(SamPredictor):
+    """SamPredictor running an OnnxSam model.
+
+    It can be passed to SamAutomaticMaskGenerator in place of a SAM model.
+    """
+
+    def __init__(self, sam_model: OnnxSam) -> None:
+        self.model = sam_model
+        self.transform = ResizeLongestSide(sam_model.img_size)
+        self.reset_image()
+
+    @torch.no_grad()
+    def set_torch_image(self, transformed_image: torch.Tensor, original_image_size: Tuple[int, ...]) -> None:
+        assert (
+            len(transformed_image.shape) == 4
+            and transformed_image.shape[1] == 3
+            and max(*transformed_image.shape[2:]) == self.model.img_size
+        ), f"set_torch_image input must be BCHW with long side {self.model.img_size}."
+        self.reset_image()
+
+        self.original_size = original_image_size
+        self.input_size = tuple(transformed_image.shape[-2:])
+        input_image = self.model.preprocess(transformed_image.float().cpu())
+        outputs = self.model.encoder_session.run(None, {"image": input_image.numpy()})
+        self.features = torch.from_numpy(outputs[0])
+        self.interm_features = torch.from_numpy(outputs[1]) if self.model.hq else None
+        self.is_image_set = True
+
+    @torch.no_grad()
+    def predict_torch(
+        self,
+        point_coords: Optional[torch.Tensor],
+        point_labels: Optional[torch.Tensor],
+        boxes: Optional[torch.Tensor] = None,
+        mask_input: Optional[torch.Tensor] = None,
+        multimask_output: bool = True,
+        return_logits: bool = False,
+        hq_token_only: bool = False,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        if not self.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+
+        # Boxes are embedded as two corner points, points are padded if there is no box
+        coords, labels = [], []
+        if point_coords is not None:
+            coords.append(point_coords.float().cpu())
+            labels.append(point_labels.float().cpu())
+        if boxes is not None:
+            boxes = boxes.float().cpu().reshape(-1, 2, 2)
+            coords.append(boxes)
+            labels.append(torch.tensor([[2, 3]], dtype=torch.float32).expand(boxes.shape[0], -1))
+        elif point_coords is not None:
+            coords.append(torch.zeros((point_coords.shape[0], 1, 2), dtype=torch.float32))
+            labels.append(-torch.ones((point_labels.shape[0], 1), dtype=torch.float32))
+        if len(coords) > 0:
+            point_coords, point_labels = torch.cat(coords, dim=1), torch.cat(labels, dim=1)
+        else:
+            point_coords, point_labels = torch.zeros((1, 0, 2)), torch.zeros((1, 0))
+
+        if mask_input is not None:
+            mask_input, has_mask_input = mask_input.float().cpu(), torch.ones(1)
+        else:
+            mask_input, has_mask_input = torch.zeros((1, 1, *self.model.mask_input_size)), torch.zeros(1)
+
+        inputs = dict(
+            image_embeddings=self.features.numpy(),
+            point_coords=point_coords.numpy(),
+            point_labels=point_labels.numpy(),
+            mask_input=mask_input.numpy(),
+            has_mask_input=has_mask_input.numpy(),
+        )
+        if self.model.hq:
+            inputs["interm_embeddings"] = self.interm_features.numpy()
+        masks, iou_pred = [torch.from_numpy(output) for output in self.model.decoder_session.run(None, inputs)]
+
+        # Select the correct mask or masks for output
+        if self.model.hq:
+            num_mask_tokens = self.model.num_mask_tokens
+            if multimask_output:
+                iou_pred, max_iou_idx = torch.max(iou_pred[:, 1:num_mask_tokens - 1], dim=1)
+                iou_pred = iou_pred.unsqueeze(1)
+                masks_sam = masks[torch.arange(masks.size(0)), max_iou_idx + 1].unsqueeze(1)
+            else:
+                iou_pred = iou_pred[:, 0:1]
+                masks_sam = masks[:, 0:1]
+            masks_hq = masks[:, num_mask_tokens - 1:num_mask_tokens]
+            low_res_masks = masks_hq if hq_token_only else masks_sam + masks_hq
+        else:
+            mask_slice = slice(1, None) if multimask_output else slice(0, 1)
+            low_res_masks, iou_pred = masks[:, mask_slice], iou_pred[:, mask_slice]
+
+        # Upscale the masks to the original image resolution
+        masks = self.model.postprocess_masks(low_res_masks, self.input_size, self.original_size)
+
+        if not return_logits:
+            masks = masks > self.model.mask_threshold
+
+        return masks, iou_pred, low_res_masks
+
+    def reset_image(self) -> None:
+        super().reset_image()
+        self.interm_features = None
+
+
+def main():
+    from ia_sam_manager import export_sam_onnx_model
+
+    parser = argparse.ArgumentParser(description="Export SAM models to ONNX for the --sam-backend onnx option.")
+    parser.add_argument("sam_checkpoints", nargs="+", help="SAM checkpoint paths (e.g. models/sam_vit_b_01ec64.pth).")
+    parser.add_argument("--img-size", type=int, default=None, help="Input image size of the image encoder.")
+    args = parser.parse_args()
+
+    for sam_checkpoint in args.sam_checkpoints:
+        export_sam_onnx_model(sam_checkpoint, args.img_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from functools import wraps
+
+import torch
+
+from ia_logging import ia_logging
+
+SAM_PRECISIONS = ["fp32", "fp16", "bf16"]
+
+
+def get_sam_dtype(precision, device):
+    """Get the autocast dtype of a SAM precision on a device.
+
+    fp16 is used on accelerators only, on CPU it is replaced by bf16.
+    fp32 is returned when the device does not support autocast with the dtype.
+
+    Args:
+        precision (str): SAM precision, one of SAM_PRECISIONS
+        device (torch.device): device SAM runs on
+
+    Returns:
+        torch.dtype: autocast dtype, torch.float32 if autocast is not used
+    """
+    if precision not in SAM_PRECISIONS:
+        raise ValueError(f"Invalid SAM precision: {precision}")
+
+    if precision == "fp32":
+        return torch.float32
+
+    dtype = torch.float16 if precision == "fp16" else torch.bfloat16
+    if device.type == "cpu" and dtype == torch.float16:
+        ia_logging.warning("fp16 is not supported by SAM on CPU, using bf16 instead")
+        dtype = torch.bfloat16
+
+    try:
+        with torch.autocast(device_type=device.type, dtype=dtype):
+            pass
+    except RuntimeError as e:
+        ia_logging.warning(f"Autocast with {dtype} is not available on {device.type}, using fp32: {e}")
+        return torch.float32
+
+    return dtype
+
+
+def to_float32(outputs):
+    """Cast the floating point tensors in the outputs to float32.
+
+    Args:
+        outputs (Any): tensor, or tuple/list of outputs
+
+    Returns:
+        Any: outputs with float32 tensors
+    """
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    elif isinstance(outputs, (tuple, list)):
+        return type(outputs)(to_float32(output) for output in outputs)
+
+    return outputs
+
+
+def is_all_finite(outputs):
+    """Check if the floating point tensors in the outputs are all finite.
+
+    Args:
+        outputs (Any): tensor, or tuple/list of outputs
+
+    Returns:
+        bool: True if all values are finite else False
+    """
+    if isinstance(outputs, torch.Tensor):
+        return not outputs.is_floating_point() or bool(torch.isfinite(outputs).all())
+    elif isinstance(outputs, (tuple, list)):
+        return all(is_all_finite(output) for output in outputs)
+
+    return True
+
+
+def autocast_forward(module, device_type, dtype):
+    """Run the forward of a module under autocast.
+
+    The outputs are cast back to float32, so that the thresholds and the stability
+    scores computed from them stay in fp32. If an output is not finite, the forward
+    is run again in fp32 and autocast is disabled for the module from then on.
+
+    Args:
+        module (torch.nn.Module): module
+        device_type (str): autocast device type
+        dtype (torch.dtype): autocast dtype
+
+    Returns:
+        torch.nn.Module: module
+    """
+    forward = module.forward
+    state = dict(enabled=True)
+
+    @wraps(forward)
+    def wrapper(*args, **kwargs):
+        if state["enabled"]:
+            with torch.autocast(device_type=device_type, dtype=dtype):
+                outputs = forward(*args, **kwargs)
+            outputs = to_float32(outputs)
+            if is_all_finite(outputs):
+                return outputs
+            ia_logging.warning(f"{module.__class__.__name__} overflowed in {dtype}, falling back to fp32")
+            state["enabled"] = False
+
+        return forward(*args, **kwargs)
+
+    module.forward = wrapper
+
+    return module
+
+
+def apply_sam_precision(sam, precision, device):
+    """Run the image encoder and the mask decoder of a SAM model in mixed precision.
+
+    Args:
+        sam (Sam): SAM model
+        precision (str): SAM precision, one of SAM_PRECISIONS
+        device (torch.device): device SAM runs on
+
+    Returns:
+        Sam: SAM model
+    """
+    dtype = get_sam_dtype(precision, device)
+    if dtype == torch.float32:
+        return sam
+
+    for name in ["image_encoder", "mask_decoder"]:
+        autocast_forward(getattr(sam, name), device.type, dtype)
+    ia_logging.info(f"SAM is running in {dtype} mixed precision...")
+
+    return sam
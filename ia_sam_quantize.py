@@ -0,0 +1,202 @@
+import os
+
+import torch
+from torch import nn
+
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+
+QUANTIZE_CACHE_VERSION = 3
+
+
+def setup_quantized_engine():
+    """Select a quantized engine supported by this platform.
+
+    Returns:
+        str: quantized engine
+    """
+    supported_engines = torch.backends.quantized.supported_engines
+    if torch.backends.quantized.engine not in supported_engines or torch.backends.quantized.engine == "none":
+        for engine in ["x86", "fbgemm", "qnnpack"]:
+            if engine in supported_engines:
+                torch.backends.quantized.engine = engine
+                break
+
+    return torch.backends.quantized.engine
+
+
+def quantize_sam(sam):
+    """Apply dynamic int8 quantization to the Linear layers of a SAM model.
+
+    The image encoder (ViT or TinyViT) including its MLP blocks and the mask decoder are quantized.
+    The prompt encoder has no Linear layers and is kept as it is. Quantized models run on CPU only.
+
+    Args:
+        sam (Sam): SAM model on CPU
+
+    Returns:
+        Sam: quantized SAM model
+    """
+    setup_quantized_engine()
+    for name in ["image_encoder", "mask_decoder"]:
+        module = getattr(sam, name)
+        setattr(sam, name, torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8))
+
+    return sam
+
+
+def get_quantized_linear_modules(sam):
+    """Get the dynamically quantized Linear layers of a SAM model.
+
+    Args:
+        sam (Sam): quantized SAM model
+
+    Returns:
+        dict: quantized Linear layers by module name
+    """
+    return {name: module for name, module in sam.named_modules()
+            if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)}
+
+
+def get_quantized_state_dict(sam):
+    """Get the state dict of a quantized SAM model in plain tensors, loadable with torch.load(weights_only=True).
+
+    The packed int8 weights are stored as their integer values with their scales and zero points.
+
+    Args:
+        sam (Sam): quantized SAM model
+
+    Returns:
+        dict: state dict
+    """
+    state_dict = {name: value for name, value in sam.state_dict().items()
+                  if isinstance(value, torch.Tensor) and not value.is_quantized and "._packed_params." not in name}
+    for name, module in get_quantized_linear_modules(sam).items():
+        weight, bias = module._weight_bias()
+        state_dict[f"{name}.weight_int_repr"] = weight.int_repr()
+        if weight.qscheme() in [torch.per_channel_affine, torch.per_channel_symmetric]:
+            state_dict[f"{name}.weight_scales"] = weight.q_per_channel_scales()
+            state_dict[f"{name}.weight_zero_points"] = weight.q_per_channel_zero_points()
+            state_dict[f"{name}.weight_axis"] = torch.tensor(weight.q_per_channel_axis())
+        else:
+            state_dict[f"{name}.weight_scales"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+            state_dict[f"{name}.weight_zero_points"] = torch.tensor(weight.q_zero_point(), dtype=torch.int64)
+        if bias is not None:
+            state_dict[f"{name}.bias"] = bias.detach()
+
+    return state_dict
+
+
+def load_quantized_state_dict(sam, state_dict):
+    """Load a state dict from get_quantized_state_dict into a quantized SAM model of the same architecture.
+
+    Args:
+        sam (Sam): quantized SAM model
+        state_dict (dict): state dict
+
+    Returns:
+        Sam: SAM model
+    """
+    state_dict = dict(state_dict)
+    for name, module in get_quantized_linear_modules(sam).items():
+        int_repr = state_dict.pop(f"{name}.weight_int_repr")
+        scales = state_dict.pop(f"{name}.weight_scales")
+        zero_points = state_dict.pop(f"{name}.weight_zero_points")
+        if f"{name}.weight_axis" in state_dict:
+            axis = int(state_dict.pop(f"{name}.weight_axis"))
+            weight = torch._make_per_channel_quantized_tensor(int_repr, scales, zero_points, axis)
+        else:
+            weight = torch._make_per_tensor_quantized_tensor(int_repr, float(scales), int(zero_points))
+        module.set_weight_bias(weight, state_dict.pop(f"{name}.bias", None))
+
+    # The packed weights set above are loaded again with the other tensors
+    model_state_dict = sam.state_dict()
+    missing_keys = [key for key, value in model_state_dict.items()
+                    if isinstance(value, torch.Tensor) and not value.is_quantized and key not in state_dict]
+    unexpected_keys = [key for key in state_dict.keys() if key not in model_state_dict]
+    if len(missing_keys) > 0 or len(unexpected_keys) > 0:
+        raise RuntimeError(f"Quantized state dict does not match the model: missing {missing_keys}, "
+                           f"unexpected {unexpected_keys}")
+    model_state_dict.update(state_dict)
+    sam.load_state_dict(model_state_dict)
+
+    return sam
+
+
+def get_quantized_cache_path(sam_checkpoint):
+    """Get the cache file path of a quantized SAM model.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        str: cache file path
+    """
+    sam_name = os.path.splitext(os.path.basename(sam_checkpoint))[0]
+
+    return os.path.join(ia_file_manager.cache_dir, f"{sam_name}_dynamic_int8.pt")
+
+
+def get_quantized_cache_meta(sam_checkpoint):
+    """Get the metadata identifying the checkpoint a quantized model was created from.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        dict: metadata
+    """
+    stat = os.stat(sam_checkpoint)
+
+    return dict(
+        version=QUANTIZE_CACHE_VERSION,
+        checkpoint_size=stat.st_size,
+        checkpoint_mtime=int(stat.st_mtime),
+        torch_version=str(torch.__version__),
+        engine=setup_quantized_engine(),
+    )
+
+
+def load_quantized_sam(sam_model_registry_local, model_type, sam_checkpoint):
+    """Load a dynamically quantized SAM model.
+
+    The quantized weights are cached on the first call and reused as long as the
+    checkpoint, the torch version and the quantized engine are unchanged. The cache
+    holds plain tensors only, and is loaded with weights_only=True into the quantized
+    architecture.
+
+    Args:
+        sam_model_registry_local (dict): SAM model registry
+        model_type (str): SAM model type
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        Sam: quantized SAM model on CPU
+    """
+    cache_path = get_quantized_cache_path(sam_checkpoint)
+    cache_meta = get_quantized_cache_meta(sam_checkpoint)
+
+    if os.path.isfile(cache_path):
+        try:
+            cache = torch.load(cache_path, map_location="cpu", weights_only=True)
+            if cache.get("meta") == cache_meta:
+                sam = quantize_sam(sam_model_registry_local[model_type]())
+                load_quantized_state_dict(sam, cache["state_dict"])
+                ia_logging.info(f"Loaded quantized SAM from {cache_path}")
+                return sam
+            ia_logging.info(f"Quantized SAM cache is outdated: {cache_path}")
+        except Exception as e:
+            ia_logging.warning(f"Failed to load quantized SAM cache: {e}")
+
+    ia_logging.info(f"Quantizing {os.path.basename(sam_checkpoint)}...")
+    sam = quantize_sam(sam_model_registry_local[model_type](checkpoint=sam_checkpoint))
+
+    try:
+        tmp_path = cache_path + ".tmp"
+        torch.save(dict(meta=cache_meta, state_dict=get_quantized_state_dict(sam)), tmp_path)
+        os.replace(tmp_path, cache_path)
+        ia_logging.info(f"Saved quantized SAM to {cache_path}")
+    except Exception as e:
+        ia_logging.warning(f"Failed to save quantized SAM cache: {e}")
+
+    return sam
@@ -0,0 +1,213 @@
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from segment_anything_fb.utils.amg import build_point_grid
+
+
+def get_roi_mask(roi, shape):
+    """Get the mask of a region of interest.
+
+    Args:
+        roi (list[int] or np.ndarray): box in XYXY format, or mask of the image size such as a sketch
+        shape (tuple[int, int]): height and width of the image
+
+    Returns:
+        np.ndarray: ROI mask in bool
+    """
+    height, width = shape[:2]
+    if isinstance(roi, np.ndarray) and roi.ndim >= 2:
+        if roi.shape[:2] != (height, width):
+            raise ValueError(f"ROI mask shape {roi.shape[:2]} does not match the image shape {(height, width)}")
+        roi_mask = roi if roi.ndim == 2 else np.any(roi, axis=2)
+        roi_mask = roi_mask.astype(bool, copy=False)
+    else:
+        if len(roi) != 4:
+            raise ValueError("ROI box must be in XYXY format")
+        x0, y0 = max(0, int(roi[0])), max(0, int(roi[1]))
+        x1, y1 = min(width, int(math.ceil(roi[2]))), min(height, int(math.ceil(roi[3])))
+        roi_mask = np.zeros((height, width), dtype=bool)
+        roi_mask[y0:y1, x0:x1] = True
+
+    if not np.any(roi_mask):
+        raise ValueError("ROI is empty")
+
+    return roi_mask
+
+
+def get_roi_box(roi_mask, padding=0.0):
+    """Get the box of a ROI mask, padded by a fraction of its longer side.
+
+    Args:
+        roi_mask (np.ndarray): ROI mask
+        padding (float): padding on each side, as a fraction of the longer side of the box
+
+    Returns:
+        list[int]: box in XYXY format with exclusive ends, clipped to the image
+    """
+    height, width = roi_mask.shape[:2]
+    rows = np.flatnonzero(np.any(roi_mask, axis=1))
+    cols = np.flatnonzero(np.any(roi_mask[rows[0]:rows[-1] + 1], axis=0))
+    x0, y0, x1, y1 = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    pad = int(round(padding * max(x1 - x0, y1 - y0)))
+
+    return [max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)]
+
+
+def build_roi_point_grid(roi_mask, crop_box, n_per_side=32):
+    """Build a point grid over the box of a ROI mask, keeping the points within the ROI.
+
+    The grid has n_per_side points per side over the ROI box, so that the ROI gets the point
+    budget of the whole image. A grid cell with ROI pixels but a center outside the ROI,
+    such as a cell crossed by a sketch stroke, gets the first ROI pixel of the cell instead.
+
+    Args:
+        roi_mask (np.ndarray): ROI mask
+        crop_box (list[int]): box in XYXY format of the image given to the generator
+        n_per_side (int): number of points per side of the grid
+
+    Returns:
+        np.ndarray: points in [0,1]x[0,1] of the crop, of shape (N, 2)
+    """
+    x0, y0, x1, y1 = get_roi_box(roi_mask)
+    box_size = np.array([x1 - x0, y1 - y0])
+    grid = np.array([x0, y0]) + build_point_grid(n_per_side) * box_size
+    centers = np.minimum(grid.astype(np.int64), [x1 - 1, y1 - 1])
+    centers_in_roi = roi_mask[centers[:, 1], centers[:, 0]]
+
+    ys, xs = np.nonzero(roi_mask[y0:y1, x0:x1])
+    cells = (ys * n_per_side // box_size[1]) * n_per_side + xs * n_per_side // box_size[0]
+    cells, first_idxs = np.unique(cells, return_index=True)
+    # Pixel centers of the first ROI pixels of the cells
+    first_pixels = np.stack([xs[first_idxs] + x0, ys[first_idxs] + y0], axis=-1) + 0.5
+    points = np.where(centers_in_roi[cells, None], grid[cells], first_pixels)
+
+    crop_size = np.array([crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]])
+
+    return (points - np.array(crop_box[:2])) / crop_size
+
+
+def is_bbox_on_crop_edge(bbox, crop_box, shape):
+    """Check if the bounding box of a mask generated on a crop touches an edge of the crop within the image.
+
+    Such a mask may be cut by the crop, as in SamAutomaticMaskGenerator with crop_n_layers > 0.
+
+    Args:
+        bbox (list[int]): bounding box in XYWH format as in SamAutomaticMaskGenerator, in image coordinates
+        crop_box (list[int]): box of the crop in XYXY format
+        shape (tuple[int, int]): height and width of the image
+
+    Returns:
+        bool: True if the bounding box touches an edge of the crop that is not an edge of the image
+    """
+    height, width = shape[:2]
+    x0, y0, x1, y1 = bbox[0], bbox[1], bbox[0] + bbox[2] + 1, bbox[1] + bbox[3] + 1
+
+    return ((x0 <= crop_box[0] and crop_box[0] > 0) or (y0 <= crop_box[1] and crop_box[1] > 0) or
+            (x1 >= crop_box[2] and crop_box[2] < width) or (y1 >= crop_box[3] and crop_box[3] < height))
+
+
+def uncrop_sam_masks(sam_masks, crop_box, shape):
+    """Map SAM masks generated on a crop back to image coordinates.
+
+    Args:
+        sam_masks (list[dict]): SAM masks of the crop, with a binary mask segmentation
+        crop_box (list[int]): box of the crop in XYXY format
+        shape (tuple[int, int]): height and width of the image
+
+    Returns:
+        list[dict]: SAM masks of the image
+    """
+    x0, y0, x1, y1 = crop_box
+    for sam_mask in sam_masks:
+        segmentation = np.zeros(shape[:2], dtype=bool)
+        segmentation[y0:y1, x0:x1] = sam_mask["segmentation"]
+        sam_mask["segmentation"] = segmentation
+        if "bbox" in sam_mask:
+            sam_mask["bbox"] = [sam_mask["bbox"][0] + x0, sam_mask["bbox"][1] + y0] + list(sam_mask["bbox"][2:])
+        if "point_coords" in sam_mask:
+            sam_mask["point_coords"] = [[x + x0, y + y0] for x, y in sam_mask["point_coords"]]
+        if "crop_box" in sam_mask:
+            sam_mask["crop_box"] = [sam_mask["crop_box"][0] + x0, sam_mask["crop_box"][1] + y0] + list(sam_mask["crop_box"][2:])
+
+    return sam_masks
+
+
+def generate_roi_masks(
+        sam_mask_generator,
+        image: np.ndarray,
+        roi,
+        roi_crop: bool = False,
+        crop_padding: float = 0.1,
+        points_per_side: Optional[int] = None,
+        ) -> List[Dict[str, Any]]:
+    """Generate SAM masks within a region of interest.
+
+    The point grid of the generator is placed over the ROI only. With roi_crop, the padded box
+    of the ROI is cropped and encoded at the full input size of the image encoder, for finer
+    masks of small objects. FastSAM has no point grid, its masks overlapping the ROI are kept.
+
+    Args:
+        sam_mask_generator (SamAutomaticMaskGenerator or FastSamAutomaticMaskGenerator): SAM mask generator
+        image (np.ndarray): image in HWC uint8 format
+        roi (list[int] or np.ndarray): box in XYXY format, or mask of the image size such as a sketch
+        roi_crop (bool): True to generate the masks on the crop of the ROI
+        crop_padding (float): padding of the crop, as a fraction of the longer side of the ROI box
+        points_per_side (int, optional): points per side of the grid over the ROI box.
+            Defaults to None (the points per side of the generator).
+
+    Returns:
+        list[dict]: SAM masks in image coordinates
+    """
+    roi_mask = get_roi_mask(roi, image.shape)
+    height, width = image.shape[:2]
+    crop_box = get_roi_box(roi_mask, crop_padding) if roi_crop else [0, 0, width, height]
+    x0, y0, x1, y1 = crop_box
+    crop_image = image[y0:y1, x0:x1]
+
+    point_grids = getattr(sam_mask_generator, "point_grids", None)
+    if point_grids is None:
+        sam_masks = sam_mask_generator.generate(crop_image)
+        if roi_crop:
+            uncrop_sam_masks(sam_masks, crop_box, image.shape)
+
+        return [sam_mask for sam_mask in sam_masks if np.any(sam_mask["segmentation"][roi_mask])]
+
+    n_per_side = points_per_side or int(round(math.sqrt(len(point_grids[0]))))
+    sam_mask_generator.point_grids = [build_roi_point_grid(roi_mask, crop_box, n_per_side)] + point_grids[1:]
+    try:
+        sam_masks = sam_mask_generator.generate(crop_image)
+    finally:
+        sam_mask_generator.point_grids = point_grids
+
+    if roi_crop:
+        uncrop_sam_masks(sam_masks, crop_box, image.shape)
+
+    return sam_masks
+
+
+def generate_update_masks(sam_mask_generator, image, changed_mask, crop_padding=0.25):
+    """Generate SAM masks on the padded crop of a changed region of an image, to update its masks.
+
+    The point grid over the changed region has from 8 to 32 points per side, by the size of the
+    region, so that the decoder cost scales with its area. The masks cut by the crop are dropped.
+
+    Args:
+        sam_mask_generator (SamAutomaticMaskGenerator or FastSamAutomaticMaskGenerator): SAM mask generator
+        image (np.ndarray): image in HWC uint8 format, with the changed region
+        changed_mask (np.ndarray): mask of the changed pixels
+        crop_padding (float): padding of the crop, as a fraction of the longer side of the changed region
+
+    Returns:
+        tuple[list[dict], list[int]]: SAM masks in image coordinates, and box of the crop in XYXY format
+    """
+    x0, y0, x1, y1 = get_roi_box(changed_mask)
+    points_per_side = int(np.clip(np.ceil(32 * np.sqrt((x1 - x0) * (y1 - y0) / changed_mask.size)), 8, 32))
+    crop_box = get_roi_box(changed_mask, crop_padding)
+
+    sam_masks = generate_roi_masks(sam_mask_generator, image, changed_mask, True, crop_padding, points_per_side)
+    sam_masks = [sam_mask for sam_mask in sam_masks
+                 if sam_mask["area"] > 0 and not is_bbox_on_crop_edge(sam_mask["bbox"], crop_box, image.shape)]
+
+    return sam_masks, crop_box
@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from ia_logging import ia_logging
+
+DEFAULT_SESSION_ID = "default"
+
+
+def new_session_id():
+    """Create a session ID, given to a browser session when the page loads.
+
+    Returns:
+        str: session ID
+    """
+    return uuid.uuid4().hex
+
+
+def get_object_nbytes(obj, seen=None):
+    """Get the memory used by the arrays held by an object in bytes, counting shared objects once.
+
+    Objects with an nbytes attribute, such as MaskSet and SamMaskCandidates, report their own size.
+    Dicts, lists, tuples and the attributes of other objects are walked.
+
+    Args:
+        obj (Any): object
+        seen (set, optional): IDs of the objects already counted
+
+    Returns:
+        int: size in bytes
+    """
+    seen = set() if seen is None else seen
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray) or isinstance(getattr(type(obj), "nbytes", None), property):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(get_object_nbytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(get_object_nbytes(value, seen) for value in obj)
+    if hasattr(obj, "__dict__") and not isinstance(obj, type):
+        return sum(get_object_nbytes(value, seen) for value in vars(obj).values())
+
+    return 0
+
+
+class SessionStore:
+    """State of each browser session, keyed by session ID.
+
+    Sessions idle for longer than ttl are removed. Beyond max_sessions, or max_memory_mb for
+    the state of all sessions, the least recently used sessions are removed. The limits are
+    off by default, and checked when a session is accessed, the accessed session is never removed.
+    """
+
+    def __init__(self, factory, ttl=0.0, max_sessions=0, max_memory_mb=0.0) -> None:
+        """Initialize a session store.
+
+        Args:
+            factory (Callable[[], dict]): function creating the state of a new session
+            ttl (float): time in seconds after which an idle session is removed, 0 for no limit
+            max_sessions (int): maximum number of sessions, 0 for no limit
+            max_memory_mb (float): maximum memory of the state of all sessions in MB, 0 for no limit
+        """
+        self.factory = factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_memory_mb = max_memory_mb
+        self._sessions = OrderedDict()
+        self._last_access = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Get the state of a session and mark it as the most recently used, creating it if needed.
+
+        Args:
+            session_id (str, optional): session ID, None for the default session
+
+        Returns:
+            dict: state of the session
+        """
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self._lock:
+            if session_id not in self._sessions:
+                ia_logging.info(f"New session: {session_id}")
+                self._sessions[session_id] = self.factory()
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            self._evict(session_id)
+
+            return self._sessions[session_id]
+
+    def get_summary(self, session_id):
+        """Get the memory used by a session and by all sessions as text.
+
+        Args:
+            session_id (str, optional): session ID, None for the default session
+
+        Returns:
+            str: summary
+        """
+        with self._lock:
+            session_nbytes = get_object_nbytes(self._sessions.get(session_id or DEFAULT_SESSION_ID))
+            total_nbytes = sum(get_object_nbytes(state) for state in self._sessions.values())
+            num_sessions = len(self._sessions)
+
+        return (f"session memory: {session_nbytes / 1024**2:.1f} MB "
+                f"({num_sessions} session{'s' if num_sessions != 1 else ''}: {total_nbytes / 1024**2:.1f} MB)")
+
+    def _remove(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+
+    def _evict(self, keep_id):
+        now = time.monotonic()
+        for session_id in list(self._sessions.keys()):
+            if session_id != keep_id and self.ttl > 0 and now - self._last_access[session_id] > self.ttl:
+                self._remove(session_id)
+                ia_logging.info(f"Removed idle session: {session_id}")
+
+        while self.max_sessions > 0 and len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            self._remove(session_id)
+            ia_logging.info(f"Removed least recently used session: {session_id}")
+
+        if self.max_memory_mb > 0:
+            sessions_nbytes = OrderedDict((session_id, get_object_nbytes(state)) for session_id, state in self._sessions.items())
+            for session_id, nbytes in sessions_nbytes.items():
+                if sum(sessions_nbytes.values()) <= self.max_memory_mb * 1024**2:
+                    break
+                if session_id != keep_id:
+                    sessions_nbytes[session_id] = 0
+                    self._remove(session_id)
+                    ia_logging.info(f"Removed least recently used session to free {nbytes / 1024**2:.1f} MB: {session_id}")
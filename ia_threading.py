@@ -53,3 +53,20 @@ def clear_cache_decorator(func):
         return yield_wrapper
     else:
         return wrapper
+
+
+def model_access_decorator(func):
+    """Run a function while holding model_access_sem, so that models are run one at a time across sessions.
+
+    Generators would hold model_access_sem while their outputs are streamed, they take it around
+    each model call instead.
+    """
+    if inspect.isgeneratorfunction(func):
+        raise TypeError(f"model_access_decorator does not support generator functions: {func.__name__}")
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with model_access_sem:
+            return func(*args, **kwargs)
+
+    return wrapper
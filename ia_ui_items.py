@@ -37,6 +37,20 @@ def get_sam_model_ids():
     return sam_model_ids
 
 
+def get_sam_img_sizes():
+    """Get SAM input image sizes list.
+
+    Returns:
+        list: SAM input image sizes list
+    """
+    sam_img_sizes = [
+        "1024",
+        "768",
+        "512",
+    ]
+    return sam_img_sizes
+
+
 inp_list_from_cache = None
 
 
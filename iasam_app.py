@@ -27,14 +27,17 @@ from torchvision import transforms
 
 import inpalib
 from ia_check_versions import ia_check_versions
+from ia_compile import SAM_COMPILE_MODES, compile_unet
 from ia_config import IAConfig, get_ia_config_index, set_ia_config, setup_ia_config_ini
 from ia_devices import devices
 from ia_file_manager import IAFileManager, download_model_from_hf, ia_file_manager
 from ia_logging import ia_logging
-from ia_threading import clear_cache_decorator
+from ia_sam_onnx import SAM_BACKENDS
+from ia_session import SessionStore, new_session_id
+from ia_threading import clear_cache_decorator, model_access_decorator, model_access_sem
 from ia_ui_gradio import reload_javascript
 from ia_ui_items import (get_cleaner_model_ids, get_inp_model_ids, get_padding_mode_names,
-                         get_sam_model_ids, get_sampler_names)
+                         get_sam_img_sizes, get_sam_model_ids, get_sampler_names)
 
 print("platform:", platform.system())
 
@@ -49,6 +52,46 @@ parser = argparse.ArgumentParser(description="Inpaint Anything")
 parser.add_argument("--save-seg", action="store_true", help="Save the segmentation image generated by SAM.")
 parser.add_argument("--offline", action="store_true", help="Execute inpainting using an offline network.")
 parser.add_argument("--sam-cpu", action="store_true", help="Perform the Segment Anything operation on CPU.")
+parser.add_argument("--sam-precision", choices=["fp32", "fp16", "bf16"], default="fp32",
+                    help="Precision of Segment Anything. fp16 falls back to bf16 on CPU.")
+parser.add_argument("--sam-compile", choices=SAM_COMPILE_MODES, default=None,
+                    help="Compile the Segment Anything image encoder with TorchScript tracing (trace) or torch.compile (inductor).")
+parser.add_argument("--unet-compile", action="store_true",
+                    help="Compile the inpainting UNet with torch.compile, and keep the pipeline in memory for the next runs of the same model.")
+parser.add_argument("--sam-quantize", nargs="*", default=None, metavar="SAM_MODEL_ID",
+                    help="Use dynamic int8 quantization for Segment Anything on CPU (all models, or the given SAM model IDs only).")
+parser.add_argument("--sam-rectangular-input", action="store_true",
+                    help="Pad images for the Segment Anything ViT image encoder to multiples of its window size instead of a square.")
+parser.add_argument("--sam-channels-last", action="store_true",
+                    help="Run the conv layers of the Segment Anything encoder neck and mask decoder in channels-last with a fused LayerNorm2d.")
+parser.add_argument("--sam-sdpa", nargs="*", type=int, default=None, metavar="BLOCK_INDEX",
+                    help="Use scaled_dot_product_attention in the Segment Anything mask decoder and in the global attention blocks "
+                         "of the ViT image encoder, or in the given image encoder blocks only.")
+parser.add_argument("--sam-token-merging", nargs="+", type=float, default=None, metavar="RATIO",
+                    help="Merge this fraction of similar tokens in the global attention blocks of the SAM ViT image encoder "
+                         "(one ratio for all blocks, or one per global attention block).")
+parser.add_argument("--sam-backend", choices=SAM_BACKENDS, default="torch",
+                    help="Run Segment Anything with PyTorch (torch) or ONNX Runtime (onnx). ONNX models are exported on the first run.")
+parser.add_argument("--sam-onnx-threads", type=int, default=0,
+                    help="Number of threads of each ONNX Runtime session (default: 0, the ONNX Runtime default).")
+parser.add_argument("--sam-model-cache", type=int, default=0, metavar="NUM_MODELS",
+                    help="Keep up to NUM_MODELS SAM models in memory, sharing the weights they have in common (default: 0, load on each run).")
+parser.add_argument("--sam-mask-cache", action="store_true",
+                    help="Save the Segment Anything masks of each image to the cache directory, and load them instead of running SAM again.")
+parser.add_argument("--sam-mask-candidates", action="store_true",
+                    help="Keep the candidate masks of the last Segment Anything run in memory, and filter them again "
+                         "instead of running SAM when only Anime Style changes (not for FastSAM).")
+parser.add_argument("--sam-incremental-update", action="store_true",
+                    help="When the input image is the last segmented image with a region changed, such as an inpainting or cleaner "
+                         "result sent back, run Segment Anything on the changed region only and update the masks.")
+parser.add_argument("--concurrency-count", type=int, default=1,
+                    help="Number of requests processed in parallel, models are still run one at a time (default: 1).")
+parser.add_argument("--session-ttl", type=float, default=0.0, metavar="SECONDS",
+                    help="Remove the masks of browser sessions idle for longer than this, 0 for no limit (default: 0).")
+parser.add_argument("--max-sessions", type=int, default=0,
+                    help="Maximum number of browser sessions whose masks are kept, 0 for no limit (default: 0).")
+parser.add_argument("--session-memory", type=float, default=0.0, metavar="MB",
+                    help="Maximum memory of the masks of all browser sessions in MB, 0 for no limit (default: 0).")
 args = parser.parse_args()
 IAConfig.global_args.update(args.__dict__)
 
@@ -86,7 +129,31 @@ def download_model(sam_model_id):
         return "Model already exists"
 
 
-sam_dict = dict(sam_masks=None, mask_image=None, cnet=None, orig_image=None, pad_mask=None)
+def new_sam_dict():
+    return dict(sam_masks=None, mask_index=None, mask_candidates=None, unpadded_sam_masks=None, mask_image=None, cnet=None,
+                orig_image=None, pad_mask=None)
+
+
+def get_mask_index(sam_dict):
+    """Get the index for the hit tests of the SAM masks of a session, such as selecting the masks
+    under a sketch, building it on the first query after the masks change.
+
+    Args:
+        sam_dict (dict): state of the session
+
+    Returns:
+        inpalib.MaskIndex: index of the SAM masks, None if there are no SAM masks
+    """
+    sam_masks = sam_dict["sam_masks"]
+    if not isinstance(sam_masks, inpalib.MaskSet):
+        return None
+    if sam_dict["mask_index"] is None or sam_dict["mask_index"].mask_set is not sam_masks:
+        sam_dict["mask_index"] = inpalib.MaskIndex(sam_masks)
+
+    return sam_dict["mask_index"]
+
+
+session_store = SessionStore(new_sam_dict, ttl=args.session_ttl, max_sessions=args.max_sessions, max_memory_mb=args.session_memory)
 
 
 def save_mask_image(mask_image, save_mask_chk=False):
@@ -106,8 +173,8 @@ def save_mask_image(mask_image, save_mask_chk=False):
 
 
 @clear_cache_decorator
-def input_image_upload(input_image, sam_image, sel_mask):
-    global sam_dict
+def input_image_upload(input_image, sam_image, sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     sam_dict["orig_image"] = input_image
     sam_dict["pad_mask"] = None
 
@@ -119,11 +186,13 @@ def input_image_upload(input_image, sam_image, sel_mask):
 
     if sam_image is None or not isinstance(sam_image, dict) or "image" not in sam_image:
         sam_dict["sam_masks"] = None
+        sam_dict["mask_index"] = None
         ret_sam_image = np.zeros_like(input_image, dtype=np.uint8)
     elif sam_image["image"].shape == input_image.shape:
         ret_sam_image = gr.update()
     else:
         sam_dict["sam_masks"] = None
+        sam_dict["mask_index"] = None
         ret_sam_image = gr.update(value=np.zeros_like(input_image, dtype=np.uint8))
 
     if sel_mask is None or not isinstance(sel_mask, dict) or "image" not in sel_mask:
@@ -137,8 +206,9 @@ def input_image_upload(input_image, sam_image, sel_mask):
 
 
 @clear_cache_decorator
-def run_padding(input_image, pad_scale_width, pad_scale_height, pad_lr_barance, pad_tb_barance, padding_mode="edge"):
-    global sam_dict
+def run_padding(input_image, pad_scale_width, pad_scale_height, pad_lr_barance, pad_tb_barance, padding_mode="edge",
+                session_id=None):
+    sam_dict = session_store.get(session_id)
     if input_image is None or sam_dict["orig_image"] is None:
         sam_dict["orig_image"] = None
         sam_dict["pad_mask"] = None
@@ -171,9 +241,128 @@ def run_padding(input_image, pad_scale_width, pad_scale_height, pad_lr_barance,
     return pad_image, "Padding done"
 
 
+def get_sam_masks_from_candidates(sam_dict, input_image, sam_model_id, anime_style_chk=False, img_size=None):
+    """Get SAM masks by filtering the candidate masks of the image, generating them if needed.
+
+    Args:
+        sam_dict (dict): state of the session
+        input_image (np.ndarray): input image
+        sam_model_id (str): SAM model ID
+        anime_style_chk (bool): anime style check
+        img_size (int, optional): input image size of the SAM image encoder
+
+    Returns:
+        list[dict]: SAM masks
+    """
+    # The candidates are generated with the anime style thresholds, see generate_sam_mask_candidates
+    candidates_metadata = inpalib.get_sam_masks_metadata(input_image, sam_model_id, True, img_size)
+    if sam_dict["mask_candidates"] is None or sam_dict["mask_candidates"][0] != candidates_metadata:
+        sam_dict["mask_candidates"] = None
+        candidates = inpalib.generate_sam_mask_candidates(input_image, sam_model_id, img_size)
+        sam_dict["mask_candidates"] = (candidates_metadata, candidates)
+    else:
+        ia_logging.info("Filtering the candidate masks of the last Segment Anything run")
+
+    return inpalib.filter_sam_mask_candidates(sam_dict["mask_candidates"][1], anime_style_chk)
+
+
+def get_pad_width(pad_mask, shape):
+    """Get the padding of an image padded by run_padding.
+
+    Args:
+        pad_mask (dict, optional): pad mask stored by run_padding
+        shape (tuple[int, int]): shape of the image
+
+    Returns:
+        tuple[tuple[int, int], tuple[int, int]] or None: top and bottom, and left and right padding,
+            None if the image is not padded
+    """
+    if pad_mask is None or pad_mask["segmentation"].shape != shape[:2] or not np.any(pad_mask["segmentation"]):
+        return None
+    rows = np.flatnonzero(~np.all(pad_mask["segmentation"], axis=1))
+    cols = np.flatnonzero(~np.all(pad_mask["segmentation"], axis=0))
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+
+    return (int(rows[0]), shape[0] - int(rows[-1]) - 1), (int(cols[0]), shape[1] - int(cols[-1]) - 1)
+
+
+def get_unpadded_sam_masks(sam_dict, input_image, sam_model_id, anime_style_chk=False, img_size=None):
+    """Get the SAM masks of an unpadded image, reusing those of the last run for the same image and settings.
+
+    Re-running SAM after padding the same image again, with other scales or balances, reuses the masks.
+    With --sam-incremental-update, the masks of an image changed in a region only are updated.
+    Updated masks are not written to --sam-mask-cache, which holds the masks of full runs only.
+
+    Args:
+        sam_dict (dict): state of the session
+        input_image (np.ndarray): unpadded input image
+        sam_model_id (str): SAM model ID
+        anime_style_chk (bool): anime style check
+        img_size (int, optional): input image size of the SAM image encoder
+
+    Returns:
+        MaskSet: SAM masks sorted by area
+    """
+    sam_masks_metadata = inpalib.get_sam_masks_metadata(input_image, sam_model_id, anime_style_chk, img_size)
+    last_sam_masks = sam_dict["unpadded_sam_masks"]
+    if last_sam_masks is not None and last_sam_masks[0] == sam_masks_metadata:
+        ia_logging.info("Reusing the SAM masks of the last run")
+        return last_sam_masks[1]
+    sam_dict["unpadded_sam_masks"] = None
+
+    sam_masks = None
+    if IAConfig.global_args.get("sam_mask_cache", False):
+        sam_masks = inpalib.load_sam_masks(sam_masks_metadata)
+    if sam_masks is None:
+        if last_sam_masks is not None and IAConfig.global_args.get("sam_incremental_update", False):
+            sam_masks = update_last_sam_masks(input_image, sam_masks_metadata, last_sam_masks)
+        if sam_masks is None:
+            if IAConfig.global_args.get("sam_mask_candidates", False) and "FastSAM" not in sam_model_id:
+                sam_masks = get_sam_masks_from_candidates(sam_dict, input_image, sam_model_id, anime_style_chk, img_size)
+            else:
+                sam_masks = inpalib.generate_sam_masks(input_image, sam_model_id, anime_style_chk, img_size)
+            sam_masks = inpalib.sort_masks_by_area(sam_masks, input_image.shape[:2])
+            if IAConfig.global_args.get("sam_mask_cache", False):
+                inpalib.save_sam_masks(sam_masks, sam_masks_metadata)
+    sam_dict["unpadded_sam_masks"] = (sam_masks_metadata, sam_masks, input_image)
+
+    return sam_masks
+
+
+def update_last_sam_masks(input_image, sam_masks_metadata, last_sam_masks, max_changed_ratio=0.5):
+    """Update the SAM masks of the last run, if only a region of the image has changed since.
+
+    Args:
+        input_image (np.ndarray): unpadded input image
+        sam_masks_metadata (dict): metadata of the SAM masks of the input image
+        last_sam_masks (tuple): metadata, SAM masks and image of the last run
+        max_changed_ratio (float): largest area of the padded box of the changed region, as a fraction of the image area
+
+    Returns:
+        MaskSet or None: SAM masks, None if the settings or the image size differ, or the changed region is too large
+    """
+    last_metadata, last_masks, last_image = last_sam_masks
+    if {k: v for k, v in last_metadata.items() if k != "image_hash"} != {k: v for k, v in sam_masks_metadata.items() if k != "image_hash"}:
+        return None
+    changed_mask = inpalib.get_changed_mask(last_image, input_image)
+    if changed_mask is None or not np.any(changed_mask):
+        return None
+
+    rows = np.flatnonzero(np.any(changed_mask, axis=1))
+    cols = np.flatnonzero(np.any(changed_mask, axis=0))
+    changed_area = (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1)
+    if changed_area > max_changed_ratio * changed_mask.size:
+        ia_logging.info("The changed region is too large to update the SAM masks, running Segment Anything on the whole image")
+        return None
+
+    return inpalib.update_sam_masks(input_image, last_masks, changed_mask, sam_masks_metadata["sam_id"],
+                                    sam_masks_metadata["anime_style_chk"], sam_masks_metadata["img_size"])
+
+
 @clear_cache_decorator
-def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False):
-    global sam_dict
+def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False, sam_img_size="1024", session_id=None):
+    sam_dict = session_store.get(session_id)
     if not inpalib.sam_file_exists(sam_model_id):
         ret_sam_image = None if sam_image is None else gr.update()
         return ret_sam_image, f"{sam_model_id} not found, please download"
@@ -186,19 +375,37 @@ def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False):
 
     if sam_dict["sam_masks"] is not None:
         sam_dict["sam_masks"] = None
+        sam_dict["mask_index"] = None
         gc.collect()
 
     ia_logging.info(f"input_image: {input_image.shape} {input_image.dtype}")
 
     try:
-        sam_masks = inpalib.generate_sam_masks(input_image, sam_model_id, anime_style_chk)
-        sam_masks = inpalib.sort_masks_by_area(sam_masks)
+        img_size = int(sam_img_size) if int(sam_img_size) < 1024 else None
+        # After run_padding, segment the original image only and pad its masks
+        pad_width = get_pad_width(sam_dict["pad_mask"], input_image.shape)
+        with model_access_sem:
+            if pad_width is None:
+                sam_masks = get_unpadded_sam_masks(sam_dict, input_image, sam_model_id, anime_style_chk, img_size)
+            else:
+                (top, bottom), (left, right) = pad_width
+                unpadded_image = input_image[top:input_image.shape[0] - bottom, left:input_image.shape[1] - right]
+                sam_masks = get_unpadded_sam_masks(sam_dict, unpadded_image, sam_model_id, anime_style_chk, img_size)
+        if pad_width is not None:
+            sam_masks = sam_masks.pad(pad_width)
         sam_masks = inpalib.insert_mask_to_sam_masks(sam_masks, sam_dict["pad_mask"])
 
         seg_image = inpalib.create_seg_color_image(input_image, sam_masks)
 
         sam_dict["sam_masks"] = sam_masks
+        # The hit-test index is built on the first mask selection, see get_mask_index
+        sam_dict["mask_index"] = None
 
+    except ValueError as e:
+        # Invalid inputs, such as a model without candidate masks with --sam-mask-candidates
+        ia_logging.error(str(e))
+        ret_sam_image = None if sam_image is None else gr.update()
+        return ret_sam_image, f"Segment Anything failed: {e}"
     except Exception as e:
         print(traceback.format_exc())
         ia_logging.error(str(e))
@@ -210,18 +417,25 @@ def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False):
         save_name = os.path.join(ia_file_manager.outputs_dir, save_name)
         Image.fromarray(seg_image).save(save_name)
 
+    status_text = "Segment Anything complete"
+    if int(sam_img_size) < 1024:
+        status_text = f"Segment Anything preview ({sam_img_size}) complete"
+    session_summary = session_store.get_summary(session_id)
+    ia_logging.info(session_summary)
+    status_text = f"{status_text} ({session_summary})"
+
     if sam_image is None:
-        return seg_image, "Segment Anything complete"
+        return seg_image, status_text
     else:
         if sam_image["image"].shape == seg_image.shape and np.all(sam_image["image"] == seg_image):
-            return gr.update(), "Segment Anything complete"
+            return gr.update(), status_text
         else:
-            return gr.update(value=seg_image), "Segment Anything complete"
+            return gr.update(value=seg_image), status_text
 
 
 @clear_cache_decorator
-def select_mask(input_image, sam_image, invert_chk, ignore_black_chk, sel_mask):
-    global sam_dict
+def select_mask(input_image, sam_image, invert_chk, ignore_black_chk, sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     if sam_dict["sam_masks"] is None or sam_image is None:
         ret_sel_mask = None if sel_mask is None else gr.update()
         return ret_sel_mask
@@ -231,7 +445,7 @@ def select_mask(input_image, sam_image, invert_chk, ignore_black_chk, sel_mask):
     mask = sam_image["mask"][:, :, 0:1]
 
     try:
-        seg_image = inpalib.create_mask_image(mask, sam_masks, ignore_black_chk)
+        seg_image = inpalib.create_mask_image(mask, sam_masks, ignore_black_chk, mask_index=get_mask_index(sam_dict))
         if invert_chk:
             seg_image = inpalib.invert_mask(seg_image)
 
@@ -258,8 +472,8 @@ def select_mask(input_image, sam_image, invert_chk, ignore_black_chk, sel_mask):
 
 
 @clear_cache_decorator
-def expand_mask(input_image, sel_mask, expand_iteration=1):
-    global sam_dict
+def expand_mask(input_image, sel_mask, expand_iteration=1, session_id=None):
+    sam_dict = session_store.get(session_id)
     if sam_dict["mask_image"] is None or sel_mask is None:
         return None
 
@@ -283,8 +497,8 @@ def expand_mask(input_image, sel_mask, expand_iteration=1):
 
 
 @clear_cache_decorator
-def apply_mask(input_image, sel_mask):
-    global sam_dict
+def apply_mask(input_image, sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     if sam_dict["mask_image"] is None or sel_mask is None:
         return None
 
@@ -306,8 +520,8 @@ def apply_mask(input_image, sel_mask):
 
 
 @clear_cache_decorator
-def add_mask(input_image, sel_mask):
-    global sam_dict
+def add_mask(input_image, sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     if sam_dict["mask_image"] is None or sel_mask is None:
         return None
 
@@ -355,10 +569,79 @@ def auto_resize_to_pil(input_image, mask_image):
     return init_image, mask_image
 
 
+inp_pipe_cache = dict(key=None, pipe=None, scheduler=None)
+
+
+def load_inp_pipe(inp_model_id, torch_dtype, local_files_only=False, config_offline_inpainting=False):
+    """Load the inpainting pipeline and move it to its device.
+
+    With --unet-compile, the pipeline and its compiled UNet are kept for the next runs with the same
+    model ID, dtype and device, so that the UNet is compiled once per process.
+
+    Args:
+        inp_model_id (str): inpainting model ID
+        torch_dtype (torch.dtype): dtype of the pipeline
+        local_files_only (bool): load the model from the local cache only
+        config_offline_inpainting (bool): True if running on an offline network
+
+    Returns:
+        StableDiffusionInpaintPipeline or None: pipeline with its original scheduler, None if loading failed
+    """
+    unet_compile = IAConfig.global_args.get("unet_compile", False)
+    pipe_key = (inp_model_id, str(torch_dtype), str(devices.device))
+    if unet_compile and inp_pipe_cache["key"] == pipe_key:
+        ia_logging.info(f"Using the pipeline with the compiled UNet: {inp_model_id}")
+        pipe = inp_pipe_cache["pipe"]
+        pipe.scheduler = inp_pipe_cache["scheduler"]
+        return pipe
+    inp_pipe_cache.update(key=None, pipe=None, scheduler=None)
+
+    try:
+        pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, local_files_only=local_files_only)
+    except Exception as e:
+        ia_logging.error(str(e))
+        if not config_offline_inpainting:
+            try:
+                pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, resume_download=True)
+            except Exception as e:
+                ia_logging.error(str(e))
+                try:
+                    pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, force_download=True)
+                except Exception as e:
+                    ia_logging.error(str(e))
+                    return None
+        else:
+            return None
+    pipe.safety_checker = None
+
+    if platform.system() == "Darwin":
+        pipe = pipe.to("mps" if ia_check_versions.torch_mps_is_available else "cpu")
+        pipe.enable_attention_slicing()
+    else:
+        if ia_check_versions.diffusers_enable_cpu_offload and devices.device != devices.cpu:
+            ia_logging.info("Enable model cpu offload")
+            pipe.enable_model_cpu_offload()
+        else:
+            pipe = pipe.to(devices.device)
+        if xformers_available:
+            ia_logging.info("Enable xformers memory efficient attention")
+            pipe.enable_xformers_memory_efficient_attention()
+        else:
+            ia_logging.info("Enable attention slicing")
+            pipe.enable_attention_slicing()
+
+    if unet_compile:
+        ia_logging.info("Compile UNet with torch.compile")
+        pipe = compile_unet(pipe)
+        inp_pipe_cache.update(key=pipe_key, pipe=pipe, scheduler=pipe.scheduler)
+
+    return pipe
+
+
 @clear_cache_decorator
 def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale, seed, inp_model_id, save_mask_chk, composite_chk,
-                sampler_name="DDIM", iteration_count=1):
-    global sam_dict
+                sampler_name="DDIM", iteration_count=1, session_id=None):
+    sam_dict = session_store.get(session_id)
     if input_image is None or sam_dict["mask_image"] is None or sel_mask is None:
         ia_logging.error("The image or mask does not exist")
         return
@@ -391,59 +674,31 @@ def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale,
     else:
         torch_dtype = torch.float16
 
-    try:
-        pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, local_files_only=local_files_only)
-    except Exception as e:
-        ia_logging.error(str(e))
-        if not config_offline_inpainting:
-            try:
-                pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, resume_download=True)
-            except Exception as e:
-                ia_logging.error(str(e))
-                try:
-                    pipe = StableDiffusionInpaintPipeline.from_pretrained(inp_model_id, torch_dtype=torch_dtype, force_download=True)
-                except Exception as e:
-                    ia_logging.error(str(e))
-                    return
-        else:
+    # model_access_sem is taken around each model call, and released while the outputs are yielded
+    with model_access_sem:
+        pipe = load_inp_pipe(inp_model_id, torch_dtype, local_files_only, config_offline_inpainting)
+        if pipe is None:
             return
-    pipe.safety_checker = None
 
-    ia_logging.info(f"Using sampler {sampler_name}")
-    if sampler_name == "DDIM":
-        pipe.scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
-    elif sampler_name == "Euler":
-        pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
-    elif sampler_name == "Euler a":
-        pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(pipe.scheduler.config)
-    elif sampler_name == "DPM2 Karras":
-        pipe.scheduler = KDPM2DiscreteScheduler.from_config(pipe.scheduler.config)
-    elif sampler_name == "DPM2 a Karras":
-        pipe.scheduler = KDPM2AncestralDiscreteScheduler.from_config(pipe.scheduler.config)
-    else:
-        ia_logging.info("Sampler fallback to DDIM")
-        pipe.scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
+        ia_logging.info(f"Using sampler {sampler_name}")
+        if sampler_name == "DDIM":
+            scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
+        elif sampler_name == "Euler":
+            scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
+        elif sampler_name == "Euler a":
+            scheduler = EulerAncestralDiscreteScheduler.from_config(pipe.scheduler.config)
+        elif sampler_name == "DPM2 Karras":
+            scheduler = KDPM2DiscreteScheduler.from_config(pipe.scheduler.config)
+        elif sampler_name == "DPM2 a Karras":
+            scheduler = KDPM2AncestralDiscreteScheduler.from_config(pipe.scheduler.config)
+        else:
+            ia_logging.info("Sampler fallback to DDIM")
+            scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
 
-    if platform.system() == "Darwin":
-        pipe = pipe.to("mps" if ia_check_versions.torch_mps_is_available else "cpu")
-        pipe.enable_attention_slicing()
+    if platform.system() == "Darwin" or "privateuseone" in str(getattr(devices.device, "type", "")):
         torch_generator = torch.Generator(devices.cpu)
     else:
-        if ia_check_versions.diffusers_enable_cpu_offload and devices.device != devices.cpu:
-            ia_logging.info("Enable model cpu offload")
-            pipe.enable_model_cpu_offload()
-        else:
-            pipe = pipe.to(devices.device)
-        if xformers_available:
-            ia_logging.info("Enable xformers memory efficient attention")
-            pipe.enable_xformers_memory_efficient_attention()
-        else:
-            ia_logging.info("Enable attention slicing")
-            pipe.enable_attention_slicing()
-        if "privateuseone" in str(getattr(devices.device, "type", "")):
-            torch_generator = torch.Generator(devices.cpu)
-        else:
-            torch_generator = torch.Generator(devices.device)
+        torch_generator = torch.Generator(devices.device)
 
     init_image, mask_image = auto_resize_to_pil(input_image, mask_image)
     width, height = init_image.size
@@ -469,7 +724,10 @@ def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale,
             "generator": generator,
         }
 
-        output_image = pipe(**pipe_args_dict).images[0]
+        with model_access_sem:
+            # The pipeline kept with --unet-compile is shared with the other sessions
+            pipe.scheduler = scheduler
+            output_image = pipe(**pipe_args_dict).images[0]
 
         if composite_chk:
             dilate_mask_image = Image.fromarray(cv2.dilate(np.array(mask_image), np.ones((3, 3), dtype=np.uint8), iterations=4))
@@ -501,9 +759,10 @@ def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale,
         yield output_list, max([1, iteration_count - (count + 1)])
 
 
+@model_access_decorator
 @clear_cache_decorator
-def run_cleaner(input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk):
-    global sam_dict
+def run_cleaner(input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk, session_id=None):
+    sam_dict = session_store.get(session_id)
     if input_image is None or sam_dict["mask_image"] is None or sel_mask is None:
         ia_logging.error("The image or mask does not exist")
         return None
@@ -552,8 +811,8 @@ def run_cleaner(input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk):
 
 
 @clear_cache_decorator
-def run_get_alpha_image(input_image, sel_mask):
-    global sam_dict
+def run_get_alpha_image(input_image, sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     if input_image is None or sam_dict["mask_image"] is None or sel_mask is None:
         ia_logging.error("The image or mask does not exist")
         return None, ""
@@ -576,8 +835,8 @@ def run_get_alpha_image(input_image, sel_mask):
 
 
 @clear_cache_decorator
-def run_get_mask(sel_mask):
-    global sam_dict
+def run_get_mask(sel_mask, session_id=None):
+    sam_dict = session_store.get(session_id)
     if sam_dict["mask_image"] is None or sel_mask is None:
         return None
 
@@ -599,10 +858,11 @@ def on_ui_tabs():
     inp_model_index = get_ia_config_index(IAConfig.KEYS.INP_MODEL_ID, IAConfig.SECTIONS.USER)
     cleaner_model_ids = get_cleaner_model_ids()
     padding_mode_names = get_padding_mode_names()
+    sam_img_sizes = get_sam_img_sizes()
 
     out_gallery_kwargs = dict(columns=2, height=520, object_fit="contain", preview=True)
 
-    block = gr.Blocks().queue()
+    block = gr.Blocks().queue(concurrency_count=max(IAConfig.global_args.get("concurrency_count", 1), 1))
     block.title = "Inpaint Anything"
     with block as inpaint_anything_interface:
         with gr.Row():
@@ -643,6 +903,8 @@ def on_ui_tabs():
                     with gr.Column():
                         anime_style_chk = gr.Checkbox(label="Anime Style (Up Detection, Down mask Quality)", elem_id="anime_style_chk",
                                                       show_label=True, interactive=True)
+                        sam_img_size = gr.Radio(label="SAM Resolution (lower for a faster preview, then refine at 1024)", elem_id="sam_img_size",
+                                                choices=sam_img_sizes, value=sam_img_sizes[0], show_label=True, interactive=True)
                     with gr.Column():
                         sam_btn = gr.Button("Run Segment Anything", elem_id="sam_btn", variant="primary", interactive=False)
 
@@ -761,38 +1023,44 @@ def on_ui_tabs():
                         apply_mask_btn = gr.Button("Trim mask by sketch", elem_id="apply_mask_btn")
                         add_mask_btn = gr.Button("Add mask by sketch", elem_id="add_mask_btn")
 
+            # Each browser page gets its own session ID, keying its masks in session_store
+            session_id = gr.State(None)
+            inpaint_anything_interface.load(new_session_id, inputs=None, outputs=[session_id])
+
             load_model_btn.click(download_model, inputs=[sam_model_id], outputs=[status_text])
-            input_image.upload(input_image_upload, inputs=[input_image, sam_image, sel_mask], outputs=[sam_image, sel_mask, sam_btn]).then(
+            input_image.upload(input_image_upload, inputs=[input_image, sam_image, sel_mask, session_id], outputs=[sam_image, sel_mask, sam_btn]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_initSamSelMask")
-            padding_btn.click(run_padding, inputs=[input_image, pad_scale_width, pad_scale_height, pad_lr_barance, pad_tb_barance, padding_mode],
+            padding_btn.click(run_padding, inputs=[input_image, pad_scale_width, pad_scale_height, pad_lr_barance, pad_tb_barance, padding_mode,
+                                                   session_id],
                               outputs=[input_image, status_text])
-            sam_btn.click(run_sam, inputs=[input_image, sam_model_id, sam_image, anime_style_chk], outputs=[sam_image, status_text]).then(
+            sam_btn.click(run_sam, inputs=[input_image, sam_model_id, sam_image, anime_style_chk, sam_img_size, session_id],
+                          outputs=[sam_image, status_text]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSamMask")
-            select_btn.click(select_mask, inputs=[input_image, sam_image, invert_chk, ignore_black_chk, sel_mask], outputs=[sel_mask]).then(
+            select_btn.click(select_mask, inputs=[input_image, sam_image, invert_chk, ignore_black_chk, sel_mask, session_id], outputs=[sel_mask]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSelMask")
-            expand_mask_btn.click(expand_mask, inputs=[input_image, sel_mask, expand_mask_iteration_count], outputs=[sel_mask]).then(
+            expand_mask_btn.click(expand_mask, inputs=[input_image, sel_mask, expand_mask_iteration_count, session_id], outputs=[sel_mask]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSelMask")
-            apply_mask_btn.click(apply_mask, inputs=[input_image, sel_mask], outputs=[sel_mask]).then(
+            apply_mask_btn.click(apply_mask, inputs=[input_image, sel_mask, session_id], outputs=[sel_mask]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSelMask")
-            add_mask_btn.click(add_mask, inputs=[input_image, sel_mask], outputs=[sel_mask]).then(
+            add_mask_btn.click(add_mask, inputs=[input_image, sel_mask, session_id], outputs=[sel_mask]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSelMask")
 
             inpaint_btn.click(
                 run_inpaint,
                 inputs=[input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale, seed, inp_model_id, save_mask_chk, composite_chk,
-                        sampler_name, iteration_count],
+                        sampler_name, iteration_count, session_id],
                 outputs=[out_image, iteration_count])
             cleaner_btn.click(
                 run_cleaner,
-                inputs=[input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk],
+                inputs=[input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk, session_id],
                 outputs=[cleaner_out_image])
             get_alpha_image_btn.click(
                 run_get_alpha_image,
-                inputs=[input_image, sel_mask],
+                inputs=[input_image, sel_mask, session_id],
                 outputs=[alpha_out_image, get_alpha_status_text])
             get_mask_btn.click(
                 run_get_mask,
-                inputs=[sel_mask],
+                inputs=[sel_mask, session_id],
                 outputs=[mask_out_image])
 
     return [(inpaint_anything_interface, "Inpaint Anything", "inpaint_anything")]
@@ -1,18 +1,37 @@
+from .maskfile import load_mask_set, save_mask_set
+from .maskindex import MaskIndex
 from .masklib import create_mask_image, invert_mask
-from .samlib import (create_seg_color_image, generate_sam_masks, get_all_sam_ids,
-                     get_available_sam_ids, get_seg_colormap, insert_mask_to_sam_masks,
-                     sam_file_exists, sam_file_path, sort_masks_by_area)
+from .maskset import MaskSet, create_label_map
+from .samlib import (create_seg_color_image, filter_sam_mask_candidates, generate_sam_mask_candidates,
+                     generate_sam_masks, get_all_sam_ids, get_available_sam_ids, get_changed_mask,
+                     get_sam_masks_metadata, get_seg_colormap, insert_mask_to_sam_masks, load_sam_masks,
+                     merge_sam_masks, sam_file_exists, sam_file_path, sam_masks_file_path, save_sam_masks, sort_masks_by_area,
+                     update_sam_masks)
 
 __all__ = [
+    "load_mask_set",
+    "save_mask_set",
     "create_mask_image",
     "invert_mask",
+    "MaskIndex",
+    "MaskSet",
+    "create_label_map",
     "create_seg_color_image",
+    "filter_sam_mask_candidates",
+    "generate_sam_mask_candidates",
     "generate_sam_masks",
     "get_all_sam_ids",
     "get_available_sam_ids",
+    "get_changed_mask",
+    "get_sam_masks_metadata",
     "get_seg_colormap",
     "insert_mask_to_sam_masks",
+    "load_sam_masks",
+    "merge_sam_masks",
     "sam_file_exists",
     "sam_file_path",
+    "sam_masks_file_path",
+    "save_sam_masks",
     "sort_masks_by_area",
+    "update_sam_masks",
 ]
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .maskset import MaskSet
+
+MASK_FILE_VERSION = 1
+
+
+def get_image_hash(image: np.ndarray) -> str:
+    """Get the hash of an image, computed from its dtype, shape and contents.
+
+    Args:
+        image (np.ndarray): image
+
+    Returns:
+        str: hash in hex
+    """
+    digest = hashlib.blake2b(f"{image.dtype}{image.shape}".encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(image).data)
+
+    return digest.hexdigest()
+
+
+def get_metadata_hash(metadata: Dict[str, Any]) -> str:
+    """Get the hash of JSON serializable metadata.
+
+    Args:
+        metadata (Dict[str, Any]): metadata
+
+    Returns:
+        str: hash in hex
+    """
+    return hashlib.blake2b(json.dumps(metadata, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def save_mask_set(mask_set: MaskSet, file_path: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+    """Save a mask set to a compressed npz file, atomically.
+
+    The file is written next to file_path and renamed, so that a file at file_path is
+    always complete.
+
+    Args:
+        mask_set (MaskSet): mask set
+        file_path (str): file path
+        metadata (Optional[Dict[str, Any]]): JSON serializable metadata, such as the SAM ID and the image hash
+    """
+    overlaps = [overlap for overlap in mask_set.overlaps if overlap is not None]
+    header = dict(version=MASK_FILE_VERSION, metadata=metadata or {}, masks=mask_set.metadata)
+
+    file_dir = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(file_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=file_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                label_map=mask_set.label_map,
+                bboxes=mask_set.bboxes,
+                areas=mask_set.areas,
+                scores=mask_set.scores,
+                overlaps=np.concatenate(overlaps) if len(overlaps) > 0 else np.zeros(0, dtype=np.uint8),
+                overlap_sizes=np.array([-1 if overlap is None else len(overlap) for overlap in mask_set.overlaps], dtype=np.int64),
+                header=np.array(json.dumps(header, default=lambda o: o.tolist())),
+            )
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_mask_set(file_path: str) -> Tuple[MaskSet, Dict[str, Any]]:
+    """Load a mask set saved by save_mask_set.
+
+    Args:
+        file_path (str): file path
+
+    Returns:
+        Tuple[MaskSet, Dict[str, Any]]: mask set and its metadata
+    """
+    with np.load(file_path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        if header.get("version") != MASK_FILE_VERSION:
+            raise ValueError(f"Unsupported mask file version: {header.get('version')}")
+
+        overlaps = []
+        offset = 0
+        packed = data["overlaps"]
+        for size in data["overlap_sizes"].tolist():
+            overlaps.append(None if size < 0 else packed[offset:offset + size])
+            offset += max(size, 0)
+
+        mask_set = MaskSet(data["label_map"], data["bboxes"], data["areas"], data["scores"], overlaps, header["masks"])
+
+    return mask_set, header["metadata"]
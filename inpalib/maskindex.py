@@ -0,0 +1,344 @@
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .maskset import MaskSet
+
+
+def ragged_arange(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenate the ranges starts[i], ..., starts[i] + counts[i] - 1.
+
+    Args:
+        starts (np.ndarray): starts of the ranges
+        counts (np.ndarray): lengths of the ranges
+
+    Returns:
+        np.ndarray: concatenated ranges in int64
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.cumsum(counts) - counts
+
+    return np.arange(counts.sum(), dtype=np.int64) + np.repeat(np.asarray(starts, dtype=np.int64) - offsets, counts)
+
+
+class MaskIndex:
+    """Hit-test index over a mask set.
+
+    The masks are indexed in a uniform grid of square tiles. Each tile lists the masks
+    with pixels in it, flagged when they cover the whole tile, so that only masks partly
+    covering a tile are checked pixel by pixel, in the label map of the mask set or in
+    their bit-packed pixels if they are hidden in the label map. The index also holds a
+    containment hierarchy, in which the parent of a mask is the smallest larger mask
+    containing it, built on first use.
+
+    Mask indices are those of the mask set. Lists of indices are sorted, so that the
+    topmost mask in the label map comes first.
+    """
+
+    def __init__(self, mask_set: MaskSet, tile_size: int = 16, min_containment: float = 0.9) -> None:
+        """Build the index of a mask set.
+
+        Args:
+            mask_set (MaskSet): mask set
+            tile_size (int): tile size of the grid in pixels
+            min_containment (float): minimum ratio of a mask covered by its parent
+        """
+        self.mask_set = mask_set
+        self.tile_size = tile_size
+        self.min_containment = min_containment
+        height, width = mask_set.shape
+        self.grid_shape = (-(-height // tile_size), -(-width // tile_size))
+        # Inclusive XYXY bounding boxes
+        self.boxes = np.concatenate([mask_set.bboxes[:, :2], mask_set.bboxes[:, :2] + mask_set.bboxes[:, 2:]], axis=1)
+
+        # The bit-packed masks, concatenated to look up bits of several masks at once
+        overlaps = [overlap if overlap is not None else np.zeros(0, dtype=np.uint8) for overlap in mask_set.overlaps]
+        self.bits = np.concatenate(overlaps) if len(overlaps) > 0 else np.zeros(0, dtype=np.uint8)
+        self.bit_offsets = 8 * np.concatenate([[0], np.cumsum([len(overlap) for overlap in overlaps])]).astype(np.int64)
+        self.hidden = np.array([overlap is not None for overlap in mask_set.overlaps], dtype=bool)
+
+        self._build_grid()
+        self._parents = None
+
+    @property
+    def parents(self) -> np.ndarray:
+        """Parent indices of the masks in int32, -1 for root masks, built on first access."""
+        if self._parents is None:
+            self._parents = self._build_parents()
+
+        return self._parents
+
+    def _build_grid(self) -> None:
+        """Build the grid in compressed sparse row format, the masks of tile t are
+        self.tile_masks[self.tile_offsets[t]:self.tile_offsets[t + 1]], flagged in
+        self.tile_full when they cover the whole tile."""
+        mask_set, size = self.mask_set, self.tile_size
+        height, width = mask_set.shape
+        grid_height, grid_width = self.grid_shape
+        # Number of pixels of each tile, less on the bottom and right edges
+        tile_pixels = np.outer(np.minimum(size, height - np.arange(grid_height) * size),
+                               np.minimum(size, width - np.arange(grid_width) * size))
+
+        tiles, masks, full = [], [], []
+        for idx in np.flatnonzero(mask_set.areas > 0):
+            crop, slices = mask_set.get_mask_crop(idx)
+            ty0, tx0 = slices[0].start // size, slices[1].start // size
+            ty1, tx1 = (slices[0].stop - 1) // size, (slices[1].stop - 1) // size
+            padded = np.zeros(((ty1 - ty0 + 1) * size, (tx1 - tx0 + 1) * size), dtype=np.int32)
+            padded[slices[0].start - ty0 * size:slices[0].stop - ty0 * size,
+                   slices[1].start - tx0 * size:slices[1].stop - tx0 * size] = crop
+            counts = padded.reshape(ty1 - ty0 + 1, size, tx1 - tx0 + 1, size).sum(axis=(1, 3))
+            rows, cols = np.nonzero(counts)
+            tiles.append((rows + ty0) * grid_width + cols + tx0)
+            masks.append(np.full(len(rows), idx, dtype=np.int32))
+            full.append(counts[rows, cols] == tile_pixels[rows + ty0, cols + tx0])
+
+        tiles = np.concatenate(tiles) if len(tiles) > 0 else np.zeros(0, dtype=np.int64)
+        order = np.argsort(tiles, kind="stable")
+        self.tile_masks = np.concatenate(masks)[order] if len(masks) > 0 else np.zeros(0, dtype=np.int32)
+        self.tile_full = np.concatenate(full)[order] if len(full) > 0 else np.zeros(0, dtype=bool)
+        self.tile_offsets = np.concatenate([[0], np.cumsum(np.bincount(tiles, minlength=grid_height * grid_width))])
+
+    def _build_parents(self) -> np.ndarray:
+        """Find the parent of each mask, the smallest larger mask covering at least
+        min_containment of it.
+
+        Returns:
+            np.ndarray: parent indices in int32, -1 for root masks
+        """
+        mask_set = self.mask_set
+        parents = np.full(len(mask_set), -1, dtype=np.int32)
+        indices = np.arange(len(mask_set))
+        for idx in np.flatnonzero(mask_set.areas > 0):
+            box = self.boxes[idx]
+            # Masks of the same area are ordered by index, so that the hierarchy has no cycle
+            larger = (mask_set.areas > mask_set.areas[idx]) | ((mask_set.areas == mask_set.areas[idx]) & (indices > idx))
+            candidates = np.flatnonzero(
+                larger & np.all(self.boxes[:, :2] <= box[:2], axis=1) & np.all(self.boxes[:, 2:] >= box[2:], axis=1))
+            if len(candidates) == 0:
+                continue
+
+            crop, slices = mask_set.get_mask_crop(idx)
+            min_count = self.min_containment * mask_set.areas[idx]
+            for candidate in candidates[np.argsort(mask_set.areas[candidates], kind="stable")]:
+                if np.count_nonzero(mask_set.get_mask_region(candidate, slices) & crop) >= min_count:
+                    parents[idx] = candidate
+                    break
+
+        return parents
+
+    def _clip_box(self, x0: int, y0: int, x1: int, y1: int) -> Optional[Tuple[int, int, int, int]]:
+        height, width = self.mask_set.shape
+        x0, y0, x1, y1 = max(0, int(x0)), max(0, int(y0)), min(width - 1, int(x1)), min(height - 1, int(y1))
+
+        return (x0, y0, x1, y1) if x0 <= x1 and y0 <= y1 else None
+
+    def _covers(self, masks: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Check whether masks cover pixels, pairwise.
+
+        Args:
+            masks (np.ndarray): mask indices
+            xs (np.ndarray): columns of the pixels
+            ys (np.ndarray): rows of the pixels
+
+        Returns:
+            np.ndarray: bool array
+        """
+        # Masks not hidden in the label map are labeled on all their pixels
+        covered = self.mask_set.label_map[ys, xs] == masks + 1
+        hidden = self.hidden[masks] & ~covered
+        masks, xs, ys = masks[hidden], xs[hidden], ys[hidden]
+        boxes = self.boxes[masks]
+        inside = (boxes[:, 0] <= xs) & (xs <= boxes[:, 2]) & (boxes[:, 1] <= ys) & (ys <= boxes[:, 3])
+        pos = self.bit_offsets[masks] + (ys - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0] + 1) + (xs - boxes[:, 0])
+        pos = np.where(inside, pos, 0)
+        covered[hidden] = inside & (((self.bits[pos // 8] >> (7 - pos % 8).astype(np.uint8)) & 1) > 0)
+
+        return covered
+
+    def _query_pixels(self, xs: np.ndarray, ys: np.ndarray, all_masks: bool) -> List[int]:
+        """Get the masks covering any of sparse pixels, such as those of a polyline.
+
+        Args:
+            xs (np.ndarray): columns of the pixels
+            ys (np.ndarray): rows of the pixels
+            all_masks (bool): include the masks hidden in the label map under the pixels
+
+        Returns:
+            List[int]: mask indices
+        """
+        labels = np.unique(self.mask_set.label_map[ys, xs])
+        hits = labels[labels > 0] - 1
+        if not all_masks or len(xs) == 0:
+            return hits.tolist()
+
+        # Masks listed in the tiles of the pixels, the masks covering a whole tile are hits
+        tiles = (ys // self.tile_size) * self.grid_shape[1] + xs // self.tile_size
+        order = np.argsort(tiles, kind="stable")
+        tiles, starts, counts = np.unique(tiles[order], return_index=True, return_counts=True)
+        entry_counts = self.tile_offsets[tiles + 1] - self.tile_offsets[tiles]
+        entries = ragged_arange(self.tile_offsets[tiles], entry_counts)
+        masks = self.tile_masks[entries]
+        hits = np.union1d(hits, masks[self.tile_full[entries]])
+
+        # Masks partly covering a tile are checked on the pixels of the tile
+        partial = ~np.isin(masks, hits)
+        entry_tiles = np.repeat(np.arange(len(tiles)), entry_counts)[partial]
+        pixels = order[ragged_arange(starts[entry_tiles], counts[entry_tiles])]
+        masks = np.repeat(masks[partial], counts[entry_tiles])
+        covered = self._covers(masks, xs[pixels], ys[pixels])
+
+        return np.union1d(hits, masks[covered]).tolist()
+
+    def mask_at_point(self, x: int, y: int) -> Optional[int]:
+        """Get the topmost mask at a pixel.
+
+        Args:
+            x (int): column of the pixel
+            y (int): row of the pixel
+
+        Returns:
+            Optional[int]: mask index, None if no mask covers the pixel
+        """
+        height, width = self.mask_set.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+        label = int(self.mask_set.label_map[y, x])
+
+        return label - 1 if label > 0 else None
+
+    def masks_at_pixels(self, xs: np.ndarray, ys: np.ndarray, all_masks: bool = False) -> List[int]:
+        """Get the masks covering any of a set of pixels, such as those of a sketch.
+
+        Args:
+            xs (np.ndarray): columns of the pixels
+            ys (np.ndarray): rows of the pixels
+            all_masks (bool): include the masks hidden under the topmost masks. Defaults to False.
+
+        Returns:
+            List[int]: mask indices
+        """
+        xs, ys = np.asarray(xs, dtype=np.int64).ravel(), np.asarray(ys, dtype=np.int64).ravel()
+        height, width = self.mask_set.shape
+        inside = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+
+        return self._query_pixels(xs[inside], ys[inside], all_masks)
+
+    def masks_at_point(self, x: int, y: int) -> List[int]:
+        """Get all the masks covering a pixel.
+
+        Args:
+            x (int): column of the pixel
+            y (int): row of the pixel
+
+        Returns:
+            List[int]: mask indices
+        """
+        if self.mask_at_point(x, y) is None:
+            # A pixel labeled 0 is covered by no mask, hidden or not
+            return []
+
+        tile = (y // self.tile_size) * self.grid_shape[1] + x // self.tile_size
+        entries = slice(self.tile_offsets[tile], self.tile_offsets[tile + 1])
+        masks, full = self.tile_masks[entries], self.tile_full[entries]
+        partial = masks[~full]
+        covered = self._covers(partial, np.full(len(partial), x), np.full(len(partial), y))
+
+        return np.union1d(masks[full], partial[covered]).astype(int).tolist()
+
+    def masks_in_box(self, x0: int, y0: int, x1: int, y1: int, all_masks: bool = True) -> List[int]:
+        """Get the masks covering any pixel of a box.
+
+        Args:
+            x0 (int): left column of the box
+            y0 (int): top row of the box
+            x1 (int): right column of the box, inclusive
+            y1 (int): bottom row of the box, inclusive
+            all_masks (bool): include the masks hidden under the topmost masks. Defaults to True.
+
+        Returns:
+            List[int]: mask indices
+        """
+        box = self._clip_box(x0, y0, x1, y1)
+        if box is None:
+            return []
+        x0, y0, x1, y1 = box
+        if not all_masks:
+            labels = np.unique(self.mask_set.label_map[y0:y1 + 1, x0:x1 + 1])
+            return (labels[labels > 0] - 1).tolist()
+
+        # All the masks listed in the tiles within the box are hits
+        size, grid_width = self.tile_size, self.grid_shape[1]
+        height, width = self.mask_set.shape
+        ty0, tx0 = -(-y0 // size), -(-x0 // size)
+        ty1 = (y1 + 1) // size - 1 if y1 < height - 1 else self.grid_shape[0] - 1
+        tx1 = (x1 + 1) // size - 1 if x1 < width - 1 else grid_width - 1
+        hits = np.zeros(0, dtype=np.int64)
+        region = np.ones((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+        if ty0 <= ty1 and tx0 <= tx1:
+            tiles = (np.arange(ty0, ty1 + 1)[:, None] * grid_width + np.arange(tx0, tx1 + 1)[None, :]).ravel()
+            entries = ragged_arange(self.tile_offsets[tiles], self.tile_offsets[tiles + 1] - self.tile_offsets[tiles])
+            hits = np.unique(self.tile_masks[entries])
+            region[ty0 * size - y0:(ty1 + 1) * size - y0, tx0 * size - x0:(tx1 + 1) * size - x0] = False
+
+        # The pixels of the box in the tiles on its edges
+        ys, xs = np.nonzero(region)
+
+        return np.union1d(hits, self._query_pixels(xs + x0, ys + y0, True)).astype(int).tolist()
+
+    def masks_on_polyline(self, points: Sequence[Tuple[int, int]], thickness: int = 1, all_masks: bool = True) -> List[int]:
+        """Get the masks covering any pixel of a polyline, such as a pointer path.
+
+        Args:
+            points (Sequence[Tuple[int, int]]): XY points of the polyline
+            thickness (int): line thickness in pixels
+            all_masks (bool): include the masks hidden under the topmost masks. Defaults to True.
+
+        Returns:
+            List[int]: mask indices
+        """
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(points) == 0:
+            return []
+        if len(points) == 1:
+            # A single point is drawn as a segment of length 0
+            points = np.repeat(points, 2, axis=0)
+        pad = thickness // 2 + 1
+        box = self._clip_box(*(points.min(axis=0) - pad), *(points.max(axis=0) + pad))
+        if box is None:
+            return []
+        x0, y0, x1, y1 = box
+
+        canvas = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+        cv2.polylines(canvas, [(points - [x0, y0]).reshape(-1, 1, 2)], False, 1, thickness=thickness)
+        ys, xs = np.nonzero(canvas)
+
+        return self._query_pixels(xs + x0, ys + y0, all_masks)
+
+    def get_children(self, idx: int) -> List[int]:
+        """Get the masks whose parent is a mask.
+
+        Args:
+            idx (int): mask index
+
+        Returns:
+            List[int]: mask indices
+        """
+        return np.flatnonzero(self.parents == idx).tolist()
+
+    def get_ancestors(self, idx: int) -> List[int]:
+        """Get the parent of a mask, the parent of the parent, and so on.
+
+        Args:
+            idx (int): mask index
+
+        Returns:
+            List[int]: mask indices, from the parent to the root
+        """
+        ancestors = []
+        while self.parents[idx] >= 0:
+            idx = int(self.parents[idx])
+            ancestors.append(idx)
+
+        return ancestors
@@ -1,8 +1,11 @@
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 import numpy as np
 from PIL import Image
 
+from .maskindex import MaskIndex
+from .maskset import MaskSet, create_label_map, get_bbox_slices
+
 
 def invert_mask(mask: np.ndarray) -> np.ndarray:
     """Invert mask.
@@ -22,15 +25,19 @@ def invert_mask(mask: np.ndarray) -> np.ndarray:
 
 def check_inputs_create_mask_image(
         mask: Union[np.ndarray, Image.Image],
-        sam_masks: List[Dict[str, Any]],
+        sam_masks: Union[List[Dict[str, Any]], MaskSet],
         ignore_black_chk: bool = True,
+        label_map: Optional[np.ndarray] = None,
+        mask_index: Optional[MaskIndex] = None,
         ) -> None:
     """Check create mask image inputs.
 
     Args:
         mask (Union[np.ndarray, Image.Image]): mask
-        sam_masks (List[Dict[str, Any]]): SAM masks
+        sam_masks (Union[List[Dict[str, Any]], MaskSet]): SAM masks
         ignore_black_chk (bool): ignore black check
+        label_map (Optional[np.ndarray]): label map of the SAM masks
+        mask_index (Optional[MaskIndex]): index of the SAM masks
 
     Returns:
         None
@@ -38,12 +45,18 @@ def check_inputs_create_mask_image(
     if mask is None or not isinstance(mask, (np.ndarray, Image.Image)):
         raise ValueError("Invalid mask")
 
-    if sam_masks is None or not isinstance(sam_masks, list):
+    if sam_masks is None or not isinstance(sam_masks, (list, MaskSet)):
         raise ValueError("Invalid SAM masks")
 
     if ignore_black_chk is None or not isinstance(ignore_black_chk, bool):
         raise ValueError("Invalid ignore black check")
 
+    if label_map is not None and (not isinstance(label_map, np.ndarray) or label_map.ndim != 2):
+        raise ValueError("Invalid label map")
+
+    if mask_index is not None and (not isinstance(mask_index, MaskIndex) or mask_index.mask_set is not sam_masks):
+        raise ValueError("Invalid mask index")
+
 
 def convert_mask(mask: Union[np.ndarray, Image.Image]) -> np.ndarray:
     """Convert mask.
@@ -68,38 +81,50 @@ def convert_mask(mask: Union[np.ndarray, Image.Image]) -> np.ndarray:
 
 def create_mask_image(
         mask: Union[np.ndarray, Image.Image],
-        sam_masks: List[Dict[str, Any]],
+        sam_masks: Union[List[Dict[str, Any]], MaskSet],
         ignore_black_chk: bool = True,
+        label_map: Optional[np.ndarray] = None,
+        mask_index: Optional[MaskIndex] = None,
         ) -> np.ndarray:
     """Create mask image.
 
+    The mask image covers the segments under the mask, looked up in the label map,
+    or hit-tested with the index of the SAM masks if given.
+
     Args:
         mask (Union[np.ndarray, Image.Image]): mask
-        sam_masks (List[Dict[str, Any]]): SAM masks
+        sam_masks (Union[List[Dict[str, Any]], MaskSet]): SAM masks
         ignore_black_chk (bool): ignore black check
+        label_map (Optional[np.ndarray]): label map of the SAM masks from create_label_map.
+            Defaults to None (the label map of the MaskSet, or created from sam_masks).
+        mask_index (Optional[MaskIndex]): index of the SAM masks, a MaskSet. Defaults to None.
 
     Returns:
         np.ndarray: mask image
     """
-    check_inputs_create_mask_image(mask, sam_masks, ignore_black_chk)
+    check_inputs_create_mask_image(mask, sam_masks, ignore_black_chk, label_map, mask_index)
     mask = convert_mask(mask)
 
-    canvas_image = np.zeros(mask.shape, dtype=np.uint8)
-    mask_region = np.zeros(mask.shape, dtype=np.uint8)
-    for idx, seg_dict in enumerate(sam_masks):
-        seg_mask = np.expand_dims(seg_dict["segmentation"].astype(np.uint8), axis=-1)
-        canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
-        if (seg_mask * canvas_mask * mask).astype(bool).any():
-            mask_region = mask_region + (seg_mask * canvas_mask)
-        seg_color = seg_mask * canvas_mask
-        canvas_image = canvas_image + seg_color
-
-    if not ignore_black_chk:
-        canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
-        if (canvas_mask * mask).astype(bool).any():
-            mask_region = mask_region + (canvas_mask)
-
-    mask_region = np.tile(mask_region * 255, (1, 1, 3))
+    if label_map is None:
+        label_map = sam_masks.label_map if isinstance(sam_masks, MaskSet) else create_label_map(sam_masks, mask.shape[:2])
+
+    if mask_index is not None:
+        # The topmost masks under the mask pixels, filled within their bounding boxes
+        ys, xs = np.nonzero(mask[:, :, 0] > 0)
+        mask_region = np.zeros(label_map.shape, dtype=bool)
+        if not ignore_black_chk and np.any(label_map[ys, xs] == 0):
+            mask_region[label_map == 0] = True
+        for idx in mask_index.masks_at_pixels(xs, ys):
+            slices = get_bbox_slices(sam_masks.bboxes[idx].tolist(), sam_masks.areas[idx])
+            mask_region[slices] |= label_map[slices] == idx + 1
+    else:
+        # Label 0 is the black area not covered by any segment
+        label_counts = np.bincount(label_map[mask[:, :, 0] > 0], minlength=1)
+        if ignore_black_chk:
+            label_counts[0] = 0
+        mask_region = np.isin(label_map, np.flatnonzero(label_counts))
+
+    mask_region = np.tile(mask_region[:, :, np.newaxis].astype(np.uint8) * 255, (1, 1, 3))
 
     seg_image = mask_region.astype(np.uint8)
 
@@ -0,0 +1,314 @@
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def create_label_map(
+        sam_masks: List[Dict[str, Any]],
+        shape: Tuple[int, int],
+        ) -> np.ndarray:
+    """Create a label map of SAM masks.
+
+    Each pixel is labeled idx + 1 by the first mask in sam_masks covering it, 0 if none.
+    With sam_masks sorted by area, smaller masks are on top of larger ones.
+
+    Args:
+        sam_masks (List[Dict[str, Any]]): SAM masks
+        shape (Tuple[int, int]): height and width of the label map
+
+    Returns:
+        np.ndarray: label map in int32
+    """
+    label_map = np.zeros(shape, dtype=np.int32)
+    # Paint in reverse order, so that the first mask covering a pixel is painted last
+    for idx in range(len(sam_masks) - 1, -1, -1):
+        label_map[sam_masks[idx]["segmentation"].astype(bool, copy=False)] = idx + 1
+
+    return label_map
+
+
+def get_mask_bbox(segmentation: np.ndarray) -> Tuple[int, int, int, int]:
+    """Get the bounding box of a mask.
+
+    As in SamAutomaticMaskGenerator, the width and height are the differences
+    of the inclusive max and min coordinates, one pixel less than the extent.
+
+    Args:
+        segmentation (np.ndarray): mask
+
+    Returns:
+        Tuple[int, int, int, int]: bounding box in XYWH format, (0, 0, 0, 0) if the mask is empty
+    """
+    rows = np.flatnonzero(np.any(segmentation, axis=1))
+    if len(rows) == 0:
+        return 0, 0, 0, 0
+    cols = np.flatnonzero(np.any(segmentation[rows[0]:rows[-1] + 1], axis=0))
+
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0]), int(rows[-1] - rows[0])
+
+
+def get_bbox_slices(bbox: Tuple[int, int, int, int], area: int) -> Tuple[slice, slice]:
+    """Get the slices of the pixels within the bounding box of a mask.
+
+    Args:
+        bbox (Tuple[int, int, int, int]): bounding box in XYWH format, as returned by get_mask_bbox
+        area (int): area of the mask
+
+    Returns:
+        Tuple[slice, slice]: row and column slices, empty if the mask is empty
+    """
+    if area == 0:
+        return slice(0, 0), slice(0, 0)
+    x, y, w, h = bbox
+
+    return slice(y, y + h + 1), slice(x, x + w + 1)
+
+
+class MaskSet(Sequence):
+    """Compact set of SAM masks.
+
+    The masks are stored in an area-ordered label map, in which each pixel holds the
+    label (idx + 1) of the first mask covering it. A mask partly hidden by masks before
+    it is also stored bit-packed within its bounding box. Bounding boxes, areas and
+    predicted IoU scores are kept in per-mask columns. The bounding boxes follow the
+    convention of SamAutomaticMaskGenerator, see get_mask_bbox.
+
+    As a sequence, a MaskSet yields SAM mask dicts with a full-size "segmentation",
+    so that it can be used in place of a list of SAM masks.
+    """
+
+    def __init__(
+            self,
+            label_map: np.ndarray,
+            bboxes: np.ndarray,
+            areas: np.ndarray,
+            scores: np.ndarray,
+            overlaps: List[Optional[np.ndarray]],
+            metadata: List[Dict[str, Any]],
+            ) -> None:
+        """Initialize a mask set, use MaskSet.from_masks to create one from SAM masks.
+
+        Args:
+            label_map (np.ndarray): label map in int32
+            bboxes (np.ndarray): bounding boxes in XYWH format, in int32 of shape (N, 4)
+            areas (np.ndarray): areas in int64 of shape (N,)
+            scores (np.ndarray): predicted IoU scores in float32 of shape (N,), NaN if unknown
+            overlaps (List[Optional[np.ndarray]]): bit-packed masks within their bounding boxes,
+                None for masks fully visible in the label map
+            metadata (List[Dict[str, Any]]): other items of the SAM mask dicts
+        """
+        self.label_map = label_map
+        self.bboxes = bboxes
+        self.areas = areas
+        self.scores = scores
+        self.overlaps = overlaps
+        self.metadata = metadata
+
+    @classmethod
+    def from_masks(
+            cls,
+            sam_masks: List[Dict[str, Any]],
+            shape: Optional[Tuple[int, int]] = None,
+            ) -> "MaskSet":
+        """Create a mask set from SAM masks, keeping their order.
+
+        The "area" and "bbox" of the masks are used when both are given, so they must
+        match the segmentation. Otherwise they are computed from the segmentation.
+
+        Args:
+            sam_masks (List[Dict[str, Any]]): SAM masks, sorted by area
+            shape (Optional[Tuple[int, int]]): height and width of the masks. Defaults to None (from the first mask).
+
+        Returns:
+            MaskSet: mask set
+        """
+        if shape is None:
+            if len(sam_masks) == 0:
+                raise ValueError("Shape is required for an empty mask set")
+            shape = sam_masks[0]["segmentation"].shape[:2]
+
+        label_map = create_label_map(sam_masks, shape)
+        visible_areas = np.bincount(label_map.ravel(), minlength=len(sam_masks) + 1)
+
+        bboxes = np.zeros((len(sam_masks), 4), dtype=np.int32)
+        areas = np.zeros(len(sam_masks), dtype=np.int64)
+        scores = np.full(len(sam_masks), np.nan, dtype=np.float32)
+        overlaps = []
+        metadata = []
+        for idx, sam_mask in enumerate(sam_masks):
+            segmentation = sam_mask["segmentation"].astype(bool, copy=False)
+            if "area" in sam_mask and "bbox" in sam_mask:
+                bboxes[idx] = [int(v) for v in sam_mask["bbox"]]
+                areas[idx] = int(sam_mask["area"])
+            else:
+                bboxes[idx] = get_mask_bbox(segmentation)
+                # The bounding box of an empty mask holds no pixel either
+                areas[idx] = np.count_nonzero(segmentation[get_bbox_slices(bboxes[idx], 1)])
+            crop = segmentation[get_bbox_slices(bboxes[idx], areas[idx])]
+            if "predicted_iou" in sam_mask:
+                scores[idx] = sam_mask["predicted_iou"]
+            overlaps.append(np.packbits(crop) if visible_areas[idx + 1] < areas[idx] else None)
+            metadata.append({k: v for k, v in sam_mask.items()
+                             if k not in ["segmentation", "area", "bbox", "predicted_iou"]})
+
+        return cls(label_map, bboxes, areas, scores, overlaps, metadata)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """Height and width of the masks."""
+        return self.label_map.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the mask set in bytes."""
+        overlaps_nbytes = sum(overlap.nbytes for overlap in self.overlaps if overlap is not None)
+
+        return self.label_map.nbytes + self.bboxes.nbytes + self.areas.nbytes + self.scores.nbytes + overlaps_nbytes
+
+    def __len__(self) -> int:
+        return len(self.areas)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("MaskSet index out of range")
+
+        sam_mask = dict(segmentation=self.get_mask(idx), area=int(self.areas[idx]), bbox=self.bboxes[idx].tolist())
+        if not np.isnan(self.scores[idx]):
+            sam_mask["predicted_iou"] = float(self.scores[idx])
+        sam_mask.update(self.metadata[idx])
+
+        return sam_mask
+
+    def get_mask_crop(self, idx: int) -> Tuple[np.ndarray, Tuple[slice, slice]]:
+        """Get a mask within its bounding box.
+
+        Args:
+            idx (int): mask index
+
+        Returns:
+            Tuple[np.ndarray, Tuple[slice, slice]]: mask within the bounding box, and the row and column slices of the bounding box
+        """
+        slices = get_bbox_slices(self.bboxes[idx].tolist(), self.areas[idx])
+        if self.overlaps[idx] is not None:
+            h, w = slices[0].stop - slices[0].start, slices[1].stop - slices[1].start
+            crop = np.unpackbits(self.overlaps[idx], count=w * h).reshape(h, w).astype(bool)
+        else:
+            crop = self.label_map[slices] == idx + 1
+
+        return crop, slices
+
+    def get_mask_region(self, idx: int, slices: Tuple[slice, slice]) -> np.ndarray:
+        """Get a mask within a region, unpacking only the rows of the region.
+
+        Args:
+            idx (int): mask index
+            slices (Tuple[slice, slice]): row and column slices of the region, within the masks
+
+        Returns:
+            np.ndarray: mask within the region in bool
+        """
+        region = np.zeros((slices[0].stop - slices[0].start, slices[1].stop - slices[1].start), dtype=bool)
+        bbox_slices = get_bbox_slices(self.bboxes[idx].tolist(), self.areas[idx])
+        y0, y1 = max(slices[0].start, bbox_slices[0].start), min(slices[0].stop, bbox_slices[0].stop)
+        x0, x1 = max(slices[1].start, bbox_slices[1].start), min(slices[1].stop, bbox_slices[1].stop)
+        if y0 >= y1 or x0 >= x1:
+            return region
+
+        if self.overlaps[idx] is not None:
+            w = bbox_slices[1].stop - bbox_slices[1].start
+            start, stop = (y0 - bbox_slices[0].start) * w, (y1 - bbox_slices[0].start) * w
+            bits = np.unpackbits(self.overlaps[idx][start // 8:(stop + 7) // 8])[start % 8:start % 8 + stop - start]
+            crop = bits.reshape(y1 - y0, w)[:, x0 - bbox_slices[1].start:x1 - bbox_slices[1].start].astype(bool)
+        else:
+            crop = self.label_map[y0:y1, x0:x1] == idx + 1
+        region[y0 - slices[0].start:y1 - slices[0].start, x0 - slices[1].start:x1 - slices[1].start] = crop
+
+        return region
+
+    def get_mask(self, idx: int) -> np.ndarray:
+        """Get a full-size mask.
+
+        Args:
+            idx (int): mask index
+
+        Returns:
+            np.ndarray: mask in bool
+        """
+        crop, slices = self.get_mask_crop(idx)
+        segmentation = np.zeros(self.shape, dtype=bool)
+        segmentation[slices] = crop
+
+        return segmentation
+
+    def to_masks(self) -> List[Dict[str, Any]]:
+        """Get the SAM masks as a list of dicts.
+
+        Returns:
+            List[Dict[str, Any]]: SAM masks
+        """
+        return [self[idx] for idx in range(len(self))]
+
+    def pad(self, pad_width: Tuple[Tuple[int, int], Tuple[int, int]]) -> "MaskSet":
+        """Pad the masks, as the image they were generated from is padded.
+
+        The bounding boxes, and the point coordinates and crop boxes of the SAM mask dicts,
+        are shifted by the top and left padding. The bit-packed masks are kept as they are.
+
+        Args:
+            pad_width (Tuple[Tuple[int, int], Tuple[int, int]]): top and bottom, and left and right padding
+
+        Returns:
+            MaskSet: new mask set
+        """
+        (top, _), (left, _) = pad_width
+        bboxes = self.bboxes.copy()
+        bboxes[:, 0] += left
+        bboxes[:, 1] += top
+
+        metadata = []
+        for item in self.metadata:
+            item = dict(item)
+            if "point_coords" in item:
+                item["point_coords"] = [[x + left, y + top] for x, y in item["point_coords"]]
+            if "crop_box" in item:
+                item["crop_box"] = [item["crop_box"][0] + left, item["crop_box"][1] + top] + list(item["crop_box"][2:])
+            metadata.append(item)
+
+        label_map = np.pad(self.label_map, pad_width, mode="constant", constant_values=0)
+
+        return MaskSet(label_map, bboxes, self.areas, self.scores, list(self.overlaps), metadata)
+
+    def insert_first(self, sam_mask: Dict[str, Any]) -> "MaskSet":
+        """Insert a mask before all the masks of the mask set, on top of them in the label map.
+
+        Args:
+            sam_mask (Dict[str, Any]): SAM mask with a segmentation of the same shape
+
+        Returns:
+            MaskSet: new mask set
+        """
+        first = MaskSet.from_masks([sam_mask], self.shape)
+        segmentation = first.label_map > 0
+
+        # Masks visible under the inserted mask become partly hidden, store them in full
+        overlaps = list(self.overlaps)
+        for label in np.unique(self.label_map[segmentation]):
+            if label > 0 and overlaps[label - 1] is None:
+                crop, _ = self.get_mask_crop(label - 1)
+                overlaps[label - 1] = np.packbits(crop)
+
+        label_map = np.where(segmentation, 1, self.label_map + (self.label_map > 0)).astype(np.int32)
+
+        return MaskSet(
+            label_map,
+            np.concatenate([first.bboxes, self.bboxes]),
+            np.concatenate([first.areas, self.areas]),
+            np.concatenate([first.scores, self.scores]),
+            first.overlaps + overlaps,
+            first.metadata + self.metadata,
+        )
@@ -1,12 +1,9 @@
-import copy
 import os
 import sys
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
-import cv2
 import numpy as np
 from PIL import Image
-from tqdm import tqdm
 
 inpa_basedir = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
 if inpa_basedir not in sys.path:
@@ -15,9 +12,16 @@ if inpa_basedir not in sys.path:
 from ia_file_manager import ia_file_manager  # noqa: E402
 from ia_get_dataset_colormap import create_pascal_label_colormap  # noqa: E402
 from ia_logging import ia_logging  # noqa: E402
-from ia_sam_manager import get_sam_mask_generator  # noqa: E402
+from ia_mask_morphology import close_open_masks  # noqa: E402
+from ia_sam_candidates import SamMaskCandidates, generate_sam_mask_candidates as generate_mask_candidates  # noqa: E402
+from ia_sam_manager import (get_sam_mask_generator, get_sam_mask_generator_settings,  # noqa: E402
+                            get_sam_mask_generator_thresholds)
+from ia_sam_roi import generate_roi_masks, generate_update_masks  # noqa: E402
 from ia_ui_items import get_sam_model_ids  # noqa: E402
 
+from .maskfile import get_image_hash, get_metadata_hash, load_mask_set, save_mask_set  # noqa: E402
+from .maskset import MaskSet, create_label_map  # noqa: E402
+
 
 def get_all_sam_ids() -> List[str]:
     """Get all SAM IDs.
@@ -72,6 +76,8 @@ def check_inputs_generate_sam_masks(
         input_image: Union[np.ndarray, Image.Image],
         sam_id: str,
         anime_style_chk: bool = False,
+        img_size: Optional[int] = None,
+        roi: Optional[Union[Sequence[int], np.ndarray]] = None,
         ) -> None:
     """Check generate SAM masks inputs.
 
@@ -79,6 +85,8 @@ def check_inputs_generate_sam_masks(
         input_image (Union[np.ndarray, Image.Image]): input image
         sam_id (str): SAM ID
         anime_style_chk (bool): anime style check
+        img_size (Optional[int]): input image size of the SAM image encoder
+        roi (Optional[Union[Sequence[int], np.ndarray]]): region of interest
 
     Returns:
         None
@@ -92,6 +100,13 @@ def check_inputs_generate_sam_masks(
     if anime_style_chk is None or not isinstance(anime_style_chk, bool):
         raise ValueError("Invalid anime style check")
 
+    if img_size is not None and (not isinstance(img_size, int) or img_size <= 0):
+        raise ValueError("Invalid image size")
+
+    if roi is not None and not (isinstance(roi, np.ndarray) and roi.ndim >= 2 or
+                                isinstance(roi, (list, tuple, np.ndarray)) and len(roi) == 4):
+        raise ValueError("Invalid ROI")
+
 
 def convert_input_image(input_image: Union[np.ndarray, Image.Image]) -> np.ndarray:
     """Convert input image.
@@ -118,6 +133,9 @@ def generate_sam_masks(
         input_image: Union[np.ndarray, Image.Image],
         sam_id: str,
         anime_style_chk: bool = False,
+        img_size: Optional[int] = None,
+        roi: Optional[Union[Sequence[int], np.ndarray]] = None,
+        roi_crop: bool = False,
         ) -> List[Dict[str, Any]]:
     """Generate SAM masks.
 
@@ -125,44 +143,308 @@ def generate_sam_masks(
         input_image (Union[np.ndarray, Image.Image]): input image
         sam_id (str): SAM ID
         anime_style_chk (bool): anime style check
+        img_size (Optional[int]): input image size of the SAM image encoder.
+            A smaller size such as 512 or 768 gives a faster, coarser preview. Defaults to None (1024).
+        roi (Optional[Union[Sequence[int], np.ndarray]]): region of interest, a box in XYXY format or
+            a mask of the image size such as a sketch. The point grid is placed over the ROI only.
+            Defaults to None (the whole image).
+        roi_crop (bool): True to encode the crop of the ROI at the full input size of the image encoder,
+            for finer masks of small objects
 
     Returns:
         List[Dict[str, Any]]: SAM masks
     """
-    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk)
+    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk, img_size, roi)
     input_image = convert_input_image(input_image)
 
     sam_checkpoint = sam_file_path(sam_id)
-    sam_mask_generator = get_sam_mask_generator(sam_checkpoint, anime_style_chk)
+    sam_mask_generator = get_sam_mask_generator(sam_checkpoint, anime_style_chk, img_size)
     ia_logging.info(f"{sam_mask_generator.__class__.__name__} {sam_id}")
 
-    sam_masks = sam_mask_generator.generate(input_image)
+    if roi is not None:
+        sam_masks = generate_roi_masks(sam_mask_generator, input_image, roi, roi_crop)
+    else:
+        sam_masks = sam_mask_generator.generate(input_image)
 
     if anime_style_chk:
-        for sam_mask in sam_masks:
-            sam_mask_seg = sam_mask["segmentation"]
-            sam_mask_seg = cv2.morphologyEx(sam_mask_seg.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
-            sam_mask_seg = cv2.morphologyEx(sam_mask_seg.astype(np.uint8), cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
-            sam_mask["segmentation"] = sam_mask_seg.astype(bool)
+        close_open_masks(sam_masks, 5, 5)
 
     ia_logging.info("sam_masks: {}".format(len(sam_masks)))
 
-    sam_masks = copy.deepcopy(sam_masks)
     return sam_masks
 
 
-def sort_masks_by_area(
-        sam_masks: List[Dict[str, Any]],
+def generate_sam_mask_candidates(
+        input_image: Union[np.ndarray, Image.Image],
+        sam_id: str,
+        img_size: Optional[int] = None,
+        ) -> SamMaskCandidates:
+    """Generate SAM candidate masks, to be filtered for either style without running SAM again.
+
+    Args:
+        input_image (Union[np.ndarray, Image.Image]): input image
+        sam_id (str): SAM ID, other than FastSAM
+        img_size (Optional[int]): input image size of the SAM image encoder. Defaults to None (1024).
+
+    Returns:
+        SamMaskCandidates: candidate masks
+
+    Raises:
+        ValueError: if the SAM model does not support candidate masks
+    """
+    check_inputs_generate_sam_masks(input_image, sam_id, False, img_size)
+    if "FastSAM" in sam_id:
+        raise ValueError("FastSAM does not support candidate masks")
+    input_image = convert_input_image(input_image)
+
+    # The thresholds of the anime style are the lower ones, so the candidates hold the masks of both styles
+    sam_checkpoint = sam_file_path(sam_id)
+    sam_mask_generator = get_sam_mask_generator(sam_checkpoint, True, img_size)
+    ia_logging.info(f"{sam_mask_generator.__class__.__name__} {sam_id} (candidates)")
+
+    candidates = generate_mask_candidates(sam_mask_generator, input_image)
+
+    ia_logging.info("sam_mask_candidates: {}".format(len(candidates)))
+
+    return candidates
+
+
+def filter_sam_mask_candidates(
+        candidates: SamMaskCandidates,
+        anime_style_chk: bool = False,
         ) -> List[Dict[str, Any]]:
-    """Sort mask by area.
+    """Filter SAM candidate masks into the masks generate_sam_masks returns.
+
+    Args:
+        candidates (SamMaskCandidates): candidate masks from generate_sam_mask_candidates
+        anime_style_chk (bool): anime style check
+
+    Returns:
+        List[Dict[str, Any]]: SAM masks
+    """
+    sam_masks = candidates.filter(**get_sam_mask_generator_thresholds(anime_style_chk))
+
+    if anime_style_chk:
+        close_open_masks(sam_masks, 5, 5)
+
+    ia_logging.info("sam_masks: {}".format(len(sam_masks)))
+
+    return sam_masks
+
+
+def sort_masks_by_area(
+        sam_masks: Union[List[Dict[str, Any]], MaskSet],
+        shape: Optional[Tuple[int, int]] = None,
+        ) -> Union[List[Dict[str, Any]], MaskSet]:
+    """Sort mask by area and store them in a mask set.
+
+    Args:
+        sam_masks (Union[List[Dict[str, Any]], MaskSet]): SAM masks
+        shape (Optional[Tuple[int, int]]): height and width of the masks. Defaults to None (from the first mask).
+
+    Returns:
+        Union[List[Dict[str, Any]], MaskSet]: sorted SAM masks, an empty list if there are no masks and no shape
+    """
+    if isinstance(sam_masks, MaskSet):
+        return sam_masks
+    if len(sam_masks) == 0 and shape is None:
+        return sam_masks
+
+    # The generators return the areas with the masks, count the pixels only for masks without one
+    areas = [x["area"] if "area" in x else np.count_nonzero(x["segmentation"]) for x in sam_masks]
+    order = np.argsort(np.array(areas, dtype=np.int64), kind="stable")
+
+    return MaskSet.from_masks([sam_masks[idx] for idx in order], shape)
+
+
+def get_changed_mask(
+        prev_image: Union[np.ndarray, Image.Image],
+        input_image: Union[np.ndarray, Image.Image],
+        ) -> Optional[np.ndarray]:
+    """Get the mask of the pixels changed between two images, such as by inpainting or cleaning.
+
+    Args:
+        prev_image (Union[np.ndarray, Image.Image]): previous image
+        input_image (Union[np.ndarray, Image.Image]): input image
+
+    Returns:
+        Optional[np.ndarray]: mask in bool, None if the sizes of the images differ
+    """
+    prev_image = convert_input_image(prev_image)
+    input_image = convert_input_image(input_image)
+    if prev_image.shape != input_image.shape:
+        return None
+
+    return np.any(prev_image != input_image, axis=2)
+
+
+def merge_sam_masks(
+        sam_masks: MaskSet,
+        new_masks: List[Dict[str, Any]],
+        changed_mask: np.ndarray,
+        crop_box: Sequence[int],
+        ) -> MaskSet:
+    """Replace the SAM masks within a crop overlapping a changed region by new masks of the crop.
+
+    The masks cut by the crop are kept, without the changed pixels, which the new masks cover.
+
+    Args:
+        sam_masks (MaskSet): SAM masks of the image before the change, sorted by area
+        new_masks (List[Dict[str, Any]]): SAM masks generated on the crop, in image coordinates
+        changed_mask (np.ndarray): mask of the changed pixels
+        crop_box (Sequence[int]): box of the crop in XYXY format
+
+    Returns:
+        MaskSet: SAM masks sorted by area
+    """
+    x0, y0, x1, y1 = crop_box
+    crop_slices = (slice(y0, y1), slice(x0, x1))
+    changed_crop = changed_mask[crop_slices]
+
+    kept_masks, num_cleared = [], 0
+    for idx, (bx, by, bw, bh) in enumerate(sam_masks.bboxes.tolist()):
+        within_crop = bx >= x0 and by >= y0 and bx + bw < x1 and by + bh < y1
+        if not np.any(sam_masks.get_mask_region(idx, crop_slices) & changed_crop):
+            kept_masks.append(sam_masks[idx])
+        elif not within_crop:
+            # The changed pixels of the old mask are stale, its area and bbox are computed again
+            sam_mask = sam_masks[idx]
+            sam_mask["segmentation"] = sam_mask["segmentation"] & ~changed_mask
+            del sam_mask["area"], sam_mask["bbox"]
+            num_cleared += 1
+            if np.any(sam_mask["segmentation"]):
+                kept_masks.append(sam_mask)
+
+    ia_logging.info(f"sam_masks: {len(sam_masks)} -> {len(kept_masks) + len(new_masks)} "
+                    f"({len(sam_masks) - len(kept_masks)} replaced, {num_cleared} cleared, {len(new_masks)} new)")
+
+    return sort_masks_by_area(kept_masks + new_masks, sam_masks.shape)
+
+
+def update_sam_masks(
+        input_image: Union[np.ndarray, Image.Image],
+        sam_masks: MaskSet,
+        changed_mask: np.ndarray,
+        sam_id: str,
+        anime_style_chk: bool = False,
+        img_size: Optional[int] = None,
+        crop_padding: float = 0.25,
+        ) -> MaskSet:
+    """Update SAM masks after a region of the image changed, segmenting the padded crop of the region only.
+
+    The masks within the crop overlapping the changed region are replaced by the masks generated
+    on the crop. The masks cut by the crop are kept without the changed pixels.
+
+    Args:
+        input_image (Union[np.ndarray, Image.Image]): input image, with the changed region
+        sam_masks (MaskSet): SAM masks of the image before the change, sorted by area
+        changed_mask (np.ndarray): mask of the changed pixels, from get_changed_mask
+        sam_id (str): SAM ID
+        anime_style_chk (bool): anime style check
+        img_size (Optional[int]): input image size of the SAM image encoder. Defaults to None (1024).
+        crop_padding (float): padding of the crop, as a fraction of the longer side of the changed region
+
+    Returns:
+        MaskSet: SAM masks sorted by area
+    """
+    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk, img_size)
+    input_image = convert_input_image(input_image)
+    if changed_mask.shape[:2] != sam_masks.shape or input_image.shape[:2] != sam_masks.shape:
+        raise ValueError("The sizes of the image, the changed mask and the SAM masks do not match")
+    changed_mask = changed_mask.astype(bool, copy=False)
+    if not np.any(changed_mask):
+        return sam_masks
+
+    sam_checkpoint = sam_file_path(sam_id)
+    sam_mask_generator = get_sam_mask_generator(sam_checkpoint, anime_style_chk, img_size)
+    ia_logging.info(f"{sam_mask_generator.__class__.__name__} {sam_id} (update)")
+
+    new_masks, crop_box = generate_update_masks(sam_mask_generator, input_image, changed_mask, crop_padding)
+
+    if anime_style_chk:
+        close_open_masks(new_masks, 5, 5)
+
+    return merge_sam_masks(sam_masks, new_masks, changed_mask, crop_box)
+
+
+def get_sam_masks_metadata(
+        input_image: Union[np.ndarray, Image.Image],
+        sam_id: str,
+        anime_style_chk: bool = False,
+        img_size: Optional[int] = None,
+        ) -> Dict[str, Any]:
+    """Get the metadata identifying the SAM masks of an image, to save and load them.
+
+    Args:
+        input_image (Union[np.ndarray, Image.Image]): input image
+        sam_id (str): SAM ID
+        anime_style_chk (bool): anime style check
+        img_size (Optional[int]): input image size of the SAM image encoder. Defaults to None (1024).
+
+    Returns:
+        Dict[str, Any]: metadata with the SAM ID, the image hash and the mask generator settings
+    """
+    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk, img_size)
+    input_image = convert_input_image(input_image)
+
+    return dict(sam_id=sam_id, image_hash=get_image_hash(input_image), image_shape=list(input_image.shape),
+                **get_sam_mask_generator_settings(sam_file_path(sam_id), anime_style_chk, img_size))
+
+
+def sam_masks_file_path(metadata: Dict[str, Any]) -> str:
+    """Get the path of the file of SAM masks with metadata.
+
+    Args:
+        metadata (Dict[str, Any]): metadata, as returned by get_sam_masks_metadata
+
+    Returns:
+        str: file path in the SAM masks cache directory
+    """
+    sam_name = os.path.splitext(metadata["sam_id"])[0]
+
+    return os.path.join(ia_file_manager.cache_dir, "sam_masks", f"{sam_name}_{get_metadata_hash(metadata)}.npz")
+
+
+def save_sam_masks(sam_masks: MaskSet, metadata: Dict[str, Any]) -> str:
+    """Save SAM masks with their metadata.
 
     Args:
-        sam_masks (List[Dict[str, Any]]): SAM masks
+        sam_masks (MaskSet): SAM masks sorted by area
+        metadata (Dict[str, Any]): metadata, as returned by get_sam_masks_metadata
 
     Returns:
-        List[Dict[str, Any]]: sorted SAM masks
+        str: file path
     """
-    return sorted(sam_masks, key=lambda x: np.sum(x.get("segmentation").astype(np.uint32)))
+    file_path = sam_masks_file_path(metadata)
+    save_mask_set(sam_masks, file_path, metadata)
+    ia_logging.info(f"Saved SAM masks: {file_path}")
+
+    return file_path
+
+
+def load_sam_masks(metadata: Dict[str, Any]) -> Optional[MaskSet]:
+    """Load the SAM masks saved with the same metadata.
+
+    Args:
+        metadata (Dict[str, Any]): metadata, as returned by get_sam_masks_metadata
+
+    Returns:
+        Optional[MaskSet]: SAM masks, None if no matching file is found
+    """
+    file_path = sam_masks_file_path(metadata)
+    if not os.path.isfile(file_path):
+        return None
+
+    try:
+        sam_masks, saved_metadata = load_mask_set(file_path)
+    except Exception as e:
+        ia_logging.warning(f"Failed to load SAM masks: {file_path}: {e}")
+        return None
+    if saved_metadata != metadata:
+        return None
+    ia_logging.info(f"Loaded SAM masks: {file_path}")
+
+    return sam_masks
 
 
 def get_seg_colormap() -> np.ndarray:
@@ -179,23 +461,26 @@ def get_seg_colormap() -> np.ndarray:
 
 
 def insert_mask_to_sam_masks(
-        sam_masks: List[Dict[str, Any]],
+        sam_masks: Union[List[Dict[str, Any]], MaskSet],
         insert_mask: Dict[str, Any],
-        ) -> List[Dict[str, Any]]:
+        ) -> Union[List[Dict[str, Any]], MaskSet]:
     """Insert mask to SAM masks.
 
     Args:
-        sam_masks (List[Dict[str, Any]]): SAM masks
+        sam_masks (Union[List[Dict[str, Any]], MaskSet]): SAM masks
         insert_mask (Dict[str, Any]): insert mask
 
     Returns:
-        List[Dict[str, Any]]: SAM masks
+        Union[List[Dict[str, Any]], MaskSet]: SAM masks, a new mask set if sam_masks is a MaskSet
     """
-    if insert_mask is not None and isinstance(insert_mask, dict) and "segmentation" in insert_mask:
-        if (len(sam_masks) > 0 and
-                sam_masks[0]["segmentation"].shape == insert_mask["segmentation"].shape and
+    if insert_mask is not None and isinstance(insert_mask, dict) and "segmentation" in insert_mask and len(sam_masks) > 0:
+        masks_shape = sam_masks.shape if isinstance(sam_masks, MaskSet) else sam_masks[0]["segmentation"].shape
+        if (masks_shape == insert_mask["segmentation"].shape and
                 np.any(insert_mask["segmentation"])):
-            sam_masks.insert(0, insert_mask)
+            if isinstance(sam_masks, MaskSet):
+                sam_masks = sam_masks.insert_first(insert_mask)
+            else:
+                sam_masks.insert(0, insert_mask)
             ia_logging.info("insert mask to sam_masks")
 
     return sam_masks
@@ -203,47 +488,35 @@ def insert_mask_to_sam_masks(
 
 def create_seg_color_image(
         input_image: Union[np.ndarray, Image.Image],
-        sam_masks: List[Dict[str, Any]],
+        sam_masks: Union[List[Dict[str, Any]], MaskSet],
+        label_map: Optional[np.ndarray] = None,
         ) -> np.ndarray:
     """Create segmentation color image.
 
+    Pixels are colored by the first mask in sam_masks covering them, black if none.
+    The colormap is repeated for masks beyond its length.
+
     Args:
         input_image (Union[np.ndarray, Image.Image]): input image
-        sam_masks (List[Dict[str, Any]]): SAM masks
+        sam_masks (Union[List[Dict[str, Any]], MaskSet]): SAM masks
+        label_map (Optional[np.ndarray]): label map of the SAM masks from create_label_map.
+            Defaults to None (the label map of the MaskSet, or created from sam_masks).
 
     Returns:
         np.ndarray: segmentation color image
     """
     input_image = convert_input_image(input_image)
 
-    seg_colormap = get_seg_colormap()
-    sam_masks = sam_masks[:len(seg_colormap)]
-
-    with tqdm(total=len(sam_masks), desc="Processing segments") as progress_bar:
-        canvas_image = np.zeros((*input_image.shape[:2], 1), dtype=np.uint8)
-        for idx, seg_dict in enumerate(sam_masks[0:min(255, len(sam_masks))]):
-            seg_mask = np.expand_dims(seg_dict["segmentation"].astype(np.uint8), axis=-1)
-            canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
-            seg_color = np.array([idx+1], dtype=np.uint8) * seg_mask * canvas_mask
-            canvas_image = canvas_image + seg_color
-            progress_bar.update(1)
-        seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
-        temp_canvas_image = np.apply_along_axis(lambda x: seg_colormap[x[0]], axis=-1, arr=canvas_image)
-        if len(sam_masks) > 255:
-            canvas_image = canvas_image.astype(bool).astype(np.uint8)
-            for idx, seg_dict in enumerate(sam_masks[255:min(509, len(sam_masks))]):
-                seg_mask = np.expand_dims(seg_dict["segmentation"].astype(np.uint8), axis=-1)
-                canvas_mask = np.logical_not(canvas_image.astype(bool)).astype(np.uint8)
-                seg_color = np.array([idx+2], dtype=np.uint8) * seg_mask * canvas_mask
-                canvas_image = canvas_image + seg_color
-                progress_bar.update(1)
-            seg_colormap = seg_colormap[256:]
-            seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
-            seg_colormap = np.insert(seg_colormap, 0, [0, 0, 0], axis=0)
-            canvas_image = np.apply_along_axis(lambda x: seg_colormap[x[0]], axis=-1, arr=canvas_image)
-            canvas_image = temp_canvas_image + canvas_image
+    if label_map is None:
+        if isinstance(sam_masks, MaskSet):
+            label_map = sam_masks.label_map
         else:
-            canvas_image = temp_canvas_image
-    ret_seg_image = canvas_image.astype(np.uint8)
+            label_map = create_label_map(sam_masks, input_image.shape[:2])
+
+    seg_colormap = get_seg_colormap()
+    color_lut = np.zeros((len(sam_masks) + 1, 3), dtype=np.uint8)
+    color_lut[1:] = seg_colormap[np.arange(len(sam_masks)) % len(seg_colormap)]
+
+    ret_seg_image = color_lut[label_map]
 
     return ret_seg_image
@@ -91,6 +91,8 @@ def build_sam_vit_t(checkpoint=None):
         with open(checkpoint, "rb") as f:
             state_dict = torch.load(f)
         mobile_sam.load_state_dict(state_dict)
+    if not mobile_sam.training:
+        mobile_sam.image_encoder.fuse_for_inference()
     return mobile_sam
 
 
@@ -6,6 +6,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from typing import Type
 
@@ -34,10 +35,31 @@ class LayerNorm2d(nn.Module):
         self.weight = nn.Parameter(torch.ones(num_channels))
         self.bias = nn.Parameter(torch.zeros(num_channels))
         self.eps = eps
+        self.channels_last = False
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            # Channels are the innermost dimension of a channels-last tensor,
+            # so the normalization runs as a single fused layer_norm without copies
+            x = F.layer_norm(x.permute(0, 2, 3, 1), (x.shape[1],), self.weight, self.bias, self.eps)
+            return x.permute(0, 3, 1, 2)
         u = x.mean(1, keepdim=True)
         s = (x - u).pow(2).mean(1, keepdim=True)
         x = (x - u) / torch.sqrt(s + self.eps)
         x = self.weight[:, None, None] * x + self.bias[:, None, None]
         return x
+
+
+def set_channels_last(module: nn.Module, enabled: bool) -> None:
+    """
+    Switch the conv layers of a module to the channels-last memory format and
+    its LayerNorm2d layers to the fused layer norm over channels-last inputs.
+
+    Arguments:
+      module (nn.Module): A stack of conv, transposed conv and LayerNorm2d layers.
+      enabled (bool): If True, use the channels-last memory format.
+    """
+    module.to(memory_format=torch.channels_last if enabled else torch.contiguous_format)
+    for layer in module.modules():
+        if isinstance(layer, LayerNorm2d):
+            layer.channels_last = enabled
@@ -122,10 +122,12 @@ class MaskDecoder(nn.Module):
         output_tokens = output_tokens.unsqueeze(0).expand(sparse_prompt_embeddings.size(0), -1, -1)
         tokens = torch.cat((output_tokens, sparse_prompt_embeddings), dim=1)
 
-        # Expand per-image data in batch direction to be per-mask
+        # Expand per-image data in batch direction to be per-mask,
+        # cropping the prompt embeddings to a non-square image embedding
+        h, w = image_embeddings.shape[-2:]
         src = torch.repeat_interleave(image_embeddings, tokens.shape[0], dim=0)
-        src = src + dense_prompt_embeddings
-        pos_src = torch.repeat_interleave(image_pe, tokens.shape[0], dim=0)
+        src = src + dense_prompt_embeddings[..., :h, :w]
+        pos_src = torch.repeat_interleave(image_pe[..., :h, :w], tokens.shape[0], dim=0)
         b, c, h, w = src.shape
 
         # Run the transformer
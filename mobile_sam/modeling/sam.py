@@ -8,9 +8,10 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from .tiny_vit_sam import TinyViT
+from .common import set_channels_last
 from .image_encoder import ImageEncoderViT
 from .mask_decoder import MaskDecoder
 from .prompt_encoder import PromptEncoder
@@ -46,6 +47,8 @@ class Sam(nn.Module):
         self.mask_decoder = mask_decoder
         self.register_buffer("pixel_mean", torch.Tensor(pixel_mean).view(-1, 1, 1), False)
         self.register_buffer("pixel_std", torch.Tensor(pixel_std).view(-1, 1, 1), False)
+        self.rectangular_input = False
+        self.channels_last = False
 
     @property
     def device(self) -> Any:
@@ -131,6 +134,84 @@ class Sam(nn.Module):
             )
         return outputs
 
+    def set_img_size(self, img_size: int) -> None:
+        """
+        Set the input image size of the model, e.g. a smaller size for
+        faster previews. Create a new SamPredictor afterwards, since its
+        transform depends on the input image size.
+
+        Arguments:
+          img_size (int): The longest side of the image input to the model.
+        """
+        if not isinstance(self.image_encoder, ImageEncoderViT):
+            raise NotImplementedError(
+                f"{type(self.image_encoder).__name__} does not support changing the input image size."
+            )
+        self.image_encoder.set_img_size(img_size)
+
+        prompt_encoder = self.prompt_encoder
+        downscale = prompt_encoder.input_image_size[0] // prompt_encoder.image_embedding_size[0]
+        prompt_encoder.input_image_size = (img_size, img_size)
+        prompt_encoder.image_embedding_size = (img_size // downscale, img_size // downscale)
+        prompt_encoder.mask_input_size = (
+            4 * prompt_encoder.image_embedding_size[0],
+            4 * prompt_encoder.image_embedding_size[1],
+        )
+
+    def set_rectangular_input(self, enabled: bool) -> None:
+        """
+        Enable or disable the non-square input mode. Images are padded to multiples
+        of the window size instead of a square, which skips the compute on padded
+        tokens for wide and tall images. The prompt embeddings are cropped to the
+        non-square image embedding by the mask decoder.
+
+        Arguments:
+          enabled (bool): If True, use non-square inputs.
+        """
+        if enabled and not isinstance(self.image_encoder, ImageEncoderViT):
+            raise NotImplementedError(
+                f"{type(self.image_encoder).__name__} does not support non-square inputs."
+            )
+        self.rectangular_input = enabled
+
+    def set_channels_last(self, enabled: bool) -> None:
+        """
+        Enable or disable the channels-last mode of the conv stacks: the image
+        encoder neck, the mask downscaling of the prompt encoder and the output
+        upscaling of the mask decoder. Their LayerNorm2d layers normalize the
+        channels-last activations with a fused layer norm.
+
+        Arguments:
+          enabled (bool): If True, run the conv stacks in channels-last.
+        """
+        conv_stacks = [
+            self.image_encoder.neck,
+            self.prompt_encoder.mask_downscaling,
+            self.mask_decoder.output_upscaling,
+        ]
+        for conv_stack in conv_stacks:
+            set_channels_last(conv_stack, enabled)
+        self.channels_last = enabled
+
+    def set_sdpa(self, enabled: bool, attn_indexes: Optional[Tuple[int, ...]] = None) -> None:
+        """
+        Enable or disable scaled_dot_product_attention in the image encoder blocks
+        and the mask decoder transformer. In the image encoder, the relative
+        positional embeddings are passed as an additive attention bias. The
+        outputs match the attention matrix path up to floating point error.
+
+        Arguments:
+          enabled (bool): If True, use scaled_dot_product_attention.
+          attn_indexes (list, optional): Indexes of the image encoder blocks using
+            scaled_dot_product_attention. Defaults to the global attention blocks.
+            TinyViT image encoders always use their own attention.
+        """
+        if enabled and attn_indexes is None:
+            attn_indexes = getattr(self.image_encoder, "global_attn_indexes", ())
+        if isinstance(self.image_encoder, ImageEncoderViT):
+            self.image_encoder.set_sdpa(attn_indexes if enabled else ())
+        self.mask_decoder.transformer.set_sdpa(enabled)
+
     def postprocess_masks(
         self,
         masks: torch.Tensor,
@@ -152,9 +233,11 @@ class Sam(nn.Module):
           (torch.Tensor): Batched masks in BxCxHxW format, where (H, W)
             is given by original_size.
         """
+        # Low resolution masks cover the padded input, which may be non-square
+        scale = self.image_encoder.img_size / self.prompt_encoder.mask_input_size[0]
         masks = F.interpolate(
             masks,
-            (self.image_encoder.img_size, self.image_encoder.img_size),
+            (int(masks.shape[-2] * scale), int(masks.shape[-1] * scale)),
             mode="bilinear",
             align_corners=False,
         )
@@ -163,13 +246,15 @@ class Sam(nn.Module):
         return masks
 
     def preprocess(self, x: torch.Tensor) -> torch.Tensor:
-        """Normalize pixel values and pad to a square input."""
+        """Normalize pixel values and pad to a square (or non-square) input."""
         # Normalize colors
         x = (x - self.pixel_mean) / self.pixel_std
 
         # Pad
         h, w = x.shape[-2:]
-        padh = self.image_encoder.img_size - h
-        padw = self.image_encoder.img_size - w
-        x = F.pad(x, (0, padw, 0, padh))
+        if self.rectangular_input:
+            input_h, input_w = self.image_encoder.get_input_size(h, w)
+        else:
+            input_h, input_w = self.image_encoder.img_size, self.image_encoder.img_size
+        x = F.pad(x, (0, input_w - w, 0, input_h - h))
         return x
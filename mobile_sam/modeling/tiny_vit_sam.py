@@ -17,6 +17,8 @@ from timm.models.layers import DropPath as TimmDropPath,\
 from timm.models.registry import register_model
 from typing import Tuple
 
+from .common import LayerNorm2d
+
 
 class Conv2d_BN(torch.nn.Sequential):
     def __init__(self, a, b, ks=1, stride=1, pad=0, dilation=1,
@@ -257,6 +259,12 @@ class Attention(torch.nn.Module):
                                  self.attention_biases[:, self.attention_bias_idxs],
                                  persistent=False)
 
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        # refresh the cached attention bias from the loaded biases
+        if not self.training:
+            self.train(False)
+
     def forward(self, x):  # x (B,N,C)
         B, N, _ = x.shape
 
@@ -447,21 +455,6 @@ class BasicLayer(nn.Module):
         return f"dim={self.dim}, input_resolution={self.input_resolution}, depth={self.depth}"
 
 
-class LayerNorm2d(nn.Module):
-    def __init__(self, num_channels: int, eps: float = 1e-6) -> None:
-        super().__init__()
-        self.weight = nn.Parameter(torch.ones(num_channels))
-        self.bias = nn.Parameter(torch.zeros(num_channels))
-        self.eps = eps
-
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        u = x.mean(1, keepdim=True)
-        s = (x - u).pow(2).mean(1, keepdim=True)
-        x = (x - u) / torch.sqrt(s + self.eps)
-        x = self.weight[:, None, None] * x + self.bias[:, None, None]
-        return x
-
-
 class TinyViT(nn.Module):
     def __init__(self, img_size=224, in_chans=3, num_classes=1000,
                  embed_dims=[96, 192, 384, 768], depths=[2, 2, 6, 2],
@@ -599,6 +592,19 @@ class TinyViT(nn.Module):
     def no_weight_decay_keywords(self):
         return {'attention_biases'}
 
+    @torch.no_grad()
+    def fuse_for_inference(self):
+        """
+        Prepares the model for inference. Folds every Conv2d_BN pair into a
+        single convolution, precomputes the attention bias of every Attention
+        layer and replaces DropPath and Dropout layers with nn.Identity. The
+        fused model can't be trained and its state dict keys differ from the
+        checkpoint, so load the weights before calling this.
+        """
+        assert not self.training, "fuse_for_inference requires a model in eval mode"
+        _fuse_modules(self)
+        return self
+
     def forward_features(self, x):
         # x: (N, C, H, W)
         x = self.patch_embed(x)
@@ -622,6 +628,19 @@ class TinyViT(nn.Module):
         return x
 
 
+def _fuse_modules(module):
+    for name, child in module.named_children():
+        if isinstance(child, Conv2d_BN):
+            weight = child.c.weight
+            setattr(module, name, child.fuse().to(device=weight.device, dtype=weight.dtype))
+        elif isinstance(child, (DropPath, nn.Dropout)):
+            setattr(module, name, nn.Identity())
+        else:
+            if isinstance(child, Attention):
+                child.train(False)
+            _fuse_modules(child)
+
+
 _checkpoint_url_format = \
     'https://github.com/wkcn/TinyViT-model-zoo/releases/download/checkpoints/{}.pth'
 _provided_checkpoints = {
@@ -8,7 +8,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from typing import Optional, Tuple, Type
+from typing import Callable, Dict, Optional, Tuple, Type, Union
 
 from .common import LayerNorm2d, MLPBlock
 
@@ -33,6 +33,7 @@ class ImageEncoderViT(nn.Module):
         rel_pos_zero_init: bool = True,
         window_size: int = 0,
         global_attn_indexes: Tuple[int, ...] = (),
+        sdpa_attn_indexes: Tuple[int, ...] = (),
     ) -> None:
         """
         Args:
@@ -51,9 +52,12 @@ class ImageEncoderViT(nn.Module):
             rel_pos_zero_init (bool): If True, zero initialize relative positional parameters.
             window_size (int): Window size for window attention blocks.
             global_attn_indexes (list): Indexes for blocks using global attention.
+            sdpa_attn_indexes (list): Indexes for blocks using scaled_dot_product_attention.
         """
         super().__init__()
         self.img_size = img_size
+        self.window_size = window_size
+        self.global_attn_indexes = tuple(global_attn_indexes)
 
         self.patch_embed = PatchEmbed(
             kernel_size=(patch_size, patch_size),
@@ -68,6 +72,9 @@ class ImageEncoderViT(nn.Module):
             self.pos_embed = nn.Parameter(
                 torch.zeros(1, img_size // patch_size, img_size // patch_size, embed_dim)
             )
+            # absolute positional embeddings resized for the last grid size
+            self.register_buffer("pos_embed_resized", None, persistent=False)
+            self.pos_embed_resized_key = None
 
         self.blocks = nn.ModuleList()
         for i in range(depth):
@@ -82,7 +89,10 @@ class ImageEncoderViT(nn.Module):
                 rel_pos_zero_init=rel_pos_zero_init,
                 window_size=window_size if i not in global_attn_indexes else 0,
                 input_size=(img_size // patch_size, img_size // patch_size),
+                use_sdpa=i in sdpa_attn_indexes,
             )
+            if i in global_attn_indexes:
+                block.attn.grid_size = (img_size // patch_size, img_size // patch_size)
             self.blocks.append(block)
 
         self.neck = nn.Sequential(
@@ -103,10 +113,96 @@ class ImageEncoderViT(nn.Module):
             LayerNorm2d(out_chans),
         )
 
+    def set_img_size(self, img_size: int) -> None:
+        """
+        Set the input image size. The absolute positional embeddings are interpolated
+        from the pretrain image size, and the relative ones by get_rel_pos.
+        Args:
+            img_size (int): Input image size, a multiple of the patch size.
+        """
+        patch_size = self.patch_embed.proj.stride[0]
+        assert img_size % patch_size == 0, f"Input image size must be a multiple of {patch_size}."
+        self.img_size = img_size
+        for i in self.global_attn_indexes:
+            self.blocks[i].attn.grid_size = (img_size // patch_size, img_size // patch_size)
+
+    def get_pos_embed(self, size: Tuple[int, int]) -> torch.Tensor:
+        """
+        Get the absolute positional embeddings resized to the patch grid size. The resized
+        embeddings are cached in a non-persistent buffer and rebuilt when the size, the
+        device, the dtype or the values of pos_embed change.
+        Args:
+            size (Tuple): patch grid size (h, w).
+
+        Returns:
+            pos_embed: positional embeddings with [1, h, w, C].
+        """
+        if self.pos_embed.shape[1] == size[0] and self.pos_embed.shape[2] == size[1]:
+            return self.pos_embed
+        if torch.is_grad_enabled() and self.pos_embed.requires_grad:
+            # Do not cache tensors that are part of the autograd graph.
+            return resize_pos_embed(self.pos_embed, size)
+
+        key = (
+            tuple(size),
+            self.pos_embed.device,
+            self.pos_embed.dtype,
+            self.pos_embed.data_ptr(),
+            self.pos_embed._version,
+        )
+        if self.pos_embed_resized is None or self.pos_embed_resized_key != key:
+            self.pos_embed_resized = resize_pos_embed(self.pos_embed.detach(), size)
+            self.pos_embed_resized_key = key
+
+        return self.pos_embed_resized
+
+    def set_sdpa(self, attn_indexes: Tuple[int, ...]) -> None:
+        """
+        Select the blocks using scaled_dot_product_attention, the other blocks
+        use the attention matrix as in the pretrained model.
+        Args:
+            attn_indexes (list): Indexes for blocks using scaled_dot_product_attention.
+        """
+        for i, blk in enumerate(self.blocks):
+            blk.attn.use_sdpa = i in attn_indexes
+
+    def get_input_size(self, h: int, w: int) -> Tuple[int, int]:
+        """
+        Get the padded size of a non-square input. The sides are rounded up to multiples
+        of the window size in pixels, so that windowed blocks need no extra padding, and
+        capped at the input image size.
+        Args:
+            h (int): height of the resized image.
+            w (int): width of the resized image.
+
+        Returns:
+            (int, int): padded input size (H, W).
+        """
+        multiple = self.patch_embed.proj.stride[0] * max(self.window_size, 1)
+
+        return tuple(min(-(-size // multiple) * multiple, self.img_size) for size in (h, w))
+
+    def set_token_merging(self, ratio: Union[float, Dict[int, float]]) -> None:
+        """
+        Set the token merging ratio of the global attention blocks. Similar tokens are
+        merged before the attention and the MLP of a block, and unmerged after them.
+        Args:
+            ratio (float or dict(int, float)): Fraction of the tokens to merge in [0, 1),
+                for all global attention blocks or per block index. 0 disables merging.
+        """
+        ratios = ratio if isinstance(ratio, dict) else {i: ratio for i in self.global_attn_indexes}
+        for i, r in ratios.items():
+            assert i in self.global_attn_indexes, f"Block {i} is not a global attention block."
+            assert 0.0 <= r < 1.0, "Token merging ratio must be in [0, 1)."
+            self.blocks[i].tome_ratio = r
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         x = self.patch_embed(x)
         if self.pos_embed is not None:
-            x = x + self.pos_embed
+            grid_size = self.img_size // self.patch_embed.proj.stride[0]
+            pos_embed = self.get_pos_embed((grid_size, grid_size))
+            # Non-square inputs are the top-left part of the square input
+            x = x + pos_embed[:, : x.shape[1], : x.shape[2]]
 
         interm_embeddings = []
         for blk in self.blocks:
@@ -134,6 +230,7 @@ class Block(nn.Module):
         rel_pos_zero_init: bool = True,
         window_size: int = 0,
         input_size: Optional[Tuple[int, int]] = None,
+        use_sdpa: bool = False,
     ) -> None:
         """
         Args:
@@ -149,6 +246,7 @@ class Block(nn.Module):
                 use global attention.
             input_size (tuple(int, int) or None): Input resolution for calculating the relative
                 positional parameter size.
+            use_sdpa (bool): If True, use scaled_dot_product_attention.
         """
         super().__init__()
         self.norm1 = norm_layer(dim)
@@ -159,14 +257,19 @@ class Block(nn.Module):
             use_rel_pos=use_rel_pos,
             rel_pos_zero_init=rel_pos_zero_init,
             input_size=input_size if window_size == 0 else (window_size, window_size),
+            use_sdpa=use_sdpa,
         )
 
         self.norm2 = norm_layer(dim)
         self.mlp = MLPBlock(embedding_dim=dim, mlp_dim=int(dim * mlp_ratio), act=act_layer)
 
         self.window_size = window_size
+        self.tome_ratio = 0.0
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.window_size == 0 and self.tome_ratio > 0:
+            return self.forward_merged(x)
+
         shortcut = x
         x = self.norm1(x)
         # Window partition
@@ -184,6 +287,16 @@ class Block(nn.Module):
 
         return x
 
+    def forward_merged(self, x: torch.Tensor) -> torch.Tensor:
+        B, H, W, C = x.shape
+        x = x.reshape(B, H * W, C)
+        merge, unmerge, coords, sizes = bipartite_soft_matching_2d(x, (H, W), int(H * W * self.tome_ratio))
+
+        x = x + unmerge(self.attn.forward_merged(merge(self.norm1(x)), (H, W), coords, sizes))
+        x = x + unmerge(self.mlp(merge(self.norm2(x))))
+
+        return x.reshape(B, H, W, C)
+
 
 class Attention(nn.Module):
     """Multi-head Attention block with relative position embeddings."""
@@ -196,6 +309,7 @@ class Attention(nn.Module):
         use_rel_pos: bool = False,
         rel_pos_zero_init: bool = True,
         input_size: Optional[Tuple[int, int]] = None,
+        use_sdpa: bool = False,
     ) -> None:
         """
         Args:
@@ -206,6 +320,8 @@ class Attention(nn.Module):
             rel_pos_zero_init (bool): If True, zero initialize relative positional parameters.
             input_size (tuple(int, int) or None): Input resolution for calculating the relative
                 positional parameter size.
+            use_sdpa (bool): If True, use scaled_dot_product_attention with the relative
+                positional embeddings as an additive attention bias.
         """
         super().__init__()
         self.num_heads = num_heads
@@ -215,6 +331,9 @@ class Attention(nn.Module):
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.proj = nn.Linear(dim, dim)
 
+        self.use_sdpa = use_sdpa
+        # Query tokens per scaled_dot_product_attention call with relative positional embeddings
+        self.sdpa_chunk_size = 1024
         self.use_rel_pos = use_rel_pos
         if self.use_rel_pos:
             assert (
@@ -223,6 +342,12 @@ class Attention(nn.Module):
             # initialize relative positional embeddings
             self.rel_pos_h = nn.Parameter(torch.zeros(2 * input_size[0] - 1, head_dim))
             self.rel_pos_w = nn.Parameter(torch.zeros(2 * input_size[1] - 1, head_dim))
+            # grid size of a square input, set for global attention blocks
+            self.grid_size: Optional[Tuple[int, int]] = None
+            # relative positional embeddings gathered for the last input size
+            self.register_buffer("rel_pos_h_table", None, persistent=False)
+            self.register_buffer("rel_pos_w_table", None, persistent=False)
+            self.rel_pos_table_key = None
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         B, H, W, _ = x.shape
@@ -231,17 +356,122 @@ class Attention(nn.Module):
         # q, k, v with shape (B * nHead, H * W, C)
         q, k, v = qkv.reshape(3, B * self.num_heads, H * W, -1).unbind(0)
 
-        attn = (q * self.scale) @ k.transpose(-2, -1)
+        if self.use_sdpa:
+            if self.use_rel_pos:
+                Rh, Rw = self.get_rel_pos_tables((H, W), (H, W))
+                x = scaled_dot_product_attention_rel_pos(q, k, v, Rh, Rw, (H, W), self.sdpa_chunk_size)
+            else:
+                x = F.scaled_dot_product_attention(q, k, v)
+        else:
+            attn = (q * self.scale) @ k.transpose(-2, -1)
+
+            if self.use_rel_pos:
+                Rh, Rw = self.get_rel_pos_tables((H, W), (H, W))
+                attn = add_decomposed_rel_pos(attn, q, Rh, Rw, (H, W), (H, W))
+
+            attn = attn.softmax(dim=-1)
+            x = attn @ v
+
+        x = x.reshape(B, self.num_heads, H, W, -1).permute(0, 2, 3, 1, 4).reshape(B, H, W, -1)
+        x = self.proj(x)
+
+        return x
+
+    def forward_merged(
+        self, x: torch.Tensor, hw: Tuple[int, int], coords: torch.Tensor, sizes: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Attention over merged tokens, with the key sizes added as log weights.
+        Args:
+            x (Tensor): merged tokens with shape (B, N, C).
+            hw (Tuple): patch grid size (H, W) before merging.
+            coords (Tensor): grid coordinates (h, w) of the merged tokens with shape (B, N, 2).
+            sizes (Tensor): number of tokens merged into each token with shape (B, N).
+
+        Returns:
+            x (Tensor): output with shape (B, N, C).
+        """
+        B, N, _ = x.shape
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, -1).permute(2, 0, 3, 1, 4)
+        q, k, v = qkv.reshape(3, B * self.num_heads, N, -1).unbind(0)
 
+        attn_bias = sizes.log()[:, None, None, :].expand(B, self.num_heads, N, N)
         if self.use_rel_pos:
-            attn = add_decomposed_rel_pos(attn, q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W))
+            Rh, Rw = self.get_rel_pos_tables(hw, hw)
+            attn_bias = attn_bias + get_merged_rel_pos_bias(q, Rh, Rw, coords)
+        attn_bias = attn_bias.reshape(B * self.num_heads, N, N).to(q.dtype)
 
-        attn = attn.softmax(dim=-1)
-        x = (attn @ v).view(B, self.num_heads, H, W, -1).permute(0, 2, 3, 1, 4).reshape(B, H, W, -1)
+        if self.use_sdpa:
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_bias)
+        else:
+            attn = (q * self.scale) @ k.transpose(-2, -1) + attn_bias
+            x = attn.softmax(dim=-1) @ v
+
+        x = x.reshape(B, self.num_heads, N, -1).permute(0, 2, 1, 3).reshape(B, N, -1)
         x = self.proj(x)
 
         return x
 
+    def get_rel_pos_tables(
+        self, q_size: Tuple[int, int], k_size: Tuple[int, int]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get the relative positional embeddings gathered for the query and key sizes.
+        The tables are cached in non-persistent buffers and rebuilt when the sizes, the
+        device, the dtype or the values of rel_pos_h and rel_pos_w change.
+        Args:
+            q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+            k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+
+        Returns:
+            Rh (Tensor): gathered embeddings (q_h, k_h, C) for height axis.
+            Rw (Tensor): gathered embeddings (q_w, k_w, C) for width axis.
+        """
+        grid_size = self.grid_size if self.grid_size is not None else (None, None)
+        if torch.is_grad_enabled() and (self.rel_pos_h.requires_grad or self.rel_pos_w.requires_grad):
+            # Do not cache tensors that are part of the autograd graph.
+            return (
+                get_rel_pos(q_size[0], k_size[0], slice_rel_pos(q_size[0], k_size[0], self.rel_pos_h, grid_size[0])),
+                get_rel_pos(q_size[1], k_size[1], slice_rel_pos(q_size[1], k_size[1], self.rel_pos_w, grid_size[1])),
+            )
+
+        key = (
+            tuple(q_size),
+            tuple(k_size),
+            grid_size,
+            self.rel_pos_h.device,
+            self.rel_pos_h.dtype,
+            self.rel_pos_h.data_ptr(),
+            self.rel_pos_h._version,
+            self.rel_pos_w.data_ptr(),
+            self.rel_pos_w._version,
+        )
+        if self.rel_pos_h_table is None or self.rel_pos_table_key != key:
+            rel_pos_h = slice_rel_pos(q_size[0], k_size[0], self.rel_pos_h.detach(), grid_size[0])
+            rel_pos_w = slice_rel_pos(q_size[1], k_size[1], self.rel_pos_w.detach(), grid_size[1])
+            self.rel_pos_h_table = get_rel_pos(q_size[0], k_size[0], rel_pos_h)
+            self.rel_pos_w_table = get_rel_pos(q_size[1], k_size[1], rel_pos_w)
+            self.rel_pos_table_key = key
+
+        return self.rel_pos_h_table, self.rel_pos_w_table
+
+
+def resize_pos_embed(pos_embed: torch.Tensor, size: Tuple[int, int]) -> torch.Tensor:
+    """
+    Resize absolute positional embeddings to the patch grid size if needed.
+    Args:
+        pos_embed (Tensor): absolute positional embeddings with [1, H, W, C].
+        size (Tuple): patch grid size (h, w).
+
+    Returns:
+        pos_embed: positional embeddings with [1, h, w, C].
+    """
+    if pos_embed.shape[1] == size[0] and pos_embed.shape[2] == size[1]:
+        return pos_embed
+
+    pos_embed = F.interpolate(pos_embed.permute(0, 3, 1, 2), size=size, mode="bicubic", align_corners=False)
+    return pos_embed.permute(0, 2, 3, 1)
+
 
 def window_partition(x: torch.Tensor, window_size: int) -> Tuple[torch.Tensor, Tuple[int, int]]:
     """
@@ -318,13 +548,44 @@ def get_rel_pos(q_size: int, k_size: int, rel_pos: torch.Tensor) -> torch.Tensor
         rel_pos_resized = rel_pos
 
     # Scale the coords with short length if shapes for q and k are different.
-    q_coords = torch.arange(q_size)[:, None] * max(k_size / q_size, 1.0)
-    k_coords = torch.arange(k_size)[None, :] * max(q_size / k_size, 1.0)
+    q_coords = torch.arange(q_size, device=rel_pos.device)[:, None] * max(k_size / q_size, 1.0)
+    k_coords = torch.arange(k_size, device=rel_pos.device)[None, :] * max(q_size / k_size, 1.0)
     relative_coords = (q_coords - k_coords) + (k_size - 1) * max(q_size / k_size, 1.0)
 
     return rel_pos_resized[relative_coords.long()]
 
 
+def slice_rel_pos(q_size: int, k_size: int, rel_pos: torch.Tensor, grid_size: Optional[int]) -> torch.Tensor:
+    """
+    Slice the relative positional embeddings of a square input to a smaller side of
+    a non-square input, keeping the embeddings of the relative positions in use.
+    Args:
+        q_size (int): size of query q.
+        k_size (int): size of key k.
+        rel_pos (Tensor): relative position embeddings (L, C).
+        grid_size (int or None): side of the square input grid. None to keep rel_pos.
+
+    Returns:
+        Relative position embeddings (L', C) for get_rel_pos.
+    """
+    max_rel_dist = int(2 * max(q_size, k_size) - 1)
+    grid_rel_dist = 2 * grid_size - 1 if grid_size is not None else max_rel_dist
+    if max_rel_dist >= grid_rel_dist:
+        return rel_pos
+
+    if rel_pos.shape[0] != grid_rel_dist:
+        # Interpolate rel pos to the square input grid first.
+        rel_pos = F.interpolate(
+            rel_pos.reshape(1, rel_pos.shape[0], -1).permute(0, 2, 1),
+            size=grid_rel_dist,
+            mode="linear",
+        )
+        rel_pos = rel_pos.reshape(-1, grid_rel_dist).permute(1, 0)
+    start = (grid_rel_dist - max_rel_dist) // 2
+
+    return rel_pos[start: start + max_rel_dist]
+
+
 def add_decomposed_rel_pos(
     attn: torch.Tensor,
     q: torch.Tensor,
@@ -339,8 +600,10 @@ def add_decomposed_rel_pos(
     Args:
         attn (Tensor): attention map.
         q (Tensor): query q in the attention layer with shape (B, q_h * q_w, C).
-        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis.
-        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis.
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis,
+            or embeddings (q_h, k_h, C) already gathered by get_rel_pos.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis,
+            or embeddings (q_w, k_w, C) already gathered by get_rel_pos.
         q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
         k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
 
@@ -349,19 +612,216 @@ def add_decomposed_rel_pos(
     """
     q_h, q_w = q_size
     k_h, k_w = k_size
-    Rh = get_rel_pos(q_h, k_h, rel_pos_h)
-    Rw = get_rel_pos(q_w, k_w, rel_pos_w)
+    rel_h, rel_w = get_decomposed_rel_pos(q, rel_pos_h, rel_pos_w, q_size, k_size)
+
+    B = q.shape[0]
+    attn = (
+        attn.view(B, q_h, q_w, k_h, k_w) + rel_h[:, :, :, :, None] + rel_w[:, :, :, None, :]
+    ).view(B, q_h * q_w, k_h * k_w)
+
+    return attn
+
+
+def get_decomposed_rel_pos(
+    q: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    q_size: Tuple[int, int],
+    k_size: Tuple[int, int],
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Calculate the height and width terms of decomposed Relative Positional Embeddings.
+    Args:
+        q (Tensor): query q in the attention layer with shape (B, q_h * q_w, C).
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis,
+            or embeddings (q_h, k_h, C) already gathered by get_rel_pos.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis,
+            or embeddings (q_w, k_w, C) already gathered by get_rel_pos.
+        q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+        k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+
+    Returns:
+        rel_h (Tensor): height terms with shape (B, q_h, q_w, k_h).
+        rel_w (Tensor): width terms with shape (B, q_h, q_w, k_w).
+    """
+    q_h, q_w = q_size
+    k_h, k_w = k_size
+    Rh = get_rel_pos(q_h, k_h, rel_pos_h) if rel_pos_h.dim() == 2 else rel_pos_h
+    Rw = get_rel_pos(q_w, k_w, rel_pos_w) if rel_pos_w.dim() == 2 else rel_pos_w
 
     B, _, dim = q.shape
     r_q = q.reshape(B, q_h, q_w, dim)
     rel_h = torch.einsum("bhwc,hkc->bhwk", r_q, Rh)
     rel_w = torch.einsum("bhwc,wkc->bhwk", r_q, Rw)
 
-    attn = (
-        attn.view(B, q_h, q_w, k_h, k_w) + rel_h[:, :, :, :, None] + rel_w[:, :, :, None, :]
-    ).view(B, q_h * q_w, k_h * k_w)
+    return rel_h, rel_w
 
-    return attn
+
+def get_decomposed_rel_pos_bias(
+    q: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    q_size: Tuple[int, int],
+    k_size: Tuple[int, int],
+) -> torch.Tensor:
+    """
+    Calculate decomposed Relative Positional Embeddings as an additive attention bias.
+    Args:
+        q (Tensor): query q in the attention layer with shape (B, q_h * q_w, C).
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis,
+            or embeddings (q_h, k_h, C) already gathered by get_rel_pos.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis,
+            or embeddings (q_w, k_w, C) already gathered by get_rel_pos.
+        q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+        k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+
+    Returns:
+        attn_bias (Tensor): attention bias with shape (B, q_h * q_w, k_h * k_w).
+    """
+    q_h, q_w = q_size
+    k_h, k_w = k_size
+    rel_h, rel_w = get_decomposed_rel_pos(q, rel_pos_h, rel_pos_w, q_size, k_size)
+
+    B = q.shape[0]
+    attn_bias = (rel_h[:, :, :, :, None] + rel_w[:, :, :, None, :]).reshape(B, q_h * q_w, k_h * k_w)
+
+    return attn_bias
+
+
+def scaled_dot_product_attention_rel_pos(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    size: Tuple[int, int],
+    chunk_size: int = 1024,
+) -> torch.Tensor:
+    """
+    Calculate scaled_dot_product_attention with decomposed Relative Positional Embeddings
+    as an additive attention bias. The bias is built for chunks of whole rows of queries,
+    with about chunk_size queries each, so that it is not (B, H * W, H * W) at once.
+    Args:
+        q (Tensor): query q with shape (B, H * W, C).
+        k (Tensor): key k with shape (B, H * W, C).
+        v (Tensor): value v with shape (B, H * W, C).
+        rel_pos_h (Tensor): embeddings (H, H, C) gathered by get_rel_pos for height axis.
+        rel_pos_w (Tensor): embeddings (W, W, C) gathered by get_rel_pos for width axis.
+        size (Tuple): spatial sequence size of query q and key k with (H, W).
+        chunk_size (int): number of queries per chunk.
+
+    Returns:
+        x (Tensor): output with shape (B, H * W, C).
+    """
+    H, W = size
+    rows = max(chunk_size // W, 1)
+    if rows >= H:
+        attn_bias = get_decomposed_rel_pos_bias(q, rel_pos_h, rel_pos_w, size, size)
+        return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_bias)
+
+    x = []
+    for h0 in range(0, H, rows):
+        h1 = min(h0 + rows, H)
+        q_chunk = q[:, h0 * W : h1 * W]
+        attn_bias = get_decomposed_rel_pos_bias(q_chunk, rel_pos_h[h0:h1], rel_pos_w, (h1 - h0, W), size)
+        x.append(F.scaled_dot_product_attention(q_chunk, k, v, attn_mask=attn_bias))
+
+    return torch.cat(x, dim=1)
+
+
+def get_merged_rel_pos_bias(
+    q: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    coords: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Calculate decomposed Relative Positional Embeddings between merged tokens.
+    Args:
+        q (Tensor): query q in the attention layer with shape (B * nHead, N, C).
+        rel_pos_h (Tensor): embeddings (H, H, C) gathered by get_rel_pos for height axis.
+        rel_pos_w (Tensor): embeddings (W, W, C) gathered by get_rel_pos for width axis.
+        coords (Tensor): grid coordinates (h, w) of the tokens with shape (B, N, 2).
+
+    Returns:
+        attn_bias (Tensor): attention bias with shape (B, nHead, N, N).
+    """
+    B, N, _ = coords.shape
+    r_q = q.reshape(B, -1, N, q.shape[-1])
+    h, w = coords[..., 0], coords[..., 1]
+    rel_h = torch.einsum("bhnc,bnkc->bhnk", r_q, rel_pos_h[h])
+    rel_w = torch.einsum("bhnc,bnkc->bhnk", r_q, rel_pos_w[w])
+
+    index_shape = (B, r_q.shape[1], N, N)
+    attn_bias = rel_h.gather(-1, h[:, None, None, :].expand(index_shape)) + rel_w.gather(
+        -1, w[:, None, None, :].expand(index_shape)
+    )
+
+    return attn_bias
+
+
+def bipartite_soft_matching_2d(
+    metric: torch.Tensor, hw: Tuple[int, int], r: int, sx: int = 2, sy: int = 2
+) -> Tuple[Callable, Callable, torch.Tensor, torch.Tensor]:
+    """
+    Token merging (ToMe) on a patch grid. One token of each sy x sx cell is a destination,
+    and the r source tokens most similar to a destination are merged into it.
+    Adapted from https://github.com/dbolya/tomesd.
+    Args:
+        metric (Tensor): tokens used for the similarity with shape (B, H * W, C).
+        hw (Tuple): patch grid size (H, W).
+        r (int): number of tokens to remove.
+        sx (int): cell width.
+        sy (int): cell height.
+
+    Returns:
+        merge (Callable): merges tokens (B, H * W, C) into (B, H * W - r, C).
+        unmerge (Callable): copies merged tokens (B, H * W - r, C) back to (B, H * W, C).
+        coords (Tensor): grid coordinates (h, w) of the merged tokens with shape (B, H * W - r, 2).
+        sizes (Tensor): number of tokens merged into each token with shape (B, H * W - r).
+    """
+    B, N, _ = metric.shape
+    H, W = hw
+    device = metric.device
+
+    is_dst = torch.zeros(H, W, dtype=torch.bool, device=device)
+    is_dst[: (H // sy) * sy: sy, : (W // sx) * sx: sx] = True
+    dst_ids = is_dst.flatten().nonzero().squeeze(1)
+    src_ids = (~is_dst).flatten().nonzero().squeeze(1)
+    r = min(r, src_ids.shape[0])
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        scores = metric.index_select(1, src_ids) @ metric.index_select(1, dst_ids).transpose(-1, -2)
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[:, r:]
+        src_idx = edge_idx[:, :r]
+        dst_idx = node_idx[..., None].gather(1, src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        C = x.shape[-1]
+        src, dst = x.index_select(1, src_ids), x.index_select(1, dst_ids)
+        unm = src.gather(1, unm_idx.expand(B, -1, C))
+        src = src.gather(1, src_idx.expand(B, r, C))
+        dst = dst.scatter_reduce(1, dst_idx.expand(B, r, C), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        C = x.shape[-1]
+        unm, dst = x[:, : unm_idx.shape[1]], x[:, unm_idx.shape[1]:]
+        out = x.new_empty(B, N, C)
+        out[:, dst_ids] = dst
+        out.scatter_(1, src_ids[unm_idx].expand(B, -1, C), unm)
+        out.scatter_(1, src_ids[src_idx].expand(B, r, C), dst.gather(1, dst_idx.expand(B, r, C)))
+        return out
+
+    ids = torch.cat([src_ids[unm_idx[..., 0]], dst_ids.expand(B, -1)], dim=1)
+    coords = torch.stack([ids // W, ids % W], dim=-1)
+    sizes = torch.ones(B, ids.shape[1], dtype=metric.dtype, device=device)
+    sizes[:, unm_idx.shape[1]:].scatter_add_(1, dst_idx[..., 0], torch.ones_like(dst_idx[..., 0], dtype=metric.dtype))
+
+    return merge, unmerge, coords, sizes
 
 
 class PatchEmbed(nn.Module):
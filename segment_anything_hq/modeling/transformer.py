@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import torch
+import torch.nn.functional as F
 from torch import Tensor, nn
 
 import math
@@ -22,6 +23,7 @@ class TwoWayTransformer(nn.Module):
         mlp_dim: int,
         activation: Type[nn.Module] = nn.ReLU,
         attention_downsample_rate: int = 2,
+        use_sdpa: bool = False,
     ) -> None:
         """
         A transformer decoder that attends to an input image using
@@ -34,6 +36,7 @@ class TwoWayTransformer(nn.Module):
             divide embedding_dim
           mlp_dim (int): the channel dimension internal to the MLP block
           activation (nn.Module): the activation to use in the MLP block
+          use_sdpa (bool): use scaled_dot_product_attention in the attention layers
         """
         super().__init__()
         self.depth = depth
@@ -51,14 +54,26 @@ class TwoWayTransformer(nn.Module):
                     activation=activation,
                     attention_downsample_rate=attention_downsample_rate,
                     skip_first_layer_pe=(i == 0),
+                    use_sdpa=use_sdpa,
                 )
             )
 
         self.final_attn_token_to_image = Attention(
-            embedding_dim, num_heads, downsample_rate=attention_downsample_rate
+            embedding_dim, num_heads, downsample_rate=attention_downsample_rate, use_sdpa=use_sdpa
         )
         self.norm_final_attn = nn.LayerNorm(embedding_dim)
 
+    def set_sdpa(self, enabled: bool) -> None:
+        """
+        Enable or disable scaled_dot_product_attention in the attention layers.
+
+        Args:
+          enabled (bool): use scaled_dot_product_attention in the attention layers
+        """
+        for module in self.modules():
+            if isinstance(module, Attention):
+                module.use_sdpa = enabled
+
     def forward(
         self,
         image_embedding: Tensor,
@@ -115,6 +130,7 @@ class TwoWayAttentionBlock(nn.Module):
         activation: Type[nn.Module] = nn.ReLU,
         attention_downsample_rate: int = 2,
         skip_first_layer_pe: bool = False,
+        use_sdpa: bool = False,
     ) -> None:
         """
         A transformer block with four layers: (1) self-attention of sparse
@@ -128,13 +144,14 @@ class TwoWayAttentionBlock(nn.Module):
           mlp_dim (int): the hidden dimension of the mlp block
           activation (nn.Module): the activation of the mlp block
           skip_first_layer_pe (bool): skip the PE on the first layer
+          use_sdpa (bool): use scaled_dot_product_attention in the attention layers
         """
         super().__init__()
-        self.self_attn = Attention(embedding_dim, num_heads)
+        self.self_attn = Attention(embedding_dim, num_heads, use_sdpa=use_sdpa)
         self.norm1 = nn.LayerNorm(embedding_dim)
 
         self.cross_attn_token_to_image = Attention(
-            embedding_dim, num_heads, downsample_rate=attention_downsample_rate
+            embedding_dim, num_heads, downsample_rate=attention_downsample_rate, use_sdpa=use_sdpa
         )
         self.norm2 = nn.LayerNorm(embedding_dim)
 
@@ -143,7 +160,7 @@ class TwoWayAttentionBlock(nn.Module):
 
         self.norm4 = nn.LayerNorm(embedding_dim)
         self.cross_attn_image_to_token = Attention(
-            embedding_dim, num_heads, downsample_rate=attention_downsample_rate
+            embedding_dim, num_heads, downsample_rate=attention_downsample_rate, use_sdpa=use_sdpa
         )
 
         self.skip_first_layer_pe = skip_first_layer_pe
@@ -193,6 +210,7 @@ class Attention(nn.Module):
         embedding_dim: int,
         num_heads: int,
         downsample_rate: int = 1,
+        use_sdpa: bool = False,
     ) -> None:
         super().__init__()
         self.embedding_dim = embedding_dim
@@ -205,6 +223,8 @@ class Attention(nn.Module):
         self.v_proj = nn.Linear(embedding_dim, self.internal_dim)
         self.out_proj = nn.Linear(self.internal_dim, embedding_dim)
 
+        self.use_sdpa = use_sdpa
+
     def _separate_heads(self, x: Tensor, num_heads: int) -> Tensor:
         b, n, c = x.shape
         x = x.reshape(b, n, num_heads, c // num_heads)
@@ -227,13 +247,17 @@ class Attention(nn.Module):
         v = self._separate_heads(v, self.num_heads)
 
         # Attention
-        _, _, _, c_per_head = q.shape
-        attn = q @ k.permute(0, 1, 3, 2)  # B x N_heads x N_tokens x N_tokens
-        attn = attn / math.sqrt(c_per_head)
-        attn = torch.softmax(attn, dim=-1)
+        if self.use_sdpa:
+            out = F.scaled_dot_product_attention(q, k, v)
+        else:
+            _, _, _, c_per_head = q.shape
+            attn = q @ k.permute(0, 1, 3, 2)  # B x N_heads x N_tokens x N_tokens
+            attn = attn / math.sqrt(c_per_head)
+            attn = torch.softmax(attn, dim=-1)
+
+            # Get output
+            out = attn @ v
 
-        # Get output
-        out = attn @ v
         out = self._recombine_heads(out)
         out = self.out_proj(out)
 
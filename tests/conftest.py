@@ -0,0 +1,6 @@
+import os
+import sys
+
+ia_basedir = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+if ia_basedir not in sys.path:
+    sys.path.insert(0, ia_basedir)
@@ -0,0 +1,52 @@
+import importlib
+
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+
+def predict(predictor, image, mask_input):
+    predictor.set_torch_image(image, tuple(image.shape[-2:]))
+    point_coords = torch.tensor([[[40.0, 60.0], [90.0, 30.0]]])
+    point_labels = torch.tensor([[1, 0]])
+    _, iou_predictions, low_res_logits = predictor.predict_torch(
+        point_coords, point_labels, mask_input=mask_input, multimask_output=True, return_logits=True)
+
+    return predictor.features, iou_predictions, low_res_logits
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_channels_last(package):
+    """The neck, the mask downscaling and the output upscaling in channels-last against NCHW."""
+    sam = build_tiny_sam(package)
+    predictor = importlib.import_module(package).SamPredictor(sam)
+    image = torch.randint(0, 256, (1, 3, 128, 128), generator=torch.Generator().manual_seed(0)).float()
+    mask_input = torch.randn(1, 1, 32, 32)
+
+    expected = predict(predictor, image, mask_input)
+    sam.set_channels_last(True)
+    actual = predict(predictor, image, mask_input)
+    sam.set_channels_last(False)
+
+    assert sam.image_encoder.neck[0].weight.is_contiguous()
+    for a, e in zip(actual, expected):
+        torch.testing.assert_close(a, e, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_layer_norm_2d(package):
+    """The fused layer norm of channels-last inputs against the per-channel statistics of NCHW inputs."""
+    common = importlib.import_module(f"{package}.modeling.common")
+    torch.manual_seed(0)
+    layer_norm = common.LayerNorm2d(16)
+    torch.nn.init.normal_(layer_norm.weight)
+    torch.nn.init.normal_(layer_norm.bias)
+    x = torch.randn(2, 16, 12, 10) * 3.0 + 1.0
+
+    expected = layer_norm(x)
+    layer_norm.channels_last = True
+    actual = layer_norm(x.contiguous(memory_format=torch.channels_last))
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
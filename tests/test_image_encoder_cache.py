@@ -0,0 +1,90 @@
+import importlib
+
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+
+def expected_rel_pos_tables(image_encoder, attn, q_size, k_size):
+    grid_size = attn.grid_size if attn.grid_size is not None else (None, None)
+    return (
+        image_encoder.get_rel_pos(q_size[0], k_size[0], image_encoder.slice_rel_pos(q_size[0], k_size[0], attn.rel_pos_h, grid_size[0])),
+        image_encoder.get_rel_pos(q_size[1], k_size[1], image_encoder.slice_rel_pos(q_size[1], k_size[1], attn.rel_pos_w, grid_size[1])),
+    )
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@pytest.mark.parametrize("block_index", [0, 1])
+@torch.no_grad()
+def test_rel_pos_tables(package, block_index):
+    """The cached tables of a windowed and a global block, reused and rebuilt when the sizes or the values change."""
+    image_encoder = importlib.import_module(f"{package}.modeling.image_encoder")
+    encoder = build_tiny_sam(package).image_encoder
+    encoder.set_img_size(96)
+    attn = encoder.blocks[block_index].attn
+    sizes = [(4, 4)] if block_index == 0 else [(6, 6), (4, 6)]
+
+    for size in sizes:
+        tables = attn.get_rel_pos_tables(size, size)
+        for actual, expected in zip(tables, expected_rel_pos_tables(image_encoder, attn, size, size)):
+            torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+        assert all(a is b for a, b in zip(attn.get_rel_pos_tables(size, size), tables))
+
+    attn.rel_pos_h.mul_(2.0)
+    size = sizes[-1]
+    for actual, expected in zip(attn.get_rel_pos_tables(size, size), expected_rel_pos_tables(image_encoder, attn, size, size)):
+        torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+def test_rel_pos_tables_grad(package):
+    """Tables are not cached while the embeddings take gradients."""
+    encoder = build_tiny_sam(package).image_encoder
+    attn = encoder.blocks[1].attn
+
+    Rh, Rw = attn.get_rel_pos_tables((8, 8), (8, 8))
+    (Rh.sum() + Rw.sum()).backward()
+
+    assert attn.rel_pos_h_table is None
+    assert attn.rel_pos_h.grad is not None and attn.rel_pos_w.grad is not None
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_pos_embed(package):
+    """The cached resized positional embeddings, reused and rebuilt when the size or the values change."""
+    image_encoder = importlib.import_module(f"{package}.modeling.image_encoder")
+    encoder = build_tiny_sam(package).image_encoder
+    torch.nn.init.normal_(encoder.pos_embed)
+
+    assert encoder.get_pos_embed((8, 8)) is encoder.pos_embed
+    for size in [(6, 6), (4, 6)]:
+        pos_embed = encoder.get_pos_embed(size)
+        torch.testing.assert_close(pos_embed, image_encoder.resize_pos_embed(encoder.pos_embed, size), rtol=0, atol=0)
+        assert encoder.get_pos_embed(size) is pos_embed
+
+    encoder.pos_embed.mul_(2.0)
+    torch.testing.assert_close(encoder.get_pos_embed((4, 6)), image_encoder.resize_pos_embed(encoder.pos_embed, (4, 6)), rtol=0, atol=0)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_image_encoder(package):
+    """The image encoder at a smaller input size with the caches, against the same encoder without them."""
+    encoder = build_tiny_sam(package).image_encoder
+    torch.nn.init.normal_(encoder.pos_embed)
+    encoder.set_img_size(96)
+    x = torch.randn(1, 3, 96, 96)
+
+    def run():
+        output = encoder(x)
+        return output[0] if isinstance(output, tuple) else output
+
+    cached = [run(), run()]
+
+    # The tables and the embeddings are not cached while taking gradients
+    with torch.enable_grad():
+        expected = run().detach()
+
+    for actual in cached:
+        torch.testing.assert_close(actual, expected, rtol=0, atol=0)
@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import create_synthetic_masks
+from inpalib import MaskSet, load_mask_set, save_mask_set
+
+
+@pytest.mark.parametrize("num_masks", [1, 60])
+def test_save_load(tmp_path, num_masks):
+    """A loaded mask set has the label map, the masks and the metadata of the saved one."""
+    mask_set = MaskSet.from_masks(create_synthetic_masks(96, num_masks))
+    file_path = str(tmp_path / "masks.npz")
+    metadata = dict(sam_id="sam_vit_b", image_hash="0123")
+
+    save_mask_set(mask_set, file_path, metadata)
+    loaded, loaded_metadata = load_mask_set(file_path)
+
+    assert loaded_metadata == metadata
+    assert len(loaded) == len(mask_set)
+    np.testing.assert_array_equal(loaded.label_map, mask_set.label_map)
+    np.testing.assert_array_equal(loaded.bboxes, mask_set.bboxes)
+    np.testing.assert_array_equal(loaded.areas, mask_set.areas)
+    for idx in range(len(mask_set)):
+        np.testing.assert_array_equal(loaded.get_mask(idx), mask_set.get_mask(idx))
+    assert [path.name for path in tmp_path.iterdir()] == ["masks.npz"]
+
+
+def test_unsupported_version(tmp_path):
+    file_path = str(tmp_path / "masks.npz")
+    save_mask_set(MaskSet.from_masks(create_synthetic_masks(32, 4)), file_path)
+    with np.load(file_path) as data:
+        arrays = dict(data.items())
+    header = json.loads(str(arrays["header"]))
+    header["version"] += 1
+    arrays["header"] = np.array(json.dumps(header))
+    np.savez_compressed(file_path, **arrays)
+
+    with pytest.raises(ValueError):
+        load_mask_set(file_path)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import create_synthetic_masks
+from inpalib import MaskIndex, MaskSet, create_mask_image
+
+
+@pytest.fixture
+def mask_set():
+    return MaskSet.from_masks(create_synthetic_masks(128, 40))
+
+
+def create_sketch(shape, seed):
+    rng = np.random.default_rng(seed)
+    sketch = np.zeros((*shape, 3), dtype=np.uint8)
+    for _ in range(3):
+        x, y = rng.integers(0, shape[1]), rng.integers(0, shape[0])
+        sketch[max(y - 2, 0):y + 3, max(x - 2, 0):x + 3] = 255
+
+    return sketch
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("ignore_black_chk", [True, False])
+def test_create_mask_image_with_index(mask_set, seed, ignore_black_chk):
+    """Selecting the masks under a sketch with the index gives the image of the label map lookup."""
+    sketch = create_sketch(mask_set.shape, seed)
+    expected = create_mask_image(sketch, mask_set, ignore_black_chk)
+    actual = create_mask_image(sketch, mask_set, ignore_black_chk, mask_index=MaskIndex(mask_set))
+
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_create_mask_image_with_other_index(mask_set):
+    other = MaskSet.from_masks(create_synthetic_masks(128, 10, seed=1))
+
+    with pytest.raises(ValueError):
+        create_mask_image(create_sketch(mask_set.shape, 0), mask_set, mask_index=MaskIndex(other))
+
+
+def test_masks_at_pixels(mask_set):
+    """The topmost masks at pixels are their labels, all the masks are those covering any of them."""
+    index = MaskIndex(mask_set)
+    rng = np.random.default_rng(0)
+    xs, ys = rng.integers(-4, 132, size=(2, 50))
+    inside = (xs >= 0) & (xs < 128) & (ys >= 0) & (ys < 128)
+
+    labels = np.unique(mask_set.label_map[ys[inside], xs[inside]])
+    assert index.masks_at_pixels(xs, ys) == (labels[labels > 0] - 1).tolist()
+    expected = sorted({idx for x, y in zip(xs[inside], ys[inside]) for idx in range(len(mask_set))
+                       if mask_set.get_mask(idx)[y, x]})
+    assert index.masks_at_pixels(xs, ys, all_masks=True) == expected
@@ -0,0 +1,38 @@
+import copy
+
+import numpy as np
+import pytest
+
+from benchmarks.mask_bench import legacy_close_open_masks, legacy_create_seg_color_image
+from benchmarks.synthetic import create_synthetic_masks
+from ia_mask_morphology import close_open_masks
+from inpalib import MaskSet, create_seg_color_image
+
+
+@pytest.mark.parametrize("num_masks", [1, 50, 300])
+def test_seg_color_image(num_masks):
+    """The label map colors against the per-pixel colormap lookup, for the lists of masks and mask sets."""
+    sam_masks = create_synthetic_masks(64, num_masks)
+    input_image = np.zeros((64, 64, 3), dtype=np.uint8)
+    expected = legacy_create_seg_color_image(input_image, sam_masks)
+
+    np.testing.assert_array_equal(create_seg_color_image(input_image, sam_masks), expected)
+    np.testing.assert_array_equal(create_seg_color_image(input_image, MaskSet.from_masks(sam_masks)), expected)
+
+
+@pytest.mark.parametrize("num_workers", [None, 1])
+@pytest.mark.parametrize("sizes", [(5, 5), (3, 7)])
+def test_close_open_masks(num_workers, sizes):
+    """Closing and opening within padded bounding boxes against full-frame masks, with the areas and boxes updated."""
+    sam_masks = create_synthetic_masks(96, 40)
+    expected = legacy_close_open_masks(sam_masks, *sizes)
+
+    actual = close_open_masks(copy.deepcopy(sam_masks), *sizes, num_workers=num_workers)
+
+    for sam_mask, mask in zip(actual, expected):
+        np.testing.assert_array_equal(sam_mask["segmentation"], mask)
+        assert sam_mask["area"] == int(mask.sum())
+        if sam_mask["area"] > 0:
+            ys, xs = np.nonzero(mask)
+            # SAM boxes in XYWH span from the first to the last pixel of the mask
+            assert list(sam_mask["bbox"]) == [xs.min(), ys.min(), xs.max() - xs.min(), ys.max() - ys.min()]
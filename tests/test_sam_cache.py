@@ -0,0 +1,30 @@
+import torch
+from tiny_sam import build_tiny_sam
+
+from ia_sam_cache import SamModelCache, get_tensors_size
+
+
+def encode(sam, x):
+    output = sam.image_encoder(x)
+    return output[0] if isinstance(output, tuple) else output
+
+
+@torch.no_grad()
+def test_share_tensors():
+    """A SAM-HQ model with the image encoder of a cached SAM model shares its storage, with the same outputs."""
+    sam = build_tiny_sam("segment_anything_fb", seed=0)
+    sam_hq = build_tiny_sam("segment_anything_hq", seed=1)
+    sam_hq.image_encoder.load_state_dict(sam.image_encoder.state_dict())
+    x = torch.randn(1, 3, 128, 128)
+    expected = encode(sam_hq, x)
+    separate_size = get_tensors_size([sam, sam_hq])
+
+    cache = SamModelCache()
+    cache.share_tensors(sam, torch.device("cpu"))
+    cache.share_tensors(sam_hq, torch.device("cpu"))
+
+    torch.testing.assert_close(encode(sam_hq, x), expected, rtol=0, atol=0)
+    # Other identical tensors, such as the initial layer norm weights, are shared too
+    assert get_tensors_size([sam, sam_hq]) <= separate_size - get_tensors_size([sam.image_encoder])
+    data_ptrs = {param.data_ptr() for param in sam.image_encoder.parameters()}
+    assert all(param.data_ptr() in data_ptrs for param in sam_hq.image_encoder.parameters())
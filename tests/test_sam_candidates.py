@@ -0,0 +1,60 @@
+import importlib
+
+import numpy as np
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+import inpalib
+from benchmarks.synthetic import create_synthetic_image
+from ia_sam_candidates import generate_sam_mask_candidates
+
+
+def test_generator_without_candidates():
+    with pytest.raises(ValueError):
+        generate_sam_mask_candidates(object(), np.zeros((8, 8, 3), dtype=np.uint8))
+
+
+def test_fast_sam_without_candidates():
+    with pytest.raises(ValueError):
+        inpalib.generate_sam_mask_candidates(np.zeros((8, 8, 3), dtype=np.uint8), "FastSAM-x.pt")
+
+
+def create_generator(package, sam, **kwargs):
+    return importlib.import_module(package).SamAutomaticMaskGenerator(model=sam, points_per_side=8, points_per_batch=32, **kwargs)
+
+
+def assert_same_masks(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        np.testing.assert_array_equal(a["segmentation"], e["segmentation"])
+        assert a["bbox"] == e["bbox"] and a["area"] == e["area"]
+        assert a["predicted_iou"] == pytest.approx(e["predicted_iou"])
+        assert a["stability_score"] == pytest.approx(e["stability_score"])
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_filter(package):
+    """Masks filtered from the candidates for other thresholds, against a generator with these thresholds."""
+    sam = build_tiny_sam(package)
+    # The masks of random weights are empty, larger hypernetwork outputs give masks with varied scores
+    for mlp in sam.mask_decoder.output_hypernetworks_mlps:
+        mlp.layers[-1].weight.mul_(100.0)
+        mlp.layers[-1].bias.mul_(100.0)
+    image = create_synthetic_image(128, aspect_ratio=4 / 3)
+    candidates = generate_sam_mask_candidates(create_generator(package, sam, pred_iou_thresh=0.0, stability_score_thresh=0.0), image)
+    assert len(candidates) > 0
+
+    # The masks of random weights cover most of the image, the NMS with an IoU cutoff of 1.0 keeps them all
+    iou_preds, stability_scores = candidates.mask_data["iou_preds"], candidates.mask_data["stability_score"]
+    settings = [
+        dict(pred_iou_thresh=0.0, stability_score_thresh=0.0, box_nms_thresh=1.0),
+        dict(pred_iou_thresh=max(float(np.median(iou_preds)), 0.0), stability_score_thresh=float(np.median(stability_scores)),
+             box_nms_thresh=1.0),
+        dict(pred_iou_thresh=max(float(np.quantile(iou_preds, 0.75)), 0.0), stability_score_thresh=0.0, box_nms_thresh=1.0,
+             min_mask_region_area=20),
+        dict(pred_iou_thresh=0.0, stability_score_thresh=0.0),
+    ]
+    for kwargs in settings:
+        assert_same_masks(candidates.filter(**kwargs), create_generator(package, sam, **kwargs).generate(image))
@@ -0,0 +1,45 @@
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+import ia_compile
+from ia_compile import compile_sam_encoder
+
+
+def encode(sam, x):
+    output = sam.image_encoder(x)
+    return output[0] if isinstance(output, tuple) else output
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_trace(package, tmp_path, monkeypatch):
+    """The traced image encoder against eager mode, traced on the first call and loaded from the cache by a new model."""
+    monkeypatch.setattr(ia_compile, "get_compile_cache_dir", lambda: str(tmp_path))
+    x = torch.randn(1, 3, 128, 128)
+    expected = encode(build_tiny_sam(package), x)
+
+    sam = compile_sam_encoder(build_tiny_sam(package), "trace", f"{package}_tiny")
+    torch.testing.assert_close(encode(sam, x), expected, rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(encode(sam, x), expected, rtol=1e-5, atol=1e-5)
+    assert len(list(tmp_path.glob(f"{package}_tiny_cpu_float32_1x3x128x128_*.pt"))) == 1
+
+    # A model with other weights loads the cached graph of the same model key
+    sam = compile_sam_encoder(build_tiny_sam(package, seed=1), "trace", f"{package}_tiny")
+    torch.testing.assert_close(encode(sam, x), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_trace_grad(tmp_path, monkeypatch):
+    """The eager forward is used while taking gradients."""
+    monkeypatch.setattr(ia_compile, "get_compile_cache_dir", lambda: str(tmp_path))
+    sam = compile_sam_encoder(build_tiny_sam("segment_anything_fb"), "trace", "segment_anything_fb_tiny")
+
+    encode(sam, torch.randn(1, 3, 128, 128)).sum().backward()
+
+    assert sam.image_encoder.patch_embed.proj.weight.grad is not None
+    assert not list(tmp_path.iterdir())
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        compile_sam_encoder(build_tiny_sam("segment_anything_fb"), "onnx", "segment_anything_fb_tiny")
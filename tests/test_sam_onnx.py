@@ -0,0 +1,34 @@
+import importlib
+
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+pytest.importorskip("onnxruntime")
+
+from ia_sam_onnx import OnnxSam, OnnxSamPredictor, export_sam_onnx  # noqa: E402
+
+
+def predict(predictor, image, **kwargs):
+    predictor.set_torch_image(image, (120, 96))
+    point_coords = torch.tensor([[[40.0, 60.0], [90.0, 30.0]], [[10.0, 20.0], [60.0, 100.0]]])
+    point_labels = torch.tensor([[1, 0], [1, 1]])
+    masks, iou_predictions, low_res_logits = predictor.predict_torch(point_coords, point_labels, return_logits=True, **kwargs)
+
+    return predictor.features, masks, iou_predictions, low_res_logits
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@pytest.mark.parametrize("multimask_output", [True, False])
+@torch.no_grad()
+def test_onnx_sam(package, multimask_output, tmp_path):
+    """The exported encoder and decoder on ONNX Runtime against the PyTorch predictor."""
+    sam = build_tiny_sam(package)
+    onnx_dir = export_sam_onnx(sam, str(tmp_path / "onnx"))
+    image = torch.randint(0, 256, (1, 3, 128, 102), generator=torch.Generator().manual_seed(0)).float()
+
+    expected = predict(importlib.import_module(package).SamPredictor(sam), image, multimask_output=multimask_output)
+    actual = predict(OnnxSamPredictor(OnnxSam(onnx_dir, num_threads=1)), image, multimask_output=multimask_output)
+
+    for a, e in zip(actual, expected):
+        torch.testing.assert_close(a, e, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,61 @@
+import importlib
+
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+from ia_sam_precision import apply_sam_precision, autocast_forward
+
+
+def predict_logits(package, sam, image):
+    predictor = importlib.import_module(package).SamPredictor(sam)
+    predictor.set_torch_image(image, tuple(image.shape[-2:]))
+    point_coords = torch.tensor([[[40.0, 60.0], [90.0, 30.0]]])
+    point_labels = torch.tensor([[1, 0]])
+    _, _, low_res_logits = predictor.predict_torch(point_coords, point_labels, multimask_output=True, return_logits=True)
+
+    return predictor.features, low_res_logits
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_bf16(package):
+    """bf16 mixed precision on CPU returns fp32 outputs close to fp32."""
+    image = torch.randint(0, 256, (1, 3, 128, 128), generator=torch.Generator().manual_seed(0)).float()
+    expected = predict_logits(package, build_tiny_sam(package), image)
+    sam = apply_sam_precision(build_tiny_sam(package), "bf16", torch.device("cpu"))
+    actual = predict_logits(package, sam, image)
+
+    for a, e in zip(actual, expected):
+        assert a.dtype == torch.float32
+        torch.testing.assert_close(a, e, rtol=0.05, atol=0.05)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+def test_fp32(package):
+    sam = build_tiny_sam(package)
+    forward = sam.image_encoder.forward
+
+    assert apply_sam_precision(sam, "fp32", torch.device("cpu")).image_encoder.forward == forward
+
+
+class OverflowModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.num_autocast_calls = 0
+
+    def forward(self, x):
+        if torch.is_autocast_cpu_enabled():
+            self.num_autocast_calls += 1
+            return x * float("inf")
+        return x * 2.0
+
+
+def test_overflow_fallback():
+    """A non-finite output is computed again in fp32, and autocast stays disabled for the module."""
+    module = autocast_forward(OverflowModule(), "cpu", torch.bfloat16)
+    x = torch.ones(2, 3)
+
+    torch.testing.assert_close(module(x), x * 2.0)
+    torch.testing.assert_close(module(x), x * 2.0)
+    assert module.num_autocast_calls == 1
@@ -0,0 +1,50 @@
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+import ia_sam_quantize
+from ia_sam_quantize import get_quantized_state_dict, load_quantized_state_dict, quantize_sam
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_quantized_state_dict(package, tmp_path):
+    """The plain tensor state dict loads with weights_only=True into a new quantized model with the same outputs."""
+    sam = quantize_sam(build_tiny_sam(package, seed=0))
+    path = tmp_path / "sam_dynamic_int8.pt"
+    torch.save(dict(state_dict=get_quantized_state_dict(sam)), path)
+
+    loaded = quantize_sam(build_tiny_sam(package, seed=1))
+    load_quantized_state_dict(loaded, torch.load(path, weights_only=True)["state_dict"])
+
+    x = torch.randn(1, 3, 128, 128)
+    expected, actual = sam.image_encoder(x), loaded.image_encoder(x)
+    if isinstance(expected, tuple):
+        expected, actual = expected[0], actual[0]
+    torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+
+
+def test_load_quantized_sam_cache(tmp_path, monkeypatch):
+    """The first load quantizes the checkpoint and writes the cache, the second one loads the cache only."""
+    checkpoint = tmp_path / "sam_tiny.pth"
+    torch.save(build_tiny_sam("segment_anything_fb").state_dict(), checkpoint)
+    checkpoints = []
+
+    def build(checkpoint=None):
+        checkpoints.append(checkpoint)
+        sam = build_tiny_sam("segment_anything_fb", seed=1)
+        if checkpoint is not None:
+            sam.load_state_dict(torch.load(checkpoint, weights_only=True))
+        return sam
+
+    cache_path = tmp_path / "sam_tiny_dynamic_int8.pt"
+    monkeypatch.setattr(ia_sam_quantize, "get_quantized_cache_path", lambda sam_checkpoint: str(cache_path))
+    quantized = ia_sam_quantize.load_quantized_sam(dict(tiny=build), "tiny", str(checkpoint))
+    assert cache_path.is_file()
+    cached = ia_sam_quantize.load_quantized_sam(dict(tiny=build), "tiny", str(checkpoint))
+    assert checkpoints == [str(checkpoint), None]
+
+    cached_state_dict = cached.state_dict()
+    for name, value in quantized.state_dict().items():
+        if isinstance(value, torch.Tensor):
+            torch.testing.assert_close(cached_state_dict[name], value, rtol=0, atol=0)
@@ -0,0 +1,107 @@
+import importlib
+
+import pytest
+import torch
+
+SAM_PACKAGES = ["segment_anything_fb", "segment_anything_hq", "mobile_sam"]
+
+
+def import_modeling(package, module):
+    return importlib.import_module(f"{package}.modeling.{module}")
+
+
+def randomize_rel_pos(model):
+    # relative positional embeddings are zero initialized, which would hide errors in the bias
+    for name, param in model.named_parameters():
+        if "rel_pos" in name:
+            torch.nn.init.normal_(param, std=0.5)
+
+
+def run_both(fn, set_sdpa):
+    set_sdpa(False)
+    expected = fn()
+    set_sdpa(True)
+    try:
+        actual = fn()
+    finally:
+        set_sdpa(False)
+
+    return actual, expected
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@pytest.mark.parametrize("chunk_size", [10 ** 6, 12, 32])
+@torch.no_grad()
+def test_rel_pos_attention(package, chunk_size):
+    """Global attention with the relative positional bias, unchunked and chunked by 1 and 3 rows of 10 tokens."""
+    image_encoder = import_modeling(package, "image_encoder")
+    torch.manual_seed(0)
+    attn = image_encoder.Attention(32, num_heads=4, use_rel_pos=True, input_size=(8, 10)).eval()
+    randomize_rel_pos(attn)
+    attn.sdpa_chunk_size = chunk_size
+    x = torch.randn(2, 8, 10, 32)
+
+    actual, expected = run_both(lambda: attn(x), lambda enabled: setattr(attn, "use_sdpa", enabled))
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@pytest.mark.parametrize("chunk_size", [10 ** 6, 5, 16])
+@torch.no_grad()
+def test_rel_pos_bias(package, chunk_size):
+    """The chunked attention bias against add_decomposed_rel_pos on the attention matrix."""
+    image_encoder = import_modeling(package, "image_encoder")
+    torch.manual_seed(0)
+    size = (6, 5)
+    q, k, v = torch.randn(3, 4, size[0] * size[1], 8).unbind(0)
+    rel_pos_h = image_encoder.get_rel_pos(size[0], size[0], torch.randn(2 * size[0] - 1, 8))
+    rel_pos_w = image_encoder.get_rel_pos(size[1], size[1], torch.randn(2 * size[1] - 1, 8))
+
+    attn = (q * q.shape[-1] ** -0.5) @ k.transpose(-2, -1)
+    attn = image_encoder.add_decomposed_rel_pos(attn, q, rel_pos_h, rel_pos_w, size, size)
+    expected = attn.softmax(dim=-1) @ v
+    actual = image_encoder.scaled_dot_product_attention_rel_pos(q, k, v, rel_pos_h, rel_pos_w, size, chunk_size)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@pytest.mark.parametrize("use_rel_pos", [True, False])
+@torch.no_grad()
+def test_image_encoder(package, use_rel_pos):
+    """Windowed blocks, padded to the window size, and global blocks, through ImageEncoderViT.set_sdpa."""
+    image_encoder = import_modeling(package, "image_encoder")
+    torch.manual_seed(0)
+    encoder = image_encoder.ImageEncoderViT(
+        img_size=80, patch_size=8, embed_dim=32, depth=2, num_heads=4, out_chans=16,
+        use_rel_pos=use_rel_pos, window_size=4, global_attn_indexes=(1,)).eval()
+    randomize_rel_pos(encoder)
+    for blk in encoder.blocks:
+        blk.attn.sdpa_chunk_size = 20
+    x = torch.randn(1, 3, 80, 80)
+
+    def run():
+        output = encoder(x)
+        return output[0] if isinstance(output, tuple) else output
+
+    actual, expected = run_both(run, lambda enabled: encoder.set_sdpa((0, 1) if enabled else ()))
+
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_two_way_transformer(package):
+    """Self attention, both cross attentions and the final attention of the mask decoder transformer."""
+    transformer = import_modeling(package, "transformer")
+    torch.manual_seed(0)
+    model = transformer.TwoWayTransformer(depth=2, embedding_dim=32, num_heads=4, mlp_dim=64).eval()
+    image_embedding = torch.randn(2, 32, 8, 8)
+    image_pe = torch.randn(2, 32, 8, 8)
+    point_embedding = torch.randn(2, 5, 32)
+
+    actual, expected = run_both(
+        lambda: torch.cat(model(image_embedding, image_pe, point_embedding), dim=1), model.set_sdpa)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,21 @@
+import pytest
+
+from ia_threading import model_access_decorator, model_access_sem
+
+
+def test_model_access_decorator():
+    @model_access_decorator
+    def run():
+        # The semaphore is held by the call
+        return model_access_sem.acquire(blocking=False)
+
+    assert run() is False
+    assert model_access_sem.acquire(blocking=False)
+    model_access_sem.release()
+
+
+def test_model_access_decorator_generator():
+    with pytest.raises(TypeError):
+        @model_access_decorator
+        def run():
+            yield
@@ -0,0 +1,29 @@
+import copy
+
+import torch
+
+from mobile_sam.modeling.tiny_vit_sam import TinyViT
+
+
+@torch.no_grad()
+def test_fuse_for_inference():
+    """TinyViT with folded Conv2d_BN pairs and precomputed attention biases against the unfused model."""
+    torch.manual_seed(0)
+    # the last stage keeps the 64 x 64 grid of the neck only with an output dim of 320, as in MobileSAM
+    model = TinyViT(
+        img_size=1024, embed_dims=[8, 16, 16, 320], depths=[1, 1, 2, 1], num_heads=[1, 2, 2, 4],
+        window_sizes=[7, 7, 14, 7], drop_path_rate=0.1).eval()
+    # batch norms are initialized to the identity, which would hide errors in the folding
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            torch.nn.init.normal_(module.weight)
+            torch.nn.init.normal_(module.bias)
+            module.running_mean.normal_()
+            module.running_var.uniform_(0.5, 2.0)
+    x = torch.randn(1, 3, 1024, 1024)
+
+    expected = model(x)
+    fused = copy.deepcopy(model).fuse_for_inference()
+
+    assert not any(isinstance(module, torch.nn.BatchNorm2d) for module in fused.modules())
+    torch.testing.assert_close(fused(x), expected, rtol=1e-4, atol=1e-4)
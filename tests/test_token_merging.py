@@ -0,0 +1,75 @@
+import importlib
+
+import pytest
+import torch
+from tiny_sam import SAM_PACKAGES, build_tiny_sam
+
+
+def encode(encoder, x):
+    output = encoder(x)
+    return output[0] if isinstance(output, tuple) else output
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_no_merged_tokens(package):
+    """Attention over reordered tokens with no merges, against the default forward of the global block."""
+    encoder = build_tiny_sam(package).image_encoder
+    x = torch.randn(2, 3, 128, 128)
+    expected = encode(encoder, x)
+
+    # 8 x 8 tokens, the ratio rounds down to no merged tokens
+    encoder.set_token_merging(0.01)
+    assert encoder.blocks[1].tome_ratio > 0
+
+    torch.testing.assert_close(encode(encoder, x), expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+@torch.no_grad()
+def test_merged_attention_sdpa(package):
+    """Attention over merged tokens with scaled_dot_product_attention, against the attention matrix."""
+    encoder = build_tiny_sam(package).image_encoder
+    encoder.set_token_merging(0.5)
+    x = torch.randn(2, 3, 128, 128)
+
+    encoder.set_sdpa(())
+    expected = encode(encoder, x)
+    encoder.set_sdpa((0, 1))
+    actual = encode(encoder, x)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+def test_bipartite_soft_matching(package):
+    """Merged tokens are the means of their sources, and are copied back to all of them."""
+    image_encoder = importlib.import_module(f"{package}.modeling.image_encoder")
+    torch.manual_seed(0)
+    H, W, r = 6, 8, 20
+    x = torch.randn(2, H * W, 16)
+
+    merge, unmerge, coords, sizes = image_encoder.bipartite_soft_matching_2d(x, (H, W), r)
+    merged = merge(x)
+    unmerged = unmerge(merged)
+
+    assert merged.shape == (2, H * W - r, 16)
+    torch.testing.assert_close(sizes.sum(dim=1), torch.full((2,), float(H * W)))
+    # Each token is unmerged from the token at its coordinates
+    ids = coords[..., 0] * W + coords[..., 1]
+    torch.testing.assert_close(unmerged.gather(1, ids[..., None].expand(-1, -1, 16)), merged)
+    # The sum over tokens weighted by sizes is kept by merging
+    torch.testing.assert_close((merged * sizes[..., None]).sum(dim=1), x.sum(dim=1), rtol=1e-5, atol=1e-5)
+    # Tokens without merges keep their values
+    single = sizes == 1
+    torch.testing.assert_close(merged[single], x.gather(1, ids[..., None].expand(-1, -1, 16))[single])
+
+
+@pytest.mark.parametrize("package", SAM_PACKAGES)
+def test_invalid_ratio(package):
+    encoder = build_tiny_sam(package).image_encoder
+
+    with pytest.raises(AssertionError):
+        encoder.set_token_merging({0: 0.5})
+    with pytest.raises(AssertionError):
+        encoder.set_token_merging(1.0)
@@ -0,0 +1,66 @@
+import importlib
+from functools import partial
+
+import torch
+
+SAM_PACKAGES = ["segment_anything_fb", "segment_anything_hq", "mobile_sam"]
+
+
+def build_tiny_sam(package_name, img_size=128, embed_dim=32, prompt_embed_dim=32, seed=0):
+    """Build a SAM model with the architecture of the ViT variants, small enough for unit tests.
+
+    Args:
+        package_name (str): SAM package, one of SAM_PACKAGES
+        img_size (int): input image size of the image encoder
+        embed_dim (int): embedding dimension of the image encoder
+        prompt_embed_dim (int): embedding dimension of the prompts and the mask decoder
+        seed (int): random seed for the weights
+
+    Returns:
+        Sam: SAM model in eval mode with random weights
+    """
+    modeling = importlib.import_module(f"{package_name}.modeling")
+    patch_size = 16
+    torch.manual_seed(seed)
+    decoder_kwargs = dict(
+        num_multimask_outputs=3,
+        transformer=modeling.TwoWayTransformer(depth=2, embedding_dim=prompt_embed_dim, mlp_dim=64, num_heads=4),
+        transformer_dim=prompt_embed_dim,
+        iou_head_depth=3,
+        iou_head_hidden_dim=32,
+    )
+    if hasattr(modeling, "MaskDecoderHQ"):
+        mask_decoder = modeling.MaskDecoderHQ(vit_dim=embed_dim, **decoder_kwargs)
+    else:
+        mask_decoder = modeling.MaskDecoder(**decoder_kwargs)
+    sam = modeling.Sam(
+        image_encoder=modeling.ImageEncoderViT(
+            depth=2,
+            embed_dim=embed_dim,
+            img_size=img_size,
+            mlp_ratio=2,
+            norm_layer=partial(torch.nn.LayerNorm, eps=1e-6),
+            num_heads=4,
+            patch_size=patch_size,
+            qkv_bias=True,
+            use_rel_pos=True,
+            global_attn_indexes=(1,),
+            window_size=4,
+            out_chans=prompt_embed_dim,
+        ),
+        prompt_encoder=modeling.PromptEncoder(
+            embed_dim=prompt_embed_dim,
+            image_embedding_size=(img_size // patch_size, img_size // patch_size),
+            input_image_size=(img_size, img_size),
+            mask_in_chans=16,
+        ),
+        mask_decoder=mask_decoder,
+        pixel_mean=[123.675, 116.28, 103.53],
+        pixel_std=[58.395, 57.12, 57.375],
+    )
+    # relative positional embeddings are zero initialized, which would hide errors in their use
+    for name, param in sam.named_parameters():
+        if "rel_pos" in name:
+            torch.nn.init.normal_(param, std=0.5)
+
+    return sam.eval()